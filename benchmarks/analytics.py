@@ -0,0 +1,130 @@
+# benchmarks/analytics.py
+"""lib.analytics (columnar fetch + NumPy) against the same metrics computed by looping over ORM objects.
+
+Run with: python -m benchmarks.analytics --scale 100000
+
+Each metric is computed both ways on the same synthetic fleet and the
+results are checked to agree before the timings are reported. The
+vectorized timings include loading the arrays, once per metric, as the
+CLI commands do.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+import sqlalchemy
+from lib.helpers import setup_database, dispose_engines
+from lib.models.vehicle import Vehicle
+from lib.models.payment import Payment
+from lib import analytics
+from benchmarks.datagen import generate
+
+AS_OF = datetime(2025, 6, 1)
+
+
+def _orm_payments(session):
+    return session.query(Payment).order_by(Payment.vehicle_id, Payment.payment_date).yield_per(1000)
+
+
+def orm_intervals(session):
+    gaps = defaultdict(list)
+    previous = None
+    for payment in _orm_payments(session):
+        if previous is not None and previous.vehicle_id == payment.vehicle_id:
+            gaps[payment.vehicle_id].append((payment.payment_date - previous.payment_date).total_seconds() / 86400)
+        previous = payment
+    return {id: round(sum(days) / len(days), 2) for id, days in gaps.items()}
+
+
+def orm_revenue(session):
+    revenue = defaultdict(int)
+    for payment in _orm_payments(session):
+        revenue[payment.payment_date.strftime('%Y-%m')] += payment.amount
+    return dict(revenue)
+
+
+def orm_overdue(session):
+    paid, last = defaultdict(int), {}
+    for payment in _orm_payments(session):
+        paid[payment.vehicle_id] += payment.amount
+        last[payment.vehicle_id] = payment.payment_date
+    cutoff = AS_OF - timedelta(days=analytics.OVERDUE_AFTER_DAYS)
+    return sorted(vehicle.id for vehicle in session.query(Vehicle).yield_per(1000)
+                  if vehicle.customer_id is not None and vehicle.price - paid[vehicle.id] > 0
+                  and (vehicle.id not in last or last[vehicle.id] < cutoff))
+
+
+def vectorized(session, metric):
+    payments = analytics.load_payments(session)
+    if metric == 'intervals':
+        return {r['vehicle_id']: r['mean_days'] for r in analytics.instalment_intervals(payments)}
+    if metric == 'revenue':
+        return {r['period']: r['revenue'] for r in analytics.revenue_by_period(payments)}
+    vehicles = analytics.load_vehicles(session)
+    return [r['vehicle_id'] for r in analytics.overdue_vehicles(payments, vehicles, AS_OF)]
+
+
+ORM = {'intervals': orm_intervals, 'revenue': orm_revenue, 'overdue': orm_overdue}
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def run(scale, seed):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    try:
+        session = setup_database(url)
+        counts = generate(session, scale, seed)
+        results = {}
+        for metric, orm in ORM.items():
+            session.expunge_all()
+            expected, orm_sec = timed(lambda: orm(session))
+            session.expunge_all()
+            actual, numpy_sec = timed(lambda: vectorized(session, metric))
+            if actual != expected:
+                raise SystemExit(f"{metric}: vectorized result differs from the ORM loop")
+            results[metric] = {'orm_sec': orm_sec, 'numpy_sec': numpy_sec, 'speedup': orm_sec / numpy_sec}
+            print(f"  {metric:<12} ORM loop {orm_sec:8.3f} s   NumPy {numpy_sec:8.3f} s   {orm_sec / numpy_sec:6.1f}x",
+                  file=sys.stderr)
+        return counts, results
+    finally:
+        dispose_engines()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100000, help='Number of vehicles in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    print(f"Generating {args.scale} vehicles (seed {args.seed})", file=sys.stderr)
+    counts, results = run(args.scale, args.seed)
+    document = json.dumps({
+        'meta': {'scale': args.scale, 'seed': args.seed, 'rows': counts, 'timestamp': datetime.now().isoformat(),
+                 'python': platform.python_version(), 'sqlalchemy': sqlalchemy.__version__, 'numpy': np.__version__},
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
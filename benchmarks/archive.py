@@ -0,0 +1,109 @@
+# benchmarks/archive.py
+"""Hot-table queries before and after archiving the payments of settled vehicles.
+
+Run with: python -m benchmarks.archive --scale 100000 --settled 0.6
+
+The synthetic fleet is aged into a mature book by marking a share of the
+sold vehicles fully paid (their price lowered to what they have paid).
+The collection queries (open vehicles' payment history and the overdue
+report) are timed, lib.archive moves every settled vehicle's payments out,
+and the same queries are timed again on the smaller payments table.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import text
+from lib.helpers import setup_database, dispose_engines
+from lib.models.vehicle import Vehicle
+from lib import reports
+from lib.archive import archive_payments
+from lib.models.cache import identity_cache
+from benchmarks.datagen import generate
+
+SAMPLE = 2000
+
+
+def _settle(session, share, seed):
+    sold = [id for (id,) in session.execute(text('SELECT id FROM vehicles WHERE payment_count > 0'))]
+    settled = random.Random(seed).sample(sold, int(len(sold) * share))
+    session.execute(text('UPDATE vehicles SET price_cents = total_paid_cents WHERE id = :id'),
+                    [{'id': id} for id in settled])
+    session.commit()
+    open_ids = sorted(set(sold) - set(settled))
+    return open_ids[::max(len(open_ids) // SAMPLE, 1)]
+
+
+def _collection_queries(session, open_ids):
+    # Both rounds start cold, so neither is served from the other's cached vehicles.
+    session.expunge_all()
+    identity_cache.clear()
+    started = time.perf_counter()
+    for id in open_ids:
+        Vehicle.find_by_id(session, id).get_payments(session)
+    history = time.perf_counter() - started
+    started = time.perf_counter()
+    overdue = sum(1 for _ in reports.vehicle_status(session, since=datetime(2024, 6, 1)))
+    return {'history_sec': history, 'status_report_sec': time.perf_counter() - started, 'status_rows': overdue}
+
+
+def _payment_rows(session):
+    return session.execute(text('SELECT COUNT(*) FROM payments')).scalar()
+
+
+def run(scale, settled, seed):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    try:
+        session = setup_database(url)
+        generate(session, scale, seed)
+        open_ids = _settle(session, settled, seed)
+        before = dict(_collection_queries(session, open_ids), payments=_payment_rows(session))
+        started = time.perf_counter()
+        moved = archive_payments(session, datetime.now())
+        archive_sec = time.perf_counter() - started
+        after = dict(_collection_queries(session, open_ids), payments=_payment_rows(session))
+        if after['status_rows'] != before['status_rows']:
+            raise SystemExit("the status report changed after archiving")
+        return {'before': before, 'after': after, 'archived': moved, 'archive_sec': archive_sec,
+                'payments_archived_per_sec': moved['archived'] / archive_sec if archive_sec else None}
+    finally:
+        dispose_engines()
+        stem = os.path.splitext(path)[0]
+        for name in (path, path + '-wal', path + '-shm', stem + '.archive.db'):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100000, help='Number of vehicles in the synthetic fleet')
+    parser.add_argument('--settled', type=float, default=0.6, help='Share of sold vehicles marked fully paid')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    print(f"Generating {args.scale} vehicles (seed {args.seed})", file=sys.stderr)
+    result = run(args.scale, args.settled, args.seed)
+    for label in ('before', 'after'):
+        timings = result[label]
+        print(f"  {label:<6} {timings['payments']:>9} hot payments   history {timings['history_sec']:7.3f} s"
+              f"   status report {timings['status_report_sec']:7.3f} s", file=sys.stderr)
+    print(f"  archived {result['archived']['archived']} payments of {result['archived']['vehicles']} vehicles"
+          f" in {result['archive_sec']:.2f} s", file=sys.stderr)
+    document = json.dumps({'meta': {'scale': args.scale, 'settled': args.settled, 'seed': args.seed,
+                                    'timestamp': datetime.now().isoformat()}, 'results': result}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
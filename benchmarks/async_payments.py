@@ -0,0 +1,144 @@
+# benchmarks/async_payments.py
+"""Concurrent payment posting through lib.aio against sequential blocking calls.
+
+Run with: python -m benchmarks.async_payments --scale 10000 --payments 2000 --concurrency 1 10 100
+Compare:  python -m benchmarks.async_payments --compare async.json
+
+Each async request opens its own AsyncSession, as a web handler would, and
+its latency includes time spent queued for a connection or the write lock.
+The mixed workload adds one balance read per payment to show reads
+proceeding while writes queue.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+import sqlalchemy
+from lib.helpers import setup_database, dispose_engines
+from lib.models.vehicle import Vehicle
+from lib.aio import async_session, dispose_async_engines, AsyncVehicle
+from benchmarks.datagen import generate
+from benchmarks.run import percentile, compare
+
+
+def summarize(latencies, elapsed):
+    latencies.sort()
+    return {
+        'ops': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def post_sequentially(session, targets):
+    latencies = []
+    started = time.perf_counter()
+    for vehicle_id, customer_id in targets:
+        call_started = time.perf_counter()
+        Vehicle.find_by_id(session, vehicle_id).add_payment(session, 1, customer_id)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def post_concurrently(url, targets, concurrency, reads=False):
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def request(operation):
+        async with slots:
+            call_started = time.perf_counter()
+            try:
+                async with async_session(url) as session:
+                    await operation(session)
+            except Exception as e:
+                errors.append(e)
+            latencies.append(time.perf_counter() - call_started)
+
+    operations = []
+    for vehicle_id, customer_id in targets:
+        operations.append(lambda s, v=vehicle_id, c=customer_id: AsyncVehicle.add_payment(s, v, 1, c))
+        if reads:
+            operations.append(lambda s, v=vehicle_id: AsyncVehicle.get_total_payments(s, v))
+    started = time.perf_counter()
+    await asyncio.gather(*(request(operation) for operation in operations))
+    result = summarize(latencies, time.perf_counter() - started)
+    result['errors'] = len(errors)
+    if errors:
+        print(f"    {len(errors)} failed requests, first: {errors[0]}", file=sys.stderr)
+    return result
+
+
+def run(scale, seed, payments, concurrency_levels):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    try:
+        session = setup_database(url)
+        counts = generate(session, scale, seed)
+        # Vehicles with room left for every one-unit payment this run will post.
+        targets = session.query(Vehicle.id, Vehicle.customer_id).filter(
+            Vehicle.customer_id != None, Vehicle.price - Vehicle.total_paid > payments).limit(payments).all()
+        targets = [tuple(target) for target in targets]
+        targets = (targets * (payments // len(targets) + 1))[:payments]
+
+        results = {'sync_sequential': post_sequentially(session, targets)}
+        session.close()
+
+        async def run_async():
+            for concurrency in concurrency_levels:
+                results[f'async_c{concurrency}'] = await post_concurrently(url, targets, concurrency)
+                results[f'async_mixed_c{concurrency}'] = await post_concurrently(url, targets, concurrency, reads=True)
+            await dispose_async_engines()
+        asyncio.run(run_async())
+
+        for name, result in results.items():
+            print(f"  {name:<24}{result['ops_per_sec']:>12.1f} ops/s  p50 {result['p50_ms']:.3f} ms"
+                  f"  p99 {result['p99_ms']:.3f} ms", file=sys.stderr)
+        return counts, results
+    finally:
+        dispose_engines()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=10000, help='Number of vehicles in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--payments', type=int, default=2000, help='Payments posted per run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100], help='In-flight request limits to try')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed ops/sec drop before flagging a regression')
+    args = parser.parse_args()
+
+    print(f"Generating {args.scale} vehicles (seed {args.seed})", file=sys.stderr)
+    counts, results = run(args.scale, args.seed, args.payments, args.concurrency)
+    document = {
+        'meta': {'scale': args.scale, 'seed': args.seed, 'payments': args.payments, 'rows': counts,
+                 'timestamp': datetime.now().isoformat(), 'python': platform.python_version(),
+                 'sqlalchemy': sqlalchemy.__version__},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    elif not args.compare:
+        print(json.dumps(document, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(document, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
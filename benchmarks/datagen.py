@@ -0,0 +1,89 @@
+# benchmarks/datagen.py
+"""Seeded synthetic fleet: dealerships, customers, vehicles and instalment payments.
+
+Distributions are loosely modelled on the real data: dealership sizes are
+skewed (a few hubs hold most of the stock), prices are log-normal around
+the mid-range EV price, about 70% of vehicles are sold, and sold vehicles
+carry a run of roughly monthly instalments that never exceed the price.
+"""
+import random
+from datetime import datetime, timedelta
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.customer import Customer
+from lib.models.payment import Payment
+from lib.models.money import from_cents
+
+CITIES = ['Nairobi', 'Lagos', 'Johannesburg', 'Cairo', 'Accra', 'Kigali', 'Kampala', 'Addis Ababa',
+          'Dar es Salaam', 'Casablanca', 'Cape Town', 'Mombasa', 'Abuja', 'Durban', 'Lusaka']
+MODELS = ['EV Bolt', 'EV Leaf', 'EV Kona', 'EV Ioniq', 'EV Model 3', 'EV ID.4', 'EV Zoe', 'EV e-tron',
+          'EV Taycan', 'EV Mach-E', 'EV Niro', 'EV EQA']
+SOLD_SHARE = 0.7
+INSTALMENTS = 36
+INSERT_CHUNK = 20000
+START_DATE = datetime(2023, 1, 1)
+
+
+def scale_counts(vehicles):
+    """Row counts for a fleet of the given size."""
+    return {
+        'dealerships': max(vehicles // 200, 1),
+        'customers': max(int(vehicles * 0.6), 1),
+        'vehicles': vehicles,
+    }
+
+
+def _insert(session, model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        session.execute(model.__table__.insert(), rows[start:start + INSERT_CHUNK])
+
+
+def generate(session, vehicles, seed=42):
+    """Populate an empty database through the current session and return the row counts."""
+    rng = random.Random(seed)
+    counts = scale_counts(vehicles)
+
+    _insert(session, Dealership, [
+        {'id': i, 'name': f"{rng.choice(CITIES)} EV Centre {i}", 'location': rng.choice(CITIES)}
+        for i in range(1, counts['dealerships'] + 1)])
+    _insert(session, Customer, [
+        {'id': i, 'name': f"Customer {i}", 'email': f"customer{i}@example.com"}
+        for i in range(1, counts['customers'] + 1)])
+
+    # Pareto weights give a long-tailed dealership size distribution.
+    weights = [rng.paretovariate(1.2) for _ in range(counts['dealerships'])]
+    dealership_ids = rng.choices(range(1, counts['dealerships'] + 1), weights=weights, k=vehicles)
+    vehicle_rows, payment_rows = [], []
+    payment_id = 0
+    for vehicle_id in range(1, vehicles + 1):
+        # Amounts are drawn in whole cents so the ledger total matches the payments exactly.
+        price = round(min(max(rng.lognormvariate(10.45, 0.35), 12000), 180000) * 100)
+        sold = rng.random() < SOLD_SHARE
+        customer_id = rng.randint(1, counts['customers']) if sold else None
+        total_paid, payment_count = 0, 0
+        if sold:
+            instalment = round(price / INSTALMENTS)
+            paid_date = START_DATE + timedelta(days=rng.randint(0, 540))
+            for _ in range(min(int(rng.expovariate(1 / 8)) + 1, INSTALMENTS)):
+                amount = min(round(instalment * rng.uniform(0.8, 1.2)), price - total_paid)
+                if amount <= 0:
+                    break
+                payment_id += 1
+                payment_rows.append({'id': payment_id, 'vehicle_id': vehicle_id, 'customer_id': customer_id,
+                                     'amount': from_cents(amount), 'payment_date': paid_date, 'status': "completed"})
+                total_paid += amount
+                payment_count += 1
+                paid_date += timedelta(days=rng.randint(25, 35))
+        vehicle_rows.append({'id': vehicle_id, 'model': rng.choice(MODELS), 'price': from_cents(price),
+                             'dealership_id': dealership_ids[vehicle_id - 1], 'customer_id': customer_id,
+                             'total_paid': from_cents(total_paid), 'payment_count': payment_count})
+        if len(payment_rows) >= INSERT_CHUNK:
+            # Vehicles go first so the payments' foreign keys resolve.
+            _insert(session, Vehicle, vehicle_rows)
+            _insert(session, Payment, payment_rows)
+            vehicle_rows, payment_rows = [], []
+    _insert(session, Vehicle, vehicle_rows)
+    _insert(session, Payment, payment_rows)
+    session.commit()
+    counts['payments'] = payment_id
+    return counts
@@ -0,0 +1,153 @@
+# benchmarks/http_load.py
+"""Requests per second and latency of the HTTP/JSON API (lib.server) under concurrent clients.
+
+Run with: python -m benchmarks.http_load --scale 10000 --clients 1 4 16 --seconds 5
+
+Starts `ev-african-motors serve` in a separate process on a synthetic fleet
+(or targets a running instance with --target http://host:port and
+--max-id N), then runs each client count for a fixed time. Every client
+keeps one keep-alive connection and loops over a mix of lookups, balance
+checks, conditional GETs of dealerships and pages of the vehicle listing.
+Reported per round: requests/sec, p50/p99 latency and non-2xx/304 errors.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+from lib.helpers import setup_database, dispose_engines
+from benchmarks.datagen import generate
+
+PAGE_LIMIT = 100
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_server(url, port):
+    environment = dict(os.environ, EV_DATABASE_URL=url)
+    environment.pop('EV_SHARD_MAP', None)
+    process = subprocess.Popen([sys.executable, '-m', 'lib.cli', 'serve', '--port', str(port)],
+                               env=environment, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("the server did not start")
+
+
+def _client(host, port, counts, seed, deadline, latencies, errors):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port)
+    etags = {}
+    while time.perf_counter() < deadline:
+        pick = rng.random()
+        headers = {}
+        if pick < 0.4:
+            path = f"/vehicles/{rng.randint(1, counts['vehicles'])}"
+        elif pick < 0.7:
+            path = f"/vehicles/{rng.randint(1, counts['vehicles'])}/balance"
+        elif pick < 0.9:
+            path = f"/dealerships/{rng.randint(1, counts['dealerships'])}"
+            if path in etags:
+                headers['If-None-Match'] = etags[path]
+        else:
+            path = f"/vehicles?after={rng.randint(0, max(counts['vehicles'] - PAGE_LIMIT, 0))}&limit={PAGE_LIMIT}"
+        started = time.perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+        if response.status not in (200, 304):
+            errors.append(response.status)
+    connection.close()
+
+
+def run_round(host, port, counts, clients, seconds):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=_client, args=(host, port, counts, n, deadline, latencies, errors))
+               for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {'clients': clients, 'requests': len(latencies), 'errors': len(errors),
+            'requests_per_sec': len(latencies) / wall,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p99_ms': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=10000, help='Number of vehicles in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16], help='Concurrent clients per round')
+    parser.add_argument('--seconds', type=float, default=5, help='Length of each round')
+    parser.add_argument('--target', help='URL of a running server instead of starting one')
+    parser.add_argument('--max-id', type=int, help='With --target: highest vehicle and dealership ID to request')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    process, path = None, None
+    if args.target:
+        if not args.max_id:
+            parser.error('--target needs --max-id')
+        target = urlsplit(args.target)
+        host, port = target.hostname, target.port or 80
+        counts = {'vehicles': args.max_id, 'dealerships': args.max_id}
+    else:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        url = f'sqlite:///{path}'
+        print(f"Generating {args.scale} vehicles (seed {args.seed})", file=sys.stderr)
+        counts = generate(setup_database(url), args.scale, args.seed)
+        dispose_engines()
+        host, port = '127.0.0.1', _free_port()
+        process = _start_server(url, port)
+    try:
+        results = []
+        for clients in args.clients:
+            result = run_round(host, port, counts, clients, args.seconds)
+            results.append(result)
+            print(f"  {clients:>3} clients: {result['requests_per_sec']:8.1f} req/s   p50 {result['p50_ms']:6.2f} ms"
+                  f"   p99 {result['p99_ms']:6.2f} ms   {result['errors']} errors", file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if path is not None:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    document = json.dumps({'meta': {'scale': args.scale, 'seconds': args.seconds, 'target': args.target,
+                                    'cpus': os.cpu_count(), 'timestamp': datetime.now().isoformat()},
+                           'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/indexes.py
+"""Time the indexed lookups with and without the version 2 indexes.
+
+Run with: python -m benchmarks.indexes --vehicles 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import func
+from lib.helpers import get_engine, setup_database, dispose_engines
+from lib.migrations import add_lookup_indexes, LOOKUP_INDEXES
+from benchmarks.datagen import generate
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.payment import Payment
+
+
+def drop_lookup_indexes(conn):
+    # Only the version 2 indexes; the others (e.g. the unique payment reference) aren't being measured.
+    for name in LOOKUP_INDEXES:
+        conn.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+
+
+def time_lookups(session, counts, samples, seed):
+    rng = random.Random(seed)
+    vehicle_ids = [rng.randint(1, counts['vehicles']) for _ in range(samples)]
+    customer_ids = [rng.randint(1, counts['customers']) for _ in range(samples)]
+    dealership_names = [name for (name,) in session.query(Dealership.name)]
+    names = [rng.choice(dealership_names).upper() for _ in range(samples)]
+    lookups = {
+        'total_payments': lambda i: session.query(func.sum(Payment.amount)).filter(Payment.vehicle_id == vehicle_ids[i]).scalar(),
+        'payments_by_date': lambda i: session.query(Payment).filter(Payment.vehicle_id == vehicle_ids[i]).order_by(Payment.payment_date).all(),
+        'customer_vehicles': lambda i: session.query(Vehicle.id).filter(Vehicle.customer_id == customer_ids[i]).all(),
+        'dealership_by_name': lambda i: Dealership.find_by_name(session, names[i]),
+    }
+    results = {}
+    for name, lookup in lookups.items():
+        started = time.perf_counter()
+        for i in range(samples):
+            lookup(i)
+        results[name] = (time.perf_counter() - started) / samples * 1000
+        session.expunge_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vehicles', type=int, default=100000)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    try:
+        session = setup_database(url)
+        counts = generate(session, args.vehicles, args.seed)
+        engine = get_engine(url)
+        # End the session's read transaction around each schema change, or its
+        # snapshot (and query plans) would still show the schema from before it.
+        session.commit()
+        with engine.begin() as conn:
+            drop_lookup_indexes(conn)
+        before = time_lookups(session, counts, args.samples, args.seed)
+        session.commit()
+        with engine.begin() as conn:
+            add_lookup_indexes(conn)
+        after = time_lookups(session, counts, args.samples, args.seed)
+        session.close()
+        print(f"{counts['vehicles']} vehicles, {counts['payments']} payments, {args.samples} lookups each")
+        print(f"{'lookup':<20}{'no index (ms)':>15}{'indexed (ms)':>15}{'speedup':>10}")
+        for name in before:
+            print(f"{name:<20}{before[name]:>15.3f}{after[name]:>15.3f}{before[name] / after[name]:>9.0f}x")
+    finally:
+        dispose_engines()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/parallel.py
+"""Fleet audit (ledger drift, owner mismatches, per-dealership and per-customer totals) serial vs multi-process.
+
+Run with: python -m benchmarks.parallel --scale 200000 --workers 1 2 4 8
+
+The serial baseline is what a full reconciliation cost before lib.parallel:
+Vehicle.reconcile_ledger plus the customer balance report. Each parallel
+round runs lib.parallel.audit_fleet, which computes all of that and more,
+and reports its speedup over the workers=1 round. About 5.7 payments are
+generated per vehicle, so --scale 200000 gives a little over a million
+payments. Speedup is bounded by the cores available (os.cpu_count() is
+recorded in the output) and by how much of the file the page cache holds.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+import sqlalchemy
+from lib.helpers import setup_database, dispose_engines
+from lib.models.vehicle import Vehicle
+from lib import reports
+from lib.parallel import audit_fleet
+from benchmarks.datagen import generate
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(scale, seed, workers_levels, repeat):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    try:
+        session = setup_database(url)
+        counts = generate(session, scale, seed)
+        results = {'serial': best_of(repeat, lambda: (Vehicle.reconcile_ledger(session, fix=False),
+                                                      list(reports.customer_balances(session))))}
+        for workers in workers_levels:
+            results[f'workers_{workers}'] = best_of(repeat, lambda: audit_fleet(session, workers))
+        base = results.get('workers_1', results['serial'])
+        for name, seconds in results.items():
+            print(f"  {name:<12}{seconds:>10.3f} s  speedup {base / seconds:5.2f}x", file=sys.stderr)
+        return counts, results
+    finally:
+        dispose_engines()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=200000, help='Number of vehicles in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker process counts to try')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is kept')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    print(f"Generating {args.scale} vehicles (seed {args.seed}) on {os.cpu_count()} CPUs", file=sys.stderr)
+    counts, results = run(args.scale, args.seed, args.workers, args.repeat)
+    document = json.dumps({
+        'meta': {'scale': args.scale, 'seed': args.seed, 'rows': counts, 'cpus': os.cpu_count(),
+                 'timestamp': datetime.now().isoformat(), 'python': platform.python_version(),
+                 'sqlalchemy': sqlalchemy.__version__},
+        'results_sec': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
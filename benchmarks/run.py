@@ -0,0 +1,209 @@
+# benchmarks/run.py
+"""Time the model and CLI hot paths against a synthetic fleet.
+
+Run with: python -m benchmarks.run --scale 10000 --output results.json
+Compare:  python -m benchmarks.run --scale 10000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import sqlalchemy
+from click.testing import CliRunner
+from lib.helpers import setup_database, dispose_engines
+from lib.models.vehicle import Vehicle
+from lib import reports
+from benchmarks.datagen import generate
+
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat):
+    """Register fn(ctx) -> op(i) as a benchmark run `repeat` times per scale."""
+    def register(fn):
+        BENCHMARKS[name] = (fn, repeat)
+        return fn
+    return register
+
+
+class Context:
+    def __init__(self, session, counts, seed):
+        self.session = session
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.sold_vehicle_ids = [id for (id,) in session.query(Vehicle.id).filter(
+            Vehicle.customer_id != None, Vehicle.total_paid < Vehicle.price).limit(10000)]
+        self.runner = CliRunner()
+
+
+def _random_vehicle(ctx):
+    return ctx.rng.randint(1, ctx.counts['vehicles'])
+
+
+@benchmark('vehicle_create', repeat=200)
+def bench_vehicle_create(ctx):
+    return lambda i: Vehicle.create(ctx.session, "EV Bench", 30000, ctx.rng.randint(1, ctx.counts['dealerships']))
+
+
+@benchmark('add_payment', repeat=200)
+def bench_add_payment(ctx):
+    def op(i):
+        vehicle = Vehicle.find_by_id(ctx.session, ctx.sold_vehicle_ids[i % len(ctx.sold_vehicle_ids)])
+        vehicle.add_payment(ctx.session, 1, vehicle.customer_id)
+    return op
+
+
+@benchmark('balance', repeat=1000)
+def bench_balance(ctx):
+    return lambda i: Vehicle.find_by_id(ctx.session, _random_vehicle(ctx)).get_remaining_balance(ctx.session)
+
+
+@benchmark('get_all', repeat=3)
+def bench_get_all(ctx):
+    def op(i):
+        Vehicle.get_all(ctx.session)
+        ctx.session.expunge_all()
+    return op
+
+
+@benchmark('iter_all', repeat=3)
+def bench_iter_all(ctx):
+    def op(i):
+        for _ in Vehicle.iter_all(ctx.session):
+            pass
+        ctx.session.expunge_all()
+    return op
+
+
+@benchmark('report_customer_balances', repeat=3)
+def bench_report_balances(ctx):
+    def op(i):
+        for _ in reports.customer_balances(ctx.session):
+            pass
+    return op
+
+
+@benchmark('cli_list_vehicles', repeat=3)
+def bench_cli_list_vehicles(ctx):
+    from lib.cli import cli
+    return lambda i: ctx.runner.invoke(cli, ['list-vehicles'])
+
+
+@benchmark('cli_list_vehicle_payments', repeat=200)
+def bench_cli_list_vehicle_payments(ctx):
+    from lib.cli import cli
+    return lambda i: ctx.runner.invoke(cli, ['list-vehicle-payments', '--vehicle_id', str(_random_vehicle(ctx))])
+
+
+def percentile(sorted_values, fraction):
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(op, repeat):
+    latencies = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - started)
+    # Peak memory comes from one extra traced call so tracing doesn't skew the timings.
+    tracemalloc.start()
+    op(repeat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'ops': repeat,
+        'ops_per_sec': repeat / total if total else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_mem_kb': peak / 1024,
+    }
+
+
+def run(scale, seed, only=None):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    previous_url = os.environ.get('EV_DATABASE_URL')
+    os.environ['EV_DATABASE_URL'] = url
+    try:
+        session = setup_database(url)
+        counts = generate(session, scale, seed)
+        ctx = Context(session, counts, seed)
+        results = {}
+        for name, (factory, repeat) in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            results[name] = measure(factory(ctx), repeat)
+            print(f"  {name:<28}{results[name]['ops_per_sec']:>12.1f} ops/s  p50 {results[name]['p50_ms']:.3f} ms"
+                  f"  p99 {results[name]['p99_ms']:.3f} ms  peak {results[name]['peak_mem_kb']:.0f} KiB", file=sys.stderr)
+        return counts, results
+    finally:
+        if previous_url is None:
+            os.environ.pop('EV_DATABASE_URL', None)
+        else:
+            os.environ['EV_DATABASE_URL'] = previous_url
+        dispose_engines()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def compare(current, baseline, threshold):
+    """Print per-benchmark throughput changes; return the names that regressed beyond threshold."""
+    regressions = []
+    print(f"{'benchmark':<28}{'baseline ops/s':>16}{'current ops/s':>16}{'change':>10}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before or not before['ops_per_sec']:
+            print(f"{name:<28}{'-':>16}{result['ops_per_sec']:>16.1f}{'new':>10}")
+            continue
+        change = result['ops_per_sec'] / before['ops_per_sec'] - 1
+        flag = '  REGRESSION' if change < -threshold else ''
+        print(f"{name:<28}{before['ops_per_sec']:>16.1f}{result['ops_per_sec']:>16.1f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=10000, help='Number of vehicles (10000, 100000, 1000000, ...)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', nargs='*', choices=sorted(BENCHMARKS), help='Run only these benchmarks')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed ops/sec drop before flagging a regression')
+    args = parser.parse_args()
+
+    print(f"Generating {args.scale} vehicles (seed {args.seed})", file=sys.stderr)
+    counts, results = run(args.scale, args.seed, args.only)
+    document = {
+        'meta': {'scale': args.scale, 'seed': args.seed, 'rows': counts, 'timestamp': datetime.now().isoformat(),
+                 'python': platform.python_version(), 'sqlalchemy': sqlalchemy.__version__},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    elif not args.compare:
+        print(json.dumps(document, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('scale') != args.scale:
+            print(f"Warning: baseline scale {baseline['meta'].get('scale')} differs from {args.scale}", file=sys.stderr)
+        if compare(document, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
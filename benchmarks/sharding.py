@@ -0,0 +1,120 @@
+# benchmarks/sharding.py
+"""Payment posting throughput with every region in one database against one shard per region.
+
+Run with: python -m benchmarks.sharding --regions 1 2 4 --payments 500
+
+Each round starts one writer process per region. Every writer posts
+payments to its own region's vehicles through the ShardRouter, first with
+all regions mapped to a single database and then with a database per
+region, and the total payments per second of each layout is reported.
+With one database the writers take turns on its file lock; with shards
+they only compete for CPU and disk.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+VEHICLES_PER_REGION = 20
+
+
+def _shard_map(directory, regions, sharded):
+    if sharded:
+        shards = {f'region{n}': {'url': f'sqlite:///{directory}/region{n}.db', 'block': n + 1} for n in range(regions)}
+        locations = {f'City {n}': f'region{n}' for n in range(regions)}
+    else:
+        shards = {'fleet': {'url': f'sqlite:///{directory}/fleet.db', 'block': 0}}
+        locations = {f'City {n}': 'fleet' for n in range(regions)}
+    path = os.path.join(directory, 'shards.json')
+    with open(path, 'w') as f:
+        json.dump({'shards': shards, 'locations': locations}, f)
+    return path
+
+
+def _setup(path, regions):
+    from lib.helpers import dispose_engines
+    from lib.models import Dealership, Customer, Vehicle
+    from lib.sharding import ShardMap, ShardRouter
+    router = ShardRouter(ShardMap.load(path))
+    fleets = []
+    for n in range(regions):
+        session = router.for_location(f'City {n}')
+        dealership = Dealership.create(session, f"Region {n} EV", f'City {n}')
+        fleet = []
+        for i in range(VEHICLES_PER_REGION):
+            customer = Customer.create(session, f"Customer {n}-{i}", f"customer{n}.{i}@example.com")
+            fleet.append((Vehicle.create(session, "EV Bench", 10 ** 9, dealership.id, customer.id).id, customer.id))
+        fleets.append(fleet)
+    router.close()
+    dispose_engines()
+    return fleets
+
+
+def _writer(path, fleet, payments, start):
+    from lib.helpers import dispose_engines
+    from lib.models import Vehicle
+    from lib.sharding import ShardMap, ShardRouter
+    router = ShardRouter(ShardMap.load(path))
+    session = router.for_id(fleet[0][0])
+    start.wait()
+    started = time.perf_counter()
+    for n in range(payments):
+        vehicle_id, customer_id = fleet[n % len(fleet)]
+        Vehicle.find_by_id(session, vehicle_id).add_payment(session, 10, customer_id)
+    elapsed = time.perf_counter() - started
+    router.close()
+    dispose_engines()
+    return elapsed
+
+
+def run(regions, payments, sharded):
+    directory = tempfile.mkdtemp()
+    try:
+        path = _shard_map(directory, regions, sharded)
+        fleets = _setup(path, regions)
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager:
+            start = manager.Event()
+            with context.Pool(regions) as pool:
+                pending = [pool.apply_async(_writer, (path, fleet, payments, start)) for fleet in fleets]
+                # Let every worker import and connect before the clock starts.
+                time.sleep(0.5)
+                started = time.perf_counter()
+                start.set()
+                for result in pending:
+                    result.get()
+                wall = time.perf_counter() - started
+        return {'regions': regions, 'layout': 'sharded' if sharded else 'single', 'payments': regions * payments,
+                'wall_sec': wall, 'payments_per_sec': regions * payments / wall}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--regions', type=int, nargs='+', default=[1, 2, 4], help='Regions (writer processes) per round')
+    parser.add_argument('--payments', type=int, default=500, help='Payments posted by each writer')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    results = []
+    for regions in args.regions:
+        for sharded in (False, True):
+            result = run(regions, args.payments, sharded)
+            results.append(result)
+            print(f"  {regions:>3} regions, {result['layout']:<7}: {result['payments_per_sec']:8.1f} payments/s",
+                  file=sys.stderr)
+    document = json.dumps({'meta': {'cpus': os.cpu_count()}, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# benchmarks/startup.py
+"""Time cold starts of the ev-african-motors entry point in fresh interpreters.
+
+Run with: python -m benchmarks.startup --runs 20 --output startup.json
+Compare:  python -m benchmarks.startup --compare startup.json --threshold 0.20
+Budget:   python -m benchmarks.startup --max-ms 150   # exits 1 if --help starts slower
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ENTRY_POINT = 'from lib.cli import main; main()'
+
+# name -> (CLI arguments, stdin)
+CASES = {
+    'python': (None, None),
+    'help': (['--help'], None),
+    'command_help': (['list-vehicles', '--help'], None),
+    'menu_exit': ([], '17\n'),
+    'list_dealerships': (['list-dealerships', '--limit', '1'], None),
+}
+
+
+def _command(args):
+    if args is None:
+        return [sys.executable, '-c', 'pass']
+    return [sys.executable, '-c', ENTRY_POINT] + args
+
+
+def time_case(args, stdin, runs, env):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(_command(args), input=stdin or '', cwd=ROOT, env=env, text=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {'runs': runs, 'min_ms': timings[0], 'median_ms': timings[len(timings) // 2],
+            'p90_ms': timings[min(int(len(timings) * 0.9), len(timings) - 1)]}
+
+
+def import_profile(top=10):
+    """Modules with the largest cumulative import time for `import lib.cli`, from -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import lib.cli'], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if match:
+            modules.append((int(match.group(2)) / 1000, match.group(4)))
+    loaded = {name.split('.')[0] for _, name in modules}
+    return {'sqlalchemy_loaded': 'sqlalchemy' in loaded,
+            'slowest': [{'module': name, 'cumulative_ms': ms} for ms, name in sorted(modules, reverse=True)[:top]]}
+
+
+def run(runs, only=None):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    env = dict(os.environ, EV_DATABASE_URL=f'sqlite:///{path}')
+    try:
+        # Create and stamp the schema once so list_dealerships measures a warm database.
+        subprocess.run(_command(['migrate']), cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+        results = {}
+        for name, (args, stdin) in CASES.items():
+            if only and name not in only:
+                continue
+            results[name] = time_case(args, stdin, runs, env)
+            print(f"  {name:<20}median {results[name]['median_ms']:8.1f} ms  p90 {results[name]['p90_ms']:8.1f} ms"
+                  f"  min {results[name]['min_ms']:8.1f} ms", file=sys.stderr)
+        return results
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def compare(current, baseline, threshold):
+    """Print per-case median changes; return the names that slowed down beyond threshold."""
+    regressions = []
+    print(f"{'case':<20}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            print(f"{name:<20}{'-':>14}{result['median_ms']:>14.1f}{'new':>10}")
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{name:<20}{before['median_ms']:>14.1f}{result['median_ms']:>14.1f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help='Process starts per case')
+    parser.add_argument('--only', nargs='*', choices=sorted(CASES), help='Run only these cases')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.20, help='Allowed median slowdown before flagging a regression')
+    parser.add_argument('--max-ms', type=float, default=None, help='Fail if the median --help start exceeds this many ms')
+    args = parser.parse_args()
+
+    results = run(args.runs, args.only)
+    document = {
+        'meta': {'runs': args.runs, 'timestamp': datetime.now().isoformat(), 'python': platform.python_version()},
+        'imports': import_profile(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    elif not args.compare:
+        print(json.dumps(document, indent=2))
+    failed = False
+    if document['imports']['sqlalchemy_loaded']:
+        print("Regression: importing lib.cli loads SQLAlchemy", file=sys.stderr)
+        failed = True
+    if args.max_ms is not None and 'help' in results and results['help']['median_ms'] > args.max_ms:
+        print(f"Regression: --help median {results['help']['median_ms']:.1f} ms exceeds {args.max_ms:.1f} ms", file=sys.stderr)
+        failed = True
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failed = bool(compare(document, baseline, args.threshold)) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# benchmarks/stress_payments.py
+"""Post payments from several processes at once and check nothing was lost, duplicated or overpaid.
+
+Run with: python -m benchmarks.stress_payments --writers 1 2 4 8 --payments 200
+
+Every writer posts fixed-size instalments to a small pool of vehicles, so
+writers contend for the same rows and some postings hit the balance guard
+once a vehicle is paid off. Afterwards the payments table must match what
+the writers say they posted, every vehicle's ledger must match its
+payments, and no vehicle may be paid past its price. Exits 1 otherwise.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+
+def _writer(url, vehicle_ids, customer_ids, payments, amount, seed, start):
+    from lib.helpers import setup_database, dispose_engines
+    from lib.models.vehicle import Vehicle
+    session = setup_database(url)
+    rng = random.Random(seed)
+    posted, guarded, errors = [], 0, []
+    start.wait()
+    started = time.perf_counter()
+    for _ in range(payments):
+        index = rng.randrange(len(vehicle_ids))
+        try:
+            vehicle = Vehicle.find_by_id(session, vehicle_ids[index])
+            posted.append(vehicle.add_payment(session, amount, customer_ids[index]).id)
+        except ValueError as e:
+            if "exceeds remaining balance" not in str(e):
+                errors.append(str(e))
+            guarded += 1
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+    elapsed = time.perf_counter() - started
+    session.close()
+    dispose_engines()
+    return posted, guarded, errors, elapsed
+
+
+def _setup(url, vehicles, price):
+    from lib.helpers import setup_database, dispose_engines
+    from lib.models import Dealership, Customer, Vehicle
+    session = setup_database(url)
+    dealership = Dealership.create(session, "Stress EV", "Nairobi")
+    vehicle_ids, customer_ids = [], []
+    for i in range(vehicles):
+        customer = Customer.create(session, f"Stress Customer {i}", f"stress{i}@example.com")
+        vehicle_ids.append(Vehicle.create(session, "EV Stress", price, dealership.id, customer.id).id)
+        customer_ids.append(customer.id)
+    dispose_engines()
+    return vehicle_ids, customer_ids
+
+
+def _verify(url, posted, vehicle_ids):
+    from lib.helpers import setup_database, dispose_engines
+    from lib.models import Vehicle, Payment
+    session = setup_database(url)
+    problems = []
+    stored = [id for (id,) in session.query(Payment.id)]
+    if sorted(stored) != sorted(posted):
+        problems.append(f"{len(stored)} payments stored, {len(posted)} reported posted")
+    duplicates = [id for id, count in Counter(posted).items() if count > 1]
+    if duplicates:
+        problems.append(f"payment ids reported twice: {duplicates[:10]}")
+    drift = Vehicle.reconcile_ledger(session, fix=False)
+    if drift:
+        problems.append(f"{len(drift)} vehicles whose ledger disagrees with their payments")
+    overpaid = session.query(Vehicle.id).filter(Vehicle.id.in_(vehicle_ids), Vehicle.total_paid > Vehicle.price).count()
+    if overpaid:
+        problems.append(f"{overpaid} vehicles paid past their price")
+    dispose_engines()
+    return problems
+
+
+def run(writers, payments, vehicles=5, price=None, amount=10.0, seed=42):
+    """Run one stress round with `writers` processes; return a result dict including any problems found."""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    # By default the vehicles can absorb about 3/4 of the attempts, so the balance guard is exercised.
+    price = price if price is not None else amount * max(writers * payments * 3 // (4 * vehicles), 1)
+    try:
+        vehicle_ids, customer_ids = _setup(url, vehicles, price)
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager:
+            start = manager.Event()
+            with context.Pool(writers) as pool:
+                pending = [pool.apply_async(_writer, (url, vehicle_ids, customer_ids, payments, amount, seed + n, start))
+                           for n in range(writers)]
+                # Let every worker import and connect before the clock starts.
+                time.sleep(0.5)
+                started = time.perf_counter()
+                start.set()
+                outcomes = [result.get() for result in pending]
+                wall = time.perf_counter() - started
+        posted = [id for outcome in outcomes for id in outcome[0]]
+        errors = [error for outcome in outcomes for error in outcome[2]]
+        problems = _verify(url, posted, vehicle_ids) + [f"writer error: {error}" for error in errors[:10]]
+        return {
+            'writers': writers,
+            'attempts': writers * payments,
+            'posted': len(posted),
+            'guarded': sum(outcome[1] for outcome in outcomes),
+            'errors': len(errors),
+            'wall_sec': wall,
+            'payments_per_sec': len(posted) / wall if wall else 0.0,
+            'problems': problems,
+        }
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4, 8], help='Concurrent writer processes per round')
+    parser.add_argument('--payments', type=int, default=200, help='Payments attempted by each writer')
+    parser.add_argument('--vehicles', type=int, default=5, help='Vehicles the writers contend for')
+    parser.add_argument('--output', help='Write results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    results = []
+    for writers in args.writers:
+        result = run(writers, args.payments, args.vehicles)
+        results.append(result)
+        print(f"  {writers:>3} writers: {result['posted']:>6} posted, {result['guarded']:>6} refused by the balance guard,"
+              f" {result['errors']} errors, {result['payments_per_sec']:8.1f} payments/s"
+              f"{'  FAILED: ' + '; '.join(result['problems']) if result['problems'] else ''}", file=sys.stderr)
+    document = json.dumps({'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+    if any(result['problems'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
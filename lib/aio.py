@@ -0,0 +1,157 @@
+# lib/aio.py
+"""Async model API: AsyncSession over sqlite+aiosqlite, sharing the declarative models.
+
+Requires the optional aiosqlite driver (pip install ev_african_motors[async]).
+
+    async with async_session() as session:
+        dealership = await AsyncDealership.create(session, "Lagos EV Centre", "Lagos")
+        payment = await AsyncVehicle.add_payment(session, vehicle_id, 500, customer_id)
+
+Writes and lookups run the synchronous model methods on the AsyncSession's
+sync facade (AsyncSession.run_sync), so validation, the payment ledger and
+the identity cache behave exactly as they do for blocking callers, while
+the event loop is free during every database round trip.
+
+SQLite has a single writer, so writes from this process queue on one
+asyncio.Lock per engine instead of racing each other into "database is
+locked" errors; reads are not serialized. A write that still finds the
+database locked (by another process) is retried here with asyncio.sleep
+between attempts, rather than by the models' retry_on_busy, whose
+time.sleep would block the event loop.
+
+Sessions are created with expire_on_commit=False so returned objects stay
+readable after the commit inside each operation. Attributes that were
+never loaded (relationships, or total_paid right after add_payment) must
+still be fetched with an awaited query rather than by attribute access.
+"""
+import asyncio
+import os
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from lib.helpers import DATABASE_URL, get_engine, _create_engine
+from lib.models.money import ZERO
+from lib.models.locking import BUSY_RETRIES, backoff, is_busy
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.customer import Customer
+
+_engines = {}
+_sessionmakers = {}
+_write_locks = {}
+
+
+def async_url(url):
+    """The aiosqlite form of a SQLite URL; other URLs are assumed to name an async driver already."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite':
+        parsed = parsed.set(drivername='sqlite+aiosqlite')
+    return parsed
+
+
+def get_async_engine(url=None, **options):
+    """Return the process-wide AsyncEngine for url, migrating the schema through the sync engine first."""
+    url = url or os.environ.get('EV_DATABASE_URL') or DATABASE_URL
+    engine = _engines.get(url)
+    if engine is None:
+        target = async_url(url)
+        if target.database in (None, '', ':memory:'):
+            raise ValueError("The async API needs a file database; each aiosqlite connection to :memory: is a new database")
+        if target.get_backend_name() == 'sqlite':
+            try:
+                import aiosqlite  # noqa: F401
+            except ImportError as e:
+                raise RuntimeError("The async API needs aiosqlite: pip install ev_african_motors[async]") from e
+        # Schema migrations are synchronous; run them once on the shared sync engine.
+        get_engine(url)
+        engine = _create_engine(target, factory=create_async_engine, **options)
+        _engines[url] = engine
+    return engine
+
+
+def async_session(url=None):
+    """A new AsyncSession on the engine for url; use as `async with async_session() as session:`."""
+    engine = get_async_engine(url)
+    factory = _sessionmakers.get(engine)
+    if factory is None:
+        factory = _sessionmakers[engine] = async_sessionmaker(engine, expire_on_commit=False)
+    return factory()
+
+
+async def dispose_async_engines():
+    """Close every pooled async connection and forget the registered async engines."""
+    engines = list(_engines.values())
+    _engines.clear()
+    _sessionmakers.clear()
+    _write_locks.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+async def run_write(session, fn, *args, **kwargs):
+    """session.run_sync(fn, ...) while holding the engine's write lock, retried while the database is busy."""
+    lock = _write_locks.get(session.bind)
+    if lock is None:
+        lock = _write_locks[session.bind] = asyncio.Lock()
+    async with lock:
+        for attempt in range(BUSY_RETRIES + 1):
+            if session.in_transaction():
+                # End any read transaction first: its snapshot may predate another
+                # writer's commit, and SQLite refuses to upgrade a stale snapshot.
+                await session.commit()
+            try:
+                return await session.run_sync(fn, *args, **kwargs)
+            except OperationalError as e:
+                if not is_busy(e) or attempt == BUSY_RETRIES:
+                    raise
+                await session.rollback()
+            await asyncio.sleep(backoff(attempt))
+
+
+class _AsyncModel:
+    model = None
+
+    @classmethod
+    async def create(cls, session, *args, **kwargs):
+        return await run_write(session, cls.model.create, *args, **kwargs)
+
+    @classmethod
+    async def delete(cls, session, id):
+        return await run_write(session, cls.model.delete, id)
+
+    @classmethod
+    async def find_by_id(cls, session, id):
+        return await session.run_sync(cls.model.find_by_id, id)
+
+    @classmethod
+    async def get_all(cls, session):
+        return await session.run_sync(cls.model.get_all)
+
+
+class AsyncDealership(_AsyncModel):
+    model = Dealership
+
+
+class AsyncCustomer(_AsyncModel):
+    model = Customer
+
+
+def _add_payment(session, vehicle_id, amount, customer_id, payment_date):
+    vehicle = Vehicle.find_by_id(session, vehicle_id)
+    if not vehicle:
+        raise ValueError(f"Vehicle with ID {vehicle_id} not found")
+    return vehicle.add_payment(session, amount, customer_id, payment_date)
+
+
+class AsyncVehicle(_AsyncModel):
+    model = Vehicle
+
+    @classmethod
+    async def add_payment(cls, session, vehicle_id, amount, customer_id, payment_date=None):
+        return await run_write(session, _add_payment, vehicle_id, amount, customer_id, payment_date)
+
+    @classmethod
+    async def get_total_payments(cls, session, vehicle_id):
+        total = await session.scalar(select(Vehicle.total_paid).where(Vehicle.id == vehicle_id))
+        return total or ZERO
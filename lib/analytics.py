@@ -0,0 +1,234 @@
+# lib/analytics.py
+"""Vectorized payment analytics over NumPy arrays.
+
+Requires the optional numpy dependency (pip install ev_african_motors[analytics]).
+
+load_payments() fetches vehicle_id, customer_id, amount (in cents) and
+payment time for every payment, those moved to the archive database by
+lib.archive included, in one raw query ordered by vehicle and date, into
+int64 arrays; load_vehicles() does the same for vehicles. Every series
+below therefore covers the whole payment history the ledger sums. The
+functions below then work on whole arrays: per-vehicle groups are
+contiguous runs reduced with np.add.reduceat and friends, other group-bys
+use np.bincount over dense group indexes, and nothing is done per row in
+Python. Amounts stay integer cents throughout and are converted to Decimal
+only in the rows handed to callers.
+"""
+from datetime import datetime, timedelta
+from itertools import chain
+from sqlalchemy import func, select, cast, union_all, Integer
+from lib.models.vehicle import Vehicle
+from lib.models.payment import Payment
+from lib.models.archive import archived_payments, attach_archive
+from lib.models.money import cents, from_cents
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("lib.analytics needs numpy: pip install ev_african_motors[analytics]") from e
+
+SECONDS_PER_DAY = 86400
+NO_CUSTOMER = -1
+PERIODS = {'day': 'datetime64[D]', 'month': 'datetime64[M]', 'year': 'datetime64[Y]'}
+OVERDUE_AFTER_DAYS = 30
+
+INTERVAL_FIELDS = ['vehicle_id', 'payments', 'mean_days', 'min_days', 'max_days']
+REVENUE_FIELDS = ['period', 'payments', 'revenue']
+VELOCITY_FIELDS = ['customer_id', 'paid', 'outstanding', 'paid_per_day', 'days_to_payoff', 'forecast_payoff']
+OVERDUE_FIELDS = ['vehicle_id', 'customer_id', 'outstanding', 'last_payment', 'days_since']
+BALANCE_FIELDS = ['vehicle_id', 'customer_id', 'payment_date', 'amount', 'balance']
+
+
+class Payments:
+    """Parallel int64 arrays, one entry per payment, sorted by (vehicle_id, time)."""
+
+    def __init__(self, vehicle_id, customer_id, amount_cents, time):
+        self.vehicle_id = vehicle_id
+        self.customer_id = customer_id
+        self.amount_cents = amount_cents
+        self.time = time  # seconds since the epoch, in the database's naive local time
+
+    def __len__(self):
+        return len(self.vehicle_id)
+
+
+class Vehicles:
+    """Parallel int64 arrays, one entry per vehicle, sorted by id; customer_id is NO_CUSTOMER when unsold."""
+
+    def __init__(self, id, customer_id, price_cents):
+        self.id = id
+        self.customer_id = customer_id
+        self.price_cents = price_cents
+
+
+def _epoch_seconds(column):
+    return cast(func.strftime('%s', column), Integer)
+
+
+def _columns(session, query, count):
+    """Run query and return its result columns as int64 arrays.
+
+    The rows are streamed flat into one array rather than collected first;
+    np.array() over a list of result rows is several times slower than
+    the query itself.
+    """
+    flat = np.fromiter(chain.from_iterable(session.execute(query)), dtype=np.int64)
+    return [np.ascontiguousarray(column) for column in flat.reshape(-1, count).T]
+
+
+def load_payments(session, dealership_id=None, since=None):
+    """Every payment, archived ones included (optionally for one dealership / on or after since), as a Payments."""
+    tables = [Payment.__table__] + ([archived_payments] if attach_archive(session) else [])
+    parts = []
+    for table in tables:
+        part = select(table.c.vehicle_id, table.c.customer_id, cents(table.c.amount).label('amount_cents'),
+                      table.c.payment_date)
+        if dealership_id is not None:
+            part = part.join(Vehicle, Vehicle.id == table.c.vehicle_id).where(Vehicle.dealership_id == dealership_id)
+        if since is not None:
+            part = part.where(table.c.payment_date >= since)
+        parts.append(part)
+    rows = union_all(*parts).subquery()
+    query = (select(rows.c.vehicle_id, rows.c.customer_id, rows.c.amount_cents, _epoch_seconds(rows.c.payment_date))
+             .order_by(rows.c.vehicle_id, rows.c.payment_date))
+    return Payments(*_columns(session, query, 4))
+
+
+def load_vehicles(session, dealership_id=None):
+    """Every vehicle (optionally for one dealership) as a Vehicles."""
+    query = (select(Vehicle.id, func.coalesce(Vehicle.customer_id, NO_CUSTOMER), cents(Vehicle.price))
+             .order_by(Vehicle.id))
+    if dealership_id is not None:
+        query = query.where(Vehicle.dealership_id == dealership_id)
+    return Vehicles(*_columns(session, query, 3))
+
+
+def concatenate(parts):
+    """One Payments or Vehicles from several, e.g. one per shard; parts in id order keep the arrays sorted."""
+    first = parts[0]
+    # The constructors take the arrays in the order __init__ sets them.
+    return type(first)(*(np.concatenate([vars(part)[name] for part in parts]) for name in vars(first)))
+
+
+def _seconds(moment):
+    return int((moment - datetime(1970, 1, 1)).total_seconds())
+
+
+def _moment(seconds):
+    return datetime(1970, 1, 1) + timedelta(seconds=int(seconds))
+
+
+def _runs(keys):
+    """Start offsets of the runs of equal values in a sorted key array."""
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def _per_vehicle(payments, vehicles):
+    """(cents paid, time of the newest payment or -1), aligned with vehicles."""
+    paid = np.zeros_like(vehicles.id)
+    last = np.full_like(vehicles.id, -1)
+    starts = _runs(payments.vehicle_id)
+    if len(starts):
+        position = np.searchsorted(vehicles.id, payments.vehicle_id[starts])
+        paid[position] = np.add.reduceat(payments.amount_cents, starts)
+        # Runs are in date order, so each run's last entry is its newest payment.
+        last[position] = payments.time[np.r_[starts[1:], len(payments)] - 1]
+    return paid, last
+
+
+def running_balances(payments, vehicles):
+    """Cents still owed on the vehicle after each payment, aligned with the payment arrays."""
+    starts = _runs(payments.vehicle_id)
+    running = np.cumsum(payments.amount_cents)
+    if len(starts):
+        before_run = running[starts] - payments.amount_cents[starts]
+        running -= np.repeat(before_run, np.diff(np.r_[starts, len(payments)]))
+    prices = vehicles.price_cents[np.searchsorted(vehicles.id, payments.vehicle_id)]
+    return prices - running
+
+
+def balance_history(payments, vehicles):
+    """Rows of BALANCE_FIELDS: each payment with what was still owed on its vehicle after it, oldest first per vehicle."""
+    balances = running_balances(payments, vehicles)
+    for vehicle_id, customer_id, time, amount, balance in zip(payments.vehicle_id.tolist(), payments.customer_id.tolist(),
+                                                              payments.time.tolist(), payments.amount_cents.tolist(),
+                                                              balances.tolist()):
+        yield dict(zip(BALANCE_FIELDS, (vehicle_id, customer_id, _moment(time), from_cents(amount),
+                                        from_cents(balance))))
+
+
+def instalment_intervals(payments):
+    """Rows of INTERVAL_FIELDS: days between consecutive payments, per vehicle with two or more payments."""
+    # Gaps between payments of different vehicles are dropped; the rest stay grouped by vehicle.
+    same = payments.vehicle_id[1:] == payments.vehicle_id[:-1]
+    gaps = (np.diff(payments.time) / SECONDS_PER_DAY)[same]
+    vehicle_ids = payments.vehicle_id[1:][same]
+    starts = _runs(vehicle_ids)
+    if not len(starts):
+        return
+    counts = np.diff(np.r_[starts, len(gaps)])
+    mean = np.add.reduceat(gaps, starts) / counts
+    low, high = np.minimum.reduceat(gaps, starts), np.maximum.reduceat(gaps, starts)
+    for row in zip(vehicle_ids[starts].tolist(), (counts + 1).tolist(), mean.round(2).tolist(),
+                   low.round(2).tolist(), high.round(2).tolist()):
+        yield dict(zip(INTERVAL_FIELDS, row))
+
+
+def revenue_by_period(payments, period='month'):
+    """Rows of REVENUE_FIELDS: payment count and revenue per calendar day, month or year."""
+    buckets = payments.time.astype('datetime64[s]').astype(PERIODS[period])
+    labels, index = np.unique(buckets, return_inverse=True)
+    counts = np.bincount(index, minlength=len(labels))
+    # Float64 sums of integer cents are exact below 2**53 cents.
+    revenue = np.bincount(index, weights=payments.amount_cents, minlength=len(labels)).astype(np.int64)
+    for label, count, total in zip(labels.astype(str).tolist(), counts.tolist(), revenue.tolist()):
+        yield dict(zip(REVENUE_FIELDS, (label, count, from_cents(total))))
+
+
+def payment_velocity(payments, vehicles, as_of=None):
+    """Rows of VELOCITY_FIELDS per paying customer, with a straight-line payoff forecast.
+
+    The rate is what the customer has paid over the days from their first
+    payment to as_of (at least one day). Outstanding is the balance left on
+    the vehicles they own, and days_to_payoff that balance over the rate.
+    """
+    if not len(payments):
+        return
+    now = _seconds(as_of or datetime.now())
+    order = np.lexsort((payments.time, payments.customer_id))
+    customer_ids = payments.customer_id[order]
+    starts = _runs(customer_ids)
+    customers = customer_ids[starts]
+    paid = np.add.reduceat(payments.amount_cents[order], starts)
+    first = payments.time[order][starts]
+
+    vehicle_paid, _ = _per_vehicle(payments, vehicles)
+    owing = np.maximum(vehicles.price_cents - vehicle_paid, 0)
+    owner = np.searchsorted(customers, vehicles.customer_id)
+    owned = (vehicles.customer_id != NO_CUSTOMER) & (owner < len(customers))
+    owned[owned] = customers[owner[owned]] == vehicles.customer_id[owned]
+    outstanding = np.bincount(owner[owned], weights=owing[owned], minlength=len(customers)).astype(np.int64)
+
+    rate = paid / np.maximum((now - first) / SECONDS_PER_DAY, 1.0)
+    to_payoff = np.ceil(outstanding / rate).astype(np.int64)
+    for customer_id, total, owed, per_day, days in zip(customers.tolist(), paid.tolist(), outstanding.tolist(),
+                                                       rate.tolist(), to_payoff.tolist()):
+        forecast = (_moment(now) + timedelta(days=days)).date()
+        yield dict(zip(VELOCITY_FIELDS, (customer_id, from_cents(total), from_cents(owed),
+                                         from_cents(round(per_day)), days, forecast)))
+
+
+def overdue_vehicles(payments, vehicles, as_of=None, days=OVERDUE_AFTER_DAYS):
+    """Rows of OVERDUE_FIELDS: sold vehicles with a balance left and no payment in the last `days` days."""
+    now = _seconds(as_of or datetime.now())
+    paid, last = _per_vehicle(payments, vehicles)
+    outstanding = vehicles.price_cents - paid
+    stale = last < now - days * SECONDS_PER_DAY
+    for position in np.flatnonzero((vehicles.customer_id != NO_CUSTOMER) & (outstanding > 0) & stale).tolist():
+        seen = int(last[position])
+        yield dict(zip(OVERDUE_FIELDS, (int(vehicles.id[position]), int(vehicles.customer_id[position]),
+                                        from_cents(int(outstanding[position])),
+                                        _moment(seen) if seen >= 0 else None,
+                                        (now - seen) // SECONDS_PER_DAY if seen >= 0 else None)))
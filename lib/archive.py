@@ -0,0 +1,117 @@
+# lib/archive.py
+"""Moving old payments of fully paid vehicles out of the hot payments table.
+
+    archive_payments(session, before=datetime(2024, 1, 1))
+
+Payments dated before the cutoff, on vehicles whose ledger shows them fully
+paid, are copied to the archive database (see lib.models.archive) and then
+deleted from payments, one batch of vehicles at a time. What they added to
+each vehicle's ledger is kept in its payment_rollups row, so total_paid and
+payment_count are left as they are and reconcile_ledger still balances.
+
+Each batch takes two transactions, as a transaction can't commit across
+two database files atomically without a journal both share:
+
+1. copy the payments to the archive (INSERT OR IGNORE on their ids), commit;
+2. under the write lock, fold the copied payments into the rollups and
+   delete them from payments, commit.
+
+A run interrupted between the two leaves payments that are in both
+databases; the next run skips re-copying them and finishes the move.
+"""
+from sqlalchemy import select, delete, insert, update, func, and_, exists
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from lib.models.vehicle import Vehicle
+from lib.models.payment import Payment, PaymentRollup
+from lib.models.changes import ChangeLog, latest_seq
+from lib.models.archive import archived_payments, attach_archive
+from lib.models.cache import identity_cache
+from lib.models.locking import begin_write, retry_on_busy
+from lib.models.money import cents
+from lib.constants import DEFAULT_BATCH_SIZE
+
+
+def _settled_vehicles(session, before, after_id, batch_size):
+    """The next batch of fully paid vehicle ids, above after_id, that have payments to archive."""
+    return list(session.scalars(
+        select(Vehicle.id)
+        .where(Vehicle.id > after_id, Vehicle.total_paid >= Vehicle.price,
+               exists().where(Payment.vehicle_id == Vehicle.id, Payment.payment_date < before))
+        .order_by(Vehicle.id).limit(batch_size)))
+
+
+def _copy(session, vehicle_ids, before):
+    payments = Payment.__table__
+    session.execute(
+        insert(archived_payments).prefix_with('OR IGNORE')
+        .from_select(list(archived_payments.columns),
+                     select(*(payments.c[column.key] for column in archived_payments.columns))
+                     .where(payments.c.vehicle_id.in_(vehicle_ids), payments.c.payment_date < before)))
+    session.commit()
+
+
+@retry_on_busy
+def _move(session, vehicle_ids, before):
+    """Fold the copied payments of these vehicles into their rollups and delete them.
+
+    Returns (vehicles, payments) moved.
+    """
+    try:
+        begin_write(session)
+        attach_archive(session)
+        payments = Payment.__table__
+        # Only payments the archive holds, on vehicles still fully paid now that the lock is held.
+        moving = and_(payments.c.vehicle_id.in_(vehicle_ids), payments.c.payment_date < before,
+                      payments.c.id.in_(select(archived_payments.c.id)
+                                        .where(archived_payments.c.vehicle_id.in_(vehicle_ids))),
+                      payments.c.vehicle_id.in_(select(Vehicle.id).where(Vehicle.id.in_(vehicle_ids),
+                                                                         Vehicle.total_paid >= Vehicle.price)))
+        totals = (select(payments.c.vehicle_id, func.sum(cents(payments.c.amount)), func.count(),
+                         func.min(payments.c.payment_date), func.max(payments.c.payment_date))
+                  .where(moving).group_by(payments.c.vehicle_id))
+        rollups = PaymentRollup.__table__
+        upsert = sqlite_insert(rollups).from_select(
+            [rollups.c.vehicle_id, rollups.c.amount, rollups.c.payment_count,
+             rollups.c.first_payment_date, rollups.c.last_payment_date], totals)
+        upsert = upsert.on_conflict_do_update(index_elements=[rollups.c.vehicle_id], set_={
+            rollups.c.amount: cents(rollups.c.amount) + upsert.excluded.amount,
+            rollups.c.payment_count: rollups.c.payment_count + upsert.excluded.payment_count,
+            rollups.c.first_payment_date: func.min(rollups.c.first_payment_date, upsert.excluded.first_payment_date),
+            rollups.c.last_payment_date: func.max(rollups.c.last_payment_date, upsert.excluded.last_payment_date),
+        })
+        vehicles = session.execute(upsert).rowcount
+        logged = latest_seq(session)
+        moved = session.execute(delete(payments).where(moving)).rowcount
+        # The change log sees a DELETE; tell consumers the payments moved rather than disappeared.
+        session.execute(update(ChangeLog).where(ChangeLog.seq > logged, ChangeLog.entity == 'payments',
+                                                ChangeLog.op == 'delete').values(op='archive'))
+        session.commit()
+        return vehicles, moved
+    except Exception:
+        session.rollback()
+        raise
+
+
+def archive_payments(session, before, batch_size=DEFAULT_BATCH_SIZE):
+    """Move payments dated before `before` of fully paid vehicles to the archive; return the counts.
+
+    Returns {'vehicles': ..., 'archived': ...}: the vehicles that had
+    payments moved and the number of payments moved.
+    """
+    if not attach_archive(session, create=True):
+        raise ValueError("Archiving needs a file-backed SQLite database")
+    session.commit()
+    result = {'vehicles': 0, 'archived': 0}
+    after_id = 0
+    while True:
+        vehicle_ids = _settled_vehicles(session, before, after_id, batch_size)
+        if not vehicle_ids:
+            break
+        after_id = vehicle_ids[-1]
+        attach_archive(session, create=True)
+        _copy(session, vehicle_ids, before)
+        vehicles, moved = _move(session, vehicle_ids, before)
+        result['vehicles'] += vehicles
+        result['archived'] += moved
+    identity_cache.invalidate_class(Payment)
+    return result
@@ -0,0 +1,291 @@
+# lib/bulk.py
+import csv
+import json
+import sys
+import time
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.customer import Customer
+from lib.models.payment import Payment
+from lib.models.validators import row_object, non_empty_string, email_address, positive_amount, timestamp
+from lib.models.money import ZERO
+from lib.models.locking import begin_write, retry_on_busy
+from lib.constants import DEFAULT_BATCH_SIZE
+
+
+class ImportReport:
+    def __init__(self, entity):
+        self.entity = entity
+        self.inserted = 0
+        self.rejected = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line, row, error):
+        self.rejected.append((line, row, str(error)))
+
+    @property
+    def rows_per_sec(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+
+def read_rows(path, fmt=None):
+    """Yield (row, parse error) pairs from a CSV or JSONL file; '-' reads stdin."""
+    if fmt is None:
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if fmt == 'csv':
+            for row in csv.DictReader(stream):
+                yield row, None
+        else:
+            for line in stream:
+                if line.strip():
+                    try:
+                        yield json.loads(line), None
+                    except json.JSONDecodeError as e:
+                        yield None, e
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _integer(value, label):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{label} must be an integer")
+
+
+def _optional_id(row):
+    return None if _blank(row.get('id')) else _integer(row['id'], "ID")
+
+
+class _Loader:
+    """Validates rows for one table against ID sets loaded once up front."""
+
+    model = None
+
+    def __init__(self, session):
+        self.session = session
+        self.existing_ids = None
+
+    def load_ids(self, column):
+        return {id for (id,) in self.session.query(column)}
+
+    def claim_id(self, id):
+        if id is None:
+            return None
+        if self.existing_ids is None:
+            self.existing_ids = self.load_ids(self.model.id)
+        if id in self.existing_ids:
+            raise ValueError(f"Duplicate ID {id}")
+        self.existing_ids.add(id)
+        return id
+
+    def validate(self, row):
+        raise NotImplementedError
+
+    def after_insert(self, batch):
+        """Hook for work that must commit in the same transaction as the batch."""
+
+    @retry_on_busy
+    def flush(self, batch):
+        # Rows with and without explicit IDs go in separate executemany calls so
+        # SQLite assigns the missing ones instead of receiving NULL.
+        table = self.model.__table__
+        with_ids = [r for r in batch if r['id'] is not None]
+        without_ids = [{k: v for k, v in r.items() if k != 'id'} for r in batch if r['id'] is None]
+        try:
+            begin_write(self.session)
+            if with_ids:
+                self.session.execute(table.insert(), with_ids)
+            if without_ids:
+                self.session.execute(table.insert(), without_ids)
+            self.after_insert(batch)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        if without_ids:
+            # Generated IDs are unknown here; reload the set if another explicit ID shows up.
+            self.existing_ids = None
+
+
+class _DealershipLoader(_Loader):
+    model = Dealership
+
+    def validate(self, row):
+        return {
+            'name': non_empty_string(row.get('name'), "Name"),
+            'location': non_empty_string(row.get('location'), "Location"),
+        }
+
+
+class _CustomerLoader(_Loader):
+    model = Customer
+
+    def validate(self, row):
+        return {
+            'name': non_empty_string(row.get('name'), "Name"),
+            'email': email_address(row.get('email')),
+        }
+
+
+class _VehicleLoader(_Loader):
+    model = Vehicle
+
+    def __init__(self, session):
+        super().__init__(session)
+        self.dealership_ids = self.load_ids(Dealership.id)
+        self.customer_ids = self.load_ids(Customer.id)
+
+    def validate(self, row):
+        record = {
+            'model': non_empty_string(row.get('model'), "Model"),
+            'price': positive_amount(row.get('price'), "Price"),
+            'dealership_id': _integer(row.get('dealership_id'), "Dealership ID"),
+            'customer_id': None if _blank(row.get('customer_id')) else _integer(row['customer_id'], "Customer ID"),
+        }
+        if record['dealership_id'] not in self.dealership_ids:
+            raise ValueError("Invalid dealership ID")
+        if record['customer_id'] is not None and record['customer_id'] not in self.customer_ids:
+            raise ValueError("Invalid customer ID")
+        return record
+
+
+class _PaymentLoader(_Loader):
+    model = Payment
+
+    def __init__(self, session):
+        super().__init__(session)
+        self.vehicle_owners, self.balances = {}, {}
+        for id, customer_id, price, total_paid in session.query(Vehicle.id, Vehicle.customer_id, Vehicle.price,
+                                                                Vehicle.total_paid):
+            self.vehicle_owners[id] = customer_id
+            self.balances[id] = price - total_paid
+        self.customer_ids = self.load_ids(Customer.id)
+
+    def validate(self, row):
+        vehicle_id = _integer(row.get('vehicle_id'), "Vehicle ID")
+        customer_id = _integer(row.get('customer_id'), "Customer ID")
+        if vehicle_id not in self.vehicle_owners:
+            raise ValueError("Invalid vehicle ID")
+        if customer_id not in self.customer_ids:
+            raise ValueError("Invalid customer ID")
+        owner = self.vehicle_owners[vehicle_id]
+        if owner and owner != customer_id:
+            raise ValueError("Payment customer must match vehicle customer")
+        record = {
+            'vehicle_id': vehicle_id,
+            'customer_id': customer_id,
+            'amount': positive_amount(row.get('amount'), "Payment amount"),
+            'payment_date': timestamp(row.get('payment_date'), "Payment date"),
+            'status': row.get('status') or "completed",
+        }
+        if record['amount'] > self.balances[vehicle_id]:
+            raise ValueError("Payment exceeds remaining balance")
+        self.balances[vehicle_id] -= record['amount']
+        return record
+
+    def after_insert(self, batch):
+        # Guarded by price, so a payment posted elsewhere since the balances were
+        # loaded fails the batch rather than overpaying the vehicle.
+        ledger = {}
+        for record in batch:
+            total, count = ledger.get(record['vehicle_id'], (ZERO, 0))
+            ledger[record['vehicle_id']] = (total + record['amount'], count + 1)
+        Vehicle.apply_to_ledger(self.session, ledger)
+
+
+LOADERS = {
+    'dealerships': _DealershipLoader,
+    'customers': _CustomerLoader,
+    'vehicles': _VehicleLoader,
+    'payments': _PaymentLoader,
+}
+
+
+def load(session, entity, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Validate (row, parse error) pairs and insert them in batched transactions.
+
+    Each batch is one executemany INSERT and one commit. Rows that fail
+    validation are recorded on the returned ImportReport and skipped.
+    """
+    report = ImportReport(entity)
+    _load(session, entity, enumerate(rows, start=1), batch_size, report)
+    report.elapsed = time.perf_counter() - report.started
+    return report
+
+
+def _shard_for(shard_map, entity, row, region):
+    """The shard a row belongs in: by location, by the ID of the row it hangs off, or by its own ID or region."""
+    id = _optional_id(row)
+    if entity == 'dealerships':
+        shard = shard_map.shard_for_location(non_empty_string(row.get('location'), "Location"))
+    elif entity == 'vehicles':
+        shard = shard_map.shard_for_id(_integer(row.get('dealership_id'), "Dealership ID"))
+    elif entity == 'payments':
+        shard = shard_map.shard_for_id(_integer(row.get('vehicle_id'), "Vehicle ID"))
+    elif id is not None:
+        return shard_map.shard_for_id(id)
+    elif region is None:
+        raise ValueError("Customers without an ID need a region to go to")
+    else:
+        shard = shard_map.check_region(region)
+    if id is not None and shard_map.shard_for_id(id) != shard:
+        raise ValueError(f"ID {id} is outside shard {shard!r}'s ID block")
+    return shard
+
+
+def load_sharded(router, entity, rows, batch_size=DEFAULT_BATCH_SIZE, region=None):
+    """load() across the shards of a lib.sharding.ShardRouter, each row going to the shard that holds it.
+
+    Dealerships go by location, vehicles by dealership ID, payments by
+    vehicle ID, and customers by their ID or else to region. Rows are
+    grouped per shard in memory and each shard is loaded in turn; rejected
+    rows keep their line numbers in the file.
+    """
+    report = ImportReport(entity)
+    routed = {}
+    for line, (row, error) in enumerate(rows, start=1):
+        try:
+            if error is not None:
+                raise ValueError(f"Malformed row: {error}")
+            shard = _shard_for(router.map, entity, row_object(row), region)
+        except ValueError as e:
+            report.reject(line, row, e)
+            continue
+        routed.setdefault(shard, []).append((line, (row, error)))
+    for shard in router.map.names:
+        if shard in routed:
+            _load(router.session(shard), entity, routed[shard], batch_size, report)
+    report.rejected.sort(key=lambda rejected: rejected[0])
+    report.elapsed = time.perf_counter() - report.started
+    return report
+
+
+def _load(session, entity, numbered_rows, batch_size, report):
+    loader = LOADERS[entity](session)
+    batch = []
+    for line, (row, error) in numbered_rows:
+        try:
+            if error is not None:
+                raise ValueError(f"Malformed row: {error}")
+            record = loader.validate(row_object(row))
+            record['id'] = loader.claim_id(_optional_id(row))
+            batch.append(record)
+        except ValueError as e:
+            report.reject(line, row, e)
+            continue
+        if len(batch) >= batch_size:
+            loader.flush(batch)
+            report.inserted += len(batch)
+            batch = []
+    if batch:
+        loader.flush(batch)
+        report.inserted += len(batch)
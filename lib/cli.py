@@ -1,86 +1,201 @@
 # lib/cli.py
 import sys
 import os
+import json
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+from contextlib import ExitStack
+from itertools import islice
 import click
-from lib.models.dealership import Dealership
-from lib.models.vehicle import Vehicle
-from lib.models.customer import Customer
-from lib.models.payment import Payment
-from lib.helpers import setup_database
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func
-from datetime import datetime
+# Keep module-level imports light: SQLAlchemy, the models and the engine are
+# loaded inside the commands that use them, so --help and menu navigation
+# never pay for them.
+from lib.constants import DEFAULT_BATCH_SIZE, OUTPUT_FORMATS, ENTITIES, EXPORT_FORMATS
+from lib import script
 
 @click.group()
-def cli():
+@click.option('--profile', is_flag=True, envvar='EV_PROFILE', help='Print SQL statement and timing statistics when the command exits')
+@click.option('--profile-output', type=click.Path(dir_okay=False), envvar='EV_PROFILE_OUTPUT', default=None, help='Also write the profile as JSON, or as a cProfile dump if the name ends in .prof')
+@click.pass_context
+def cli(ctx, profile, profile_output):
     """EV African Motors CLI"""
-    pass
+    if profile or profile_output:
+        from lib import profiling
+        profiling.enable(cprofile=bool(profile_output and profile_output.endswith('.prof')))
+        ctx.call_on_close(lambda: profiling.finish(profile_output))
+
+@cli.result_callback()
+@click.pass_context
+def exit_status(ctx, result, **options):
+    if ctx.meta.get('ev.failed'):
+        ctx.exit(1)
+
+def fail(message):
+    """Echo a command error and make the command exit with status 1."""
+    click.echo(message)
+    click.get_current_context().meta['ev.failed'] = True
+
+def listing_options(f):
+    f = click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='text', show_default=True, help='Output format')(f)
+    f = click.option('--after', type=int, default=None, help='Only list rows with an ID greater than this')(f)
+    f = click.option('--limit', type=click.IntRange(min=1), default=None, help='Maximum number of rows to list')(f)
+    return f
+
+def batch_size_for(limit):
+    return min(limit, DEFAULT_BATCH_SIZE) if limit else DEFAULT_BATCH_SIZE
+
+def open_session(location=None, id=None, region=None):
+    """setup_database(), or with EV_SHARD_MAP set, the session of the shard for location, row id or region.
+
+    Reports a routing error with fail() and returns None.
+    """
+    from lib.helpers import setup_database
+    from lib.sharding import router_from_env
+    try:
+        router = router_from_env()
+        if router is None:
+            return setup_database()
+        if location is not None:
+            return router.for_location(location)
+        if id is not None:
+            return router.for_id(id)
+        if region is not None:
+            return router.for_region(region)
+        raise ValueError("Give a dealership ID or --region to choose a shard when EV_SHARD_MAP is set")
+    except (ValueError, OSError) as e:
+        fail(f"Error: {e}")
+        return None
+
+def gather_rows(build):
+    """Stream build(session) from the database, or with EV_SHARD_MAP set, from every shard in parallel, in ID order."""
+    from lib.helpers import setup_database
+    from lib.sharding import router_from_env
+    router = router_from_env()
+    if router is not None:
+        yield from router.gather(build)
+        return
+    session = setup_database()
+    try:
+        yield from build(session)
+    finally:
+        session.close()
+
+def shard_sessions():
+    """[(None, setup_database())], or with EV_SHARD_MAP set, (shard, session) for every shard in block order."""
+    from lib.helpers import setup_database
+    from lib.sharding import router_from_env
+    router = router_from_env()
+    if router is None:
+        return [(None, setup_database())]
+    return [(shard, router.session(shard)) for shard in router.map.names]
+
+def search_matches(model, query, limit, offset):
+    """model.search() matches; with EV_SHARD_MAP set, each shard's best matches in turn, shards in block order.
+
+    bm25 ranks are relative to each shard's own index, so they aren't
+    compared across shards.
+    """
+    if not os.environ.get('EV_SHARD_MAP'):
+        return list(gather_rows(lambda session: model.search(session, query, limit, offset)))
+    matches = gather_rows(lambda session: model.search(session, query, offset + limit))
+    return list(islice(matches, offset, offset + limit))
+
+def iter_listing(model, limit, after):
+    """model.iter_all() for a list command, across every shard in ID order when EV_SHARD_MAP is set."""
+    from lib.helpers import setup_database
+    from lib.sharding import router_from_env
+    router = router_from_env()
+    if router is not None:
+        try:
+            yield from router.iter_all(model, batch_size_for(limit), after)
+        finally:
+            router.close()
+        return
+    session = setup_database()
+    try:
+        yield from model.iter_all(session, batch_size_for(limit), after)
+    finally:
+        session.close()
 
 @cli.command()
 @click.option('--name', prompt='Dealership name', help='Name of the dealership')
 @click.option('--location', prompt='Location', help='Location of the dealership')
 def create_dealership(name, location):
-    session = setup_database()
+    from lib.models import Dealership
+    session = open_session(location=location)
+    if session is None:
+        return
     try:
         dealership = Dealership.create(session, name, location)
         click.echo(f"Created dealership: {dealership.name} at {dealership.location} (ID: {dealership.id})")
     except ValueError as e:
-        click.echo(f"Error: {e}")
+        fail(f"Error: {e}")
     except Exception as e:
-        click.echo(f"Unexpected error: {e}")
+        fail(f"Unexpected error: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--id', prompt='Dealership ID', type=int, help='ID of the dealership to delete')
 def delete_dealership(id):
-    session = setup_database()
+    from lib.models import Dealership
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
         if Dealership.delete(session, id):
             click.echo(f"Deleted dealership with ID {id}")
         else:
-            click.echo(f"Error: Dealership with ID {id} not found")
+            fail(f"Error: Dealership with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error deleting dealership: {e}")
+        fail(f"Error deleting dealership: {e}")
     finally:
         session.close()
 
 @cli.command()
-def list_dealerships():
-    session = setup_database()
+@listing_options
+def list_dealerships(limit, after, fmt):
+    from lib.models import Dealership
+    from lib.helpers import echo_records
+    dealerships = iter_listing(Dealership, limit, after)
     try:
-        dealerships = Dealership.get_all(session)
-        if not dealerships:
+        records = ({'id': d.id, 'name': d.name, 'location': d.location} for d in dealerships)
+        count = echo_records(islice(records, limit), fmt, ['id', 'name', 'location'],
+                             lambda d: f"ID: {d['id']}, Name: {d['name']}, Location: {d['location']}")
+        if not count and fmt == 'text':
             click.echo("No dealerships found.")
-        for d in dealerships:
-            click.echo(f"ID: {d.id}, Name: {d.name}, Location: {d.location}")
     except Exception as e:
-        click.echo(f"Error listing dealerships: {e}")
+        fail(f"Error listing dealerships: {e}")
     finally:
-        session.close()
+        dealerships.close()
 
 @cli.command()
 @click.option('--id', prompt='Dealership ID', type=int, help='ID of the dealership to find')
 def find_dealership(id):
-    session = setup_database()
+    from lib.models import Dealership
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
         dealership = Dealership.find_by_id(session, id)
         if dealership:
             click.echo(f"ID: {dealership.id}, Name: {dealership.name}, Location: {dealership.location}")
         else:
-            click.echo(f"Error: Dealership with ID {id} not found")
+            fail(f"Error: Dealership with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error finding dealership: {e}")
+        fail(f"Error finding dealership: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--id', prompt='Dealership ID', type=int, help='ID of the dealership')
 def list_dealership_vehicles(id):
-    session = setup_database()
+    from lib.models import Dealership
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
-        dealership = Dealership.find_by_id(session, id)
+        dealership = Dealership.find_with_vehicles(session, id)
         if dealership:
             click.echo(f"Vehicles for {dealership.name}:")
             if not dealership.vehicles:
@@ -88,9 +203,9 @@ def list_dealership_vehicles(id):
             for vehicle in dealership.vehicles:
                 click.echo(f"  ID: {vehicle.id}, Model: {vehicle.model}, Price: ${vehicle.price}")
         else:
-            click.echo(f"Error: Dealership with ID {id} not found")
+            fail(f"Error: Dealership with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error listing vehicles: {e}")
+        fail(f"Error listing vehicles: {e}")
     finally:
         session.close()
 
@@ -100,7 +215,11 @@ def list_dealership_vehicles(id):
 @click.option('--dealership', prompt='Dealership name or ID', help='Name or ID of the dealership')
 @click.option('--customer_id', prompt='Customer ID (optional, press Enter to skip)', type=int, default=None, help='ID of the customer', show_default=False, required=False)
 def create_vehicle(model, price, dealership, customer_id):
-    session = setup_database()
+    from lib.models import Dealership, Vehicle, Customer
+    from sqlalchemy.exc import IntegrityError
+    session = open_session(id=int(dealership) if dealership.strip().isdigit() else None)
+    if session is None:
+        return
     try:
         try:
             dealership_id = int(dealership)
@@ -108,7 +227,7 @@ def create_vehicle(model, price, dealership, customer_id):
             if not dealership_obj:
                 raise ValueError(f"Dealership with ID {dealership_id} not found")
         except ValueError:
-            dealership_obj = session.query(Dealership).filter(func.lower(Dealership.name) == func.lower(dealership)).first()
+            dealership_obj = Dealership.find_by_name(session, dealership)
             if not dealership_obj:
                 raise ValueError(f"Dealership with name '{dealership}' not found")
             dealership_id = dealership_obj.id
@@ -119,125 +238,151 @@ def create_vehicle(model, price, dealership, customer_id):
             customer = Customer.find_by_id(session, customer_id)
             click.echo(f"Associated with Customer: {customer.name} (ID: {customer_id})")
     except ValueError as e:
-        click.echo(f"Error: {e}")
+        fail(f"Error: {e}")
     except IntegrityError:
-        click.echo(f"Error: Failed to create vehicle due to database constraint")
+        fail(f"Error: Failed to create vehicle due to database constraint")
     except Exception as e:
-        click.echo(f"Unexpected error: {e}")
+        fail(f"Unexpected error: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--id', prompt='Vehicle ID', type=int, help='ID of the vehicle to delete')
 def delete_vehicle(id):
-    session = setup_database()
+    from lib.models import Vehicle
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
         if Vehicle.delete(session, id):
             click.echo(f"Deleted vehicle with ID {id}")
         else:
-            click.echo(f"Error: Vehicle with ID {id} not found")
+            fail(f"Error: Vehicle with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error deleting vehicle: {e}")
+        fail(f"Error deleting vehicle: {e}")
     finally:
         session.close()
 
 @cli.command()
-def list_vehicles():
-    session = setup_database()
+@listing_options
+def list_vehicles(limit, after, fmt):
+    from lib.models import Vehicle
+    from lib.helpers import echo_records
+    vehicles = iter_listing(Vehicle, limit, after)
     try:
-        vehicles = Vehicle.get_all(session)
-        if not vehicles:
+        records = ({'id': v.id, 'model': v.model, 'price': v.price, 'dealership_id': v.dealership_id,
+                    'dealership': v.dealership.name if v.dealership else None,
+                    'customer_id': v.customer_id, 'customer': v.customer.name if v.customer else None}
+                   for v in vehicles)
+        count = echo_records(islice(records, limit), fmt,
+                             ['id', 'model', 'price', 'dealership_id', 'dealership', 'customer_id', 'customer'],
+                             lambda v: f"ID: {v['id']}, Model: {v['model']}, Price: ${v['price']}, Dealership: {v['dealership'] or 'Unknown'}, Customer: {v['customer'] or 'None'} (ID: {v['customer_id']})")
+        if not count and fmt == 'text':
             click.echo("No vehicles found.")
-        for v in vehicles:
-            dealership = Dealership.find_by_id(session, v.dealership_id)
-            customer = Customer.find_by_id(session, v.customer_id) if v.customer_id else None
-            click.echo(f"ID: {v.id}, Model: {v.model}, Price: ${v.price}, Dealership: {dealership.name if dealership else 'Unknown'}, Customer: {customer.name if customer else 'None'} (ID: {v.customer_id})")
     except Exception as e:
-        click.echo(f"Error listing vehicles: {e}")
+        fail(f"Error listing vehicles: {e}")
     finally:
-        session.close()
+        vehicles.close()
 
 @cli.command()
 @click.option('--id', prompt='Vehicle ID', type=int, help='ID of the vehicle to find')
 def find_vehicle(id):
-    session = setup_database()
+    from lib.models import Vehicle
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
-        vehicle = Vehicle.find_by_id(session, id)
+        vehicle = Vehicle.find_with_relations(session, id)
         if vehicle:
-            dealership = Dealership.find_by_id(session, vehicle.dealership_id)
-            customer = Customer.find_by_id(session, vehicle.customer_id) if vehicle.customer_id else None
+            dealership, customer = vehicle.dealership, vehicle.customer
             click.echo(f"ID: {vehicle.id}, Model: {vehicle.model}, Price: ${vehicle.price}, Dealership: {dealership.name if dealership else 'Unknown'}, Customer: {customer.name if customer else 'None'} (ID: {vehicle.customer_id})")
         else:
-            click.echo(f"Error: Vehicle with ID {id} not found")
+            fail(f"Error: Vehicle with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error finding vehicle: {e}")
+        fail(f"Error finding vehicle: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--name', prompt='Customer name', help='Name of the customer')
 @click.option('--email', prompt='Email', help='Email of the customer')
-def create_customer(name, email):
-    session = setup_database()
+@click.option('--region', default=None, help='Shard to create the customer in (with EV_SHARD_MAP)')
+def create_customer(name, email, region):
+    from lib.models import Customer
+    session = open_session(region=region)
+    if session is None:
+        return
     try:
         customer = Customer.create(session, name, email)
         click.echo(f"Created customer: {customer.name}, Email: {customer.email}, ID: {customer.id}")
     except ValueError as e:
-        click.echo(f"Error: {e}")
+        fail(f"Error: {e}")
     except Exception as e:
-        click.echo(f"Unexpected error: {e}")
+        fail(f"Unexpected error: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--id', prompt='Customer ID', type=int, help='ID of the customer to delete')
 def delete_customer(id):
-    session = setup_database()
+    from lib.models import Customer
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
         if Customer.delete(session, id):
             click.echo(f"Deleted customer with ID {id}")
         else:
-            click.echo(f"Error: Customer with ID {id} not found")
+            fail(f"Error: Customer with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error deleting customer: {e}")
+        fail(f"Error deleting customer: {e}")
     finally:
         session.close()
 
 @cli.command()
-def list_customers():
-    session = setup_database()
+@listing_options
+def list_customers(limit, after, fmt):
+    from lib.models import Customer
+    from lib.helpers import echo_records
+    customers = iter_listing(Customer, limit, after)
     try:
-        customers = Customer.get_all(session)
-        if not customers:
+        records = ({'id': c.id, 'name': c.name, 'email': c.email} for c in customers)
+        count = echo_records(islice(records, limit), fmt, ['id', 'name', 'email'],
+                             lambda c: f"ID: {c['id']}, Name: {c['name']}, Email: {c['email']}")
+        if not count and fmt == 'text':
             click.echo("No customers found.")
-        for c in customers:
-            click.echo(f"ID: {c.id}, Name: {c.name}, Email: {c.email}")
     except Exception as e:
-        click.echo(f"Error listing customers: {e}")
+        fail(f"Error listing customers: {e}")
     finally:
-        session.close()
+        customers.close()
 
 @cli.command()
 @click.option('--id', prompt='Customer ID', type=int, help='ID of the customer to find')
 def find_customer(id):
-    session = setup_database()
+    from lib.models import Customer
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
         customer = Customer.find_by_id(session, id)
         if customer:
             click.echo(f"ID: {customer.id}, Name: {customer.name}, Email: {customer.email}")
         else:
-            click.echo(f"Error: Customer with ID {id} not found")
+            fail(f"Error: Customer with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error finding customer: {e}")
+        fail(f"Error finding customer: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--id', prompt='Customer ID', type=int, help='ID of the customer')
 def list_customer_vehicles(id):
-    session = setup_database()
+    from lib.models import Customer
+    session = open_session(id=id)
+    if session is None:
+        return
     try:
-        customer = Customer.find_by_id(session, id)
+        customer = Customer.find_with_vehicles(session, id)
         if customer:
             click.echo(f"Vehicles purchased by {customer.name}:")
             if not customer.vehicles:
@@ -245,9 +390,9 @@ def list_customer_vehicles(id):
             for vehicle in customer.vehicles:
                 click.echo(f"  ID: {vehicle.id}, Model: {vehicle.model}, Price: ${vehicle.price}")
         else:
-            click.echo(f"Error: Customer with ID {id} not found")
+            fail(f"Error: Customer with ID {id} not found")
     except Exception as e:
-        click.echo(f"Error listing vehicles: {e}")
+        fail(f"Error listing vehicles: {e}")
     finally:
         session.close()
 
@@ -256,7 +401,10 @@ def list_customer_vehicles(id):
 @click.option('--customer_id', prompt='Customer ID', type=int, help='ID of the customer')
 @click.option('--amount', prompt='Payment amount', type=float, help='Amount of the payment')
 def create_payment(vehicle_id, customer_id, amount):
-    session = setup_database()
+    from lib.models import Vehicle
+    session = open_session(id=vehicle_id)
+    if session is None:
+        return
     try:
         vehicle = Vehicle.find_by_id(session, vehicle_id)
         if not vehicle:
@@ -264,23 +412,30 @@ def create_payment(vehicle_id, customer_id, amount):
         payment = vehicle.add_payment(session, amount, customer_id)
         click.echo(f"Created payment: Amount: ${payment.amount}, Vehicle ID: {payment.vehicle_id}, Customer ID: {payment.customer_id}, Date: {payment.payment_date}")
     except ValueError as e:
-        click.echo(f"Error: {e}")
+        fail(f"Error: {e}")
     except Exception as e:
-        click.echo(f"Unexpected error: {e}")
+        fail(f"Unexpected error: {e}")
     finally:
         session.close()
 
 @cli.command()
 @click.option('--vehicle_id', prompt='Vehicle ID', type=int, help='ID of the vehicle')
-def list_vehicle_payments(vehicle_id):
-    session = setup_database()
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='Only list payments on or after this date')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), default=None, help='Only list payments before this date')
+@click.option('--include-archived', is_flag=True, help='Also list payments moved to the archive')
+def list_vehicle_payments(vehicle_id, since, until, include_archived):
+    from lib.models import Vehicle
+    session = open_session(id=vehicle_id)
+    if session is None:
+        return
     try:
         vehicle = Vehicle.find_by_id(session, vehicle_id)
         if not vehicle:
             raise ValueError(f"Vehicle with ID {vehicle_id} not found")
-        payments = vehicle.get_payments(session)
+        payments = vehicle.get_payments(session, since, until, include_archived)
+        # Read the ledger row directly; the vehicle itself may come from the identity cache.
         total_paid = vehicle.get_total_payments(session)
-        balance = vehicle.get_remaining_balance(session)
+        balance = vehicle.price - total_paid
         click.echo(f"Payments for Vehicle ID {vehicle_id} (Model: {vehicle.model}):")
         if not payments:
             click.echo("  No payments found.")
@@ -288,77 +443,529 @@ def list_vehicle_payments(vehicle_id):
             click.echo(f"  Payment ID: {payment.id}, Amount: ${payment.amount}, Customer ID: {payment.customer_id}, Date: {payment.payment_date}, Status: {payment.status}")
         click.echo(f"Total Paid: ${total_paid:.2f}, Remaining Balance: ${balance:.2f}")
     except ValueError as e:
-        click.echo(f"Error: {e}")
+        fail(f"Error: {e}")
     except Exception as e:
-        click.echo(f"Error listing payments: {e}")
+        fail(f"Error listing payments: {e}")
     finally:
         session.close()
 
-def main():
-    while True:
-        click.echo("\nEV African Motors Menu:")
-        click.echo("1. Create Dealership")
-        click.echo("2. Delete Dealership")
-        click.echo("3. List Dealerships")
-        click.echo("4. Find Dealership by ID")
-        click.echo("5. List Vehicles for Dealership")
-        click.echo("6. Create Vehicle")
-        click.echo("7. Delete Vehicle")
-        click.echo("8. List Vehicles")
-        click.echo("9. Find Vehicle by ID")
-        click.echo("10. Create Customer")
-        click.echo("11. Delete Customer")
-        click.echo("12. List Customers")
-        click.echo("13. Find Customer by ID")
-        click.echo("14. List Vehicles Purchased by Customer")
-        click.echo("15. Create Payment")
-        click.echo("16. List Payments for Vehicle")
-        click.echo("17. Exit")
-        try:
-            choice = click.prompt("Enter your choice (1-17)", type=int)
+@cli.command(name='import')
+@click.argument('entity', type=click.Choice(ENTITIES))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None, help='Input format (default: from file extension)')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per INSERT transaction')
+@click.option('--show-rejects', type=int, default=20, show_default=True, help='Maximum rejected rows to print')
+@click.option('--region', default=None, help='Shard for customers without an ID (with EV_SHARD_MAP)')
+def import_data(entity, path, fmt, batch_size, show_rejects, region):
+    """Bulk load dealerships, customers, vehicles or payments from CSV/JSONL."""
+    from lib.helpers import setup_database
+    from lib.sharding import router_from_env
+    from lib import bulk
+    router = router_from_env()
+    session = None if router else setup_database()
+    try:
+        if router is not None:
+            report = bulk.load_sharded(router, entity, bulk.read_rows(path, fmt), batch_size, region)
+        else:
+            report = bulk.load(session, entity, bulk.read_rows(path, fmt), batch_size)
+        for line, row, error in report.rejected[:show_rejects]:
+            click.echo(f"  Rejected row {line}: {error}")
+        if len(report.rejected) > show_rejects:
+            click.echo(f"  ... {len(report.rejected) - show_rejects} more rejected rows")
+        click.echo(f"Imported {report.inserted} {entity} ({len(report.rejected)} rejected) in {report.elapsed:.2f}s, {report.rows_per_sec:.0f} rows/sec")
+    except Exception as e:
+        fail(f"Error importing {entity}: {e}")
+    finally:
+        if router is not None:
+            router.close()
+        else:
+            session.close()
+
+@cli.command(name='export')
+@click.argument('out_dir', type=click.Path(file_okay=False))
+@click.option('--entity', 'entities', type=click.Choice(ENTITIES), multiple=True, help='Entity to export; repeat for several (default: all)')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='auto', show_default=True, help='Parquet (needs pyarrow), NumPy .npy, or Parquet when available')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows read and written per chunk')
+@click.option('--full', is_flag=True, help='Discard earlier parts and watermarks and export every row')
+def export_data(out_dir, entities, fmt, chunk_size, full):
+    """Write rows added since the last export to columnar files under OUT_DIR.
+
+    With EV_SHARD_MAP set, each shard exports to OUT_DIR/<shard>, with its own watermarks.
+    """
+    from lib import export
+    sessions = shard_sessions()
+    try:
+        started = time.perf_counter()
+        total = 0
+        for shard, session in sessions:
+            directory = out_dir if shard is None else os.path.join(out_dir, shard)
+            written = export.export(session, directory, entities or ENTITIES, fmt, chunk_size, full)
+            for entity, rows in written.items():
+                click.echo(f"  {entity}: {rows} new rows" if shard is None else f"  {shard} {entity}: {rows} new rows")
+            total += sum(written.values())
+        click.echo(f"Exported {total} rows to {out_dir} in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        fail(f"Error exporting: {e}")
+    finally:
+        for _, session in sessions:
+            session.close()
+
+@cli.command()
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None, help='Input format (default: from file extension)')
+@click.option('--show-rejects', type=int, default=20, show_default=True, help='Maximum rejected rows to print')
+def ingest_payments(path, fmt, show_rejects):
+    """Post a settlement file of payments (vehicle_id, customer_id, amount, reference[, payment_date])."""
+    from lib.models import Payment
+    from lib.helpers import setup_database
+    from lib.sharding import router_from_env
+    from lib import bulk
+    router = router_from_env()
+    session = None if router else setup_database()
+    try:
+        started = time.perf_counter()
+        # Malformed lines come through as None and are rejected with their row number.
+        rows = (row for row, error in bulk.read_rows(path, fmt))
+        if router is not None:
+            result = Payment.bulk_ingest_sharded(router, rows)
+        else:
+            result = Payment.bulk_ingest(session, rows)
+        elapsed = time.perf_counter() - started
+        for number, row, error in result['rejected'][:show_rejects]:
+            click.echo(f"  Rejected row {number}: {error}")
+        if len(result['rejected']) > show_rejects:
+            click.echo(f"  ... {len(result['rejected']) - show_rejects} more rejected rows")
+        click.echo(f"Ingested {result['inserted']} payments, skipped {len(result['duplicates'])} already posted, rejected {len(result['rejected'])} in {elapsed:.2f}s")
+    except Exception as e:
+        fail(f"Error ingesting payments: {e}")
+    finally:
+        if router is not None:
+            router.close()
+        else:
+            session.close()
+
+@cli.command()
+@click.option('--before', type=click.DateTime(['%Y-%m-%d']), required=True, help='Archive payments dated before this day')
+@click.option('--batch-size', type=click.IntRange(min=1), default=DEFAULT_BATCH_SIZE, show_default=True, help='Vehicles moved per transaction')
+def archive(before, batch_size):
+    """Move old payments of fully paid vehicles to the archive database, keeping their totals."""
+    from lib.archive import archive_payments
+    sessions = shard_sessions()
+    try:
+        started = time.perf_counter()
+        moved = {'vehicles': 0, 'archived': 0}
+        for _, session in sessions:
+            for key, count in archive_payments(session, before, batch_size).items():
+                moved[key] += count
+        click.echo(f"Archived {moved['archived']} payments of {moved['vehicles']} vehicles in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        fail(f"Error archiving payments: {e}")
+    finally:
+        for _, session in sessions:
+            session.close()
+
+@cli.command()
+@click.option('--dry-run', is_flag=True, help='Report drift without rewriting the ledger')
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True, help='Processes scanning vehicle ID ranges in parallel')
+def reconcile(dry_run, workers):
+    """Recompute per-vehicle payment totals and report any drift and payment anomalies."""
+    from lib.models import Vehicle
+    from lib.parallel import Audit, audit_fleet
+    sessions = shard_sessions()
+    try:
+        audits = [(session, audit_fleet(session, workers)) for _, session in sessions]
+        audit = Audit()
+        for _, part in audits:
+            audit.merge(part)
+        for anomaly in audit.anomalies():
+            payment = f", Payment ID {anomaly['payment_id']}" if anomaly['payment_id'] is not None else ""
+            click.echo(f"  Vehicle ID {anomaly['vehicle_id']}{payment}: {anomaly['kind'].replace('_', ' ')}, {anomaly['detail']}")
+        drift = audit.drift
+        if drift and not dry_run:
+            # Rechecked under the write lock; a vehicle paid since the scan may no longer be drifted.
+            drift = [row for session, part in audits if part.drift for row in Vehicle.rewrite_ledger(session, part.drift)]
+        action = "found" if dry_run else "fixed"
+        click.echo(f"Reconciled payment ledger: {len(drift)} vehicles with drift {action},"
+                   f" {len(audit.owner_mismatches)} payments not from the vehicle owner, {len(audit.overpaid)} vehicles overpaid")
+    except Exception as e:
+        fail(f"Error reconciling payments: {e}")
+    finally:
+        for _, session in sessions:
+            session.close()
+
+@cli.group()
+def report():
+    """Fleet-wide balance and revenue reports."""
+    pass
+
+def report_options(f):
+    f = click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='text', show_default=True, help='Output format')(f)
+    f = click.option('--dealership', 'dealership_id', type=int, default=None, help='Only include this dealership ID')(f)
+    return f
+
+since_option = click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='Only consider payments on or after this date')
+
+@report.command()
+@report_options
+def balances(dealership_id, fmt):
+    """Outstanding balance per customer."""
+    from lib.helpers import echo_records
+    from lib import reports
+    rows = gather_rows(lambda session: reports.customer_balances(session, dealership_id))
+    try:
+        count = echo_records(rows, fmt, reports.CUSTOMER_BALANCE_FIELDS,
+                             lambda r: f"Customer ID: {r['customer_id']}, Name: {r['customer']}, Vehicles: {r['vehicles']}, Total Paid: ${r['total_paid']:.2f}, Outstanding: ${r['outstanding']:.2f}")
+        if not count and fmt == 'text':
+            click.echo("No customer balances found.")
+    except Exception as e:
+        fail(f"Error building report: {e}")
+    finally:
+        rows.close()
+
+@report.command()
+@report_options
+@since_option
+@click.option('--include-archived', is_flag=True, help='Also count payments moved to the archive')
+def revenue(dealership_id, fmt, since, include_archived):
+    """Revenue per dealership per month."""
+    from lib.helpers import echo_records
+    from lib import reports
+    rows = gather_rows(lambda session: reports.dealership_revenue(session, dealership_id, since, include_archived))
+    try:
+        count = echo_records(rows, fmt, reports.DEALERSHIP_REVENUE_FIELDS,
+                             lambda r: f"Dealership ID: {r['dealership_id']}, Name: {r['dealership']}, Month: {r['month']}, Payments: {r['payments']}, Revenue: ${r['revenue']:.2f}")
+        if not count and fmt == 'text':
+            click.echo("No revenue found.")
+    except Exception as e:
+        fail(f"Error building report: {e}")
+    finally:
+        rows.close()
+
+@report.command()
+@report_options
+@since_option
+def status(dealership_id, fmt, since):
+    """Sold vehicles that are fully paid or overdue (no payment since --since, default 30 days ago)."""
+    from lib.helpers import echo_records
+    from lib import reports
+    rows = gather_rows(lambda session: reports.vehicle_status(session, dealership_id, since))
+    try:
+        count = echo_records(rows, fmt, reports.VEHICLE_STATUS_FIELDS,
+                             lambda r: f"Vehicle ID: {r['vehicle_id']}, Model: {r['model']}, Customer ID: {r['customer_id']}, Outstanding: ${r['outstanding']:.2f}, Last Payment: {r['last_payment'] or 'Never'}, Status: {r['status']}")
+        if not count and fmt == 'text':
+            click.echo("No fully paid or overdue vehicles found.")
+    except Exception as e:
+        fail(f"Error building report: {e}")
+    finally:
+        rows.close()
+
+@report.command()
+@click.option('--by', type=click.Choice(['dealership', 'customer']), default='dealership', show_default=True, help='Group totals by')
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True, help='Processes scanning vehicle ID ranges in parallel')
+@click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='text', show_default=True, help='Output format')
+def totals(by, workers, fmt):
+    """Vehicles, price, payments received and outstanding balance per dealership or customer."""
+    from lib.helpers import echo_records
+    from lib import parallel
+    sessions = shard_sessions()
+    try:
+        audit = parallel.Audit()
+        for _, session in sessions:
+            audit.merge(parallel.audit_fleet(session, workers))
+        if by == 'dealership':
+            count = echo_records(audit.dealership_totals(), fmt, parallel.DEALERSHIP_TOTAL_FIELDS,
+                                 lambda r: f"Dealership ID: {r['dealership_id']}, Vehicles: {r['vehicles']}, Sold: {r['sold']}, Total Paid: ${r['total_paid']:.2f}, Outstanding: ${r['outstanding']:.2f}, Payments: {r['payments']}")
+        else:
+            count = echo_records(audit.customer_totals(), fmt, parallel.CUSTOMER_TOTAL_FIELDS,
+                                 lambda r: f"Customer ID: {r['customer_id']}, Vehicles: {r['vehicles']}, Total Paid: ${r['total_paid']:.2f}, Outstanding: ${r['outstanding']:.2f}, Payments: {r['payments']}")
+        if not count and fmt == 'text':
+            click.echo("No vehicles found.")
+    except Exception as e:
+        fail(f"Error building report: {e}")
+    finally:
+        for _, session in sessions:
+            session.close()
+
+@cli.group()
+def analytics():
+    """Vectorized payment analytics (needs numpy)."""
+    pass
+
+def analytics_options(f):
+    f = click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='text', show_default=True, help='Output format')(f)
+    f = click.option('--dealership', 'dealership_id', type=int, default=None, help='Only include this dealership ID')(f)
+    return f
+
+as_of_option = click.option('--as-of', type=click.DateTime(['%Y-%m-%d']), default=None, help='Evaluate as of this date (default: now)')
+
+def run_analytics(label, dealership_id, fmt, fields, text, build):
+    """Load the payment arrays and echo the records build(lib.analytics, payments, vehicles) yields.
+
+    fields names the lib.analytics field list, which can't be imported until numpy is.
+    With EV_SHARD_MAP set, the arrays of every shard are joined in id order.
+    """
+    from lib.helpers import echo_records
+    sessions = shard_sessions()
+    try:
+        from lib import analytics
+        payments = analytics.concatenate([analytics.load_payments(session, dealership_id) for _, session in sessions])
+        vehicles = analytics.concatenate([analytics.load_vehicles(session, dealership_id) for _, session in sessions])
+        count = echo_records(build(analytics, payments, vehicles), fmt, getattr(analytics, fields), text)
+        if not count and fmt == 'text':
+            click.echo(f"No {label} found.")
+    except Exception as e:
+        fail(f"Error computing {label}: {e}")
+    finally:
+        for _, session in sessions:
+            session.close()
+
+@analytics.command()
+@analytics_options
+def intervals(dealership_id, fmt):
+    """Days between consecutive instalments per vehicle."""
+    run_analytics("instalment intervals", dealership_id, fmt, 'INTERVAL_FIELDS',
+                  lambda r: f"Vehicle ID: {r['vehicle_id']}, Payments: {r['payments']}, Mean Days: {r['mean_days']}, Min: {r['min_days']}, Max: {r['max_days']}",
+                  lambda analytics, payments, vehicles: analytics.instalment_intervals(payments))
+
+@analytics.command(name='balances')
+@analytics_options
+def analytics_balances(dealership_id, fmt):
+    """Balance left on the vehicle after each payment, per vehicle in date order."""
+    run_analytics("payments", dealership_id, fmt, 'BALANCE_FIELDS',
+                  lambda r: f"Vehicle ID: {r['vehicle_id']}, Customer ID: {r['customer_id']}, Date: {r['payment_date']}, Amount: ${r['amount']:.2f}, Balance: ${r['balance']:.2f}",
+                  lambda analytics, payments, vehicles: analytics.balance_history(payments, vehicles))
+
+@analytics.command(name='revenue')
+@analytics_options
+@click.option('--period', type=click.Choice(['day', 'month', 'year']), default='month', show_default=True, help='Bucket size')
+def analytics_revenue(dealership_id, fmt, period):
+    """Payments and revenue per calendar period."""
+    run_analytics("revenue", dealership_id, fmt, 'REVENUE_FIELDS',
+                  lambda r: f"Period: {r['period']}, Payments: {r['payments']}, Revenue: ${r['revenue']:.2f}",
+                  lambda analytics, payments, vehicles: analytics.revenue_by_period(payments, period))
+
+@analytics.command()
+@analytics_options
+@as_of_option
+def velocity(dealership_id, fmt, as_of):
+    """Payment rate per customer and a straight-line payoff forecast."""
+    run_analytics("payment velocity", dealership_id, fmt, 'VELOCITY_FIELDS',
+                  lambda r: f"Customer ID: {r['customer_id']}, Paid: ${r['paid']:.2f}, Outstanding: ${r['outstanding']:.2f}, Per Day: ${r['paid_per_day']:.2f}, Payoff: {r['forecast_payoff']} ({r['days_to_payoff']} days)",
+                  lambda analytics, payments, vehicles: analytics.payment_velocity(payments, vehicles, as_of))
+
+@analytics.command()
+@analytics_options
+@as_of_option
+@click.option('--days', type=click.IntRange(min=1), default=30, show_default=True, help='Overdue after this many days without a payment')
+def overdue(dealership_id, fmt, as_of, days):
+    """Sold vehicles with a balance left and no recent payment."""
+    run_analytics("overdue vehicles", dealership_id, fmt, 'OVERDUE_FIELDS',
+                  lambda r: f"Vehicle ID: {r['vehicle_id']}, Customer ID: {r['customer_id']}, Outstanding: ${r['outstanding']:.2f}, Last Payment: {r['last_payment'] or 'Never'}",
+                  lambda analytics, payments, vehicles: analytics.overdue_vehicles(payments, vehicles, as_of, days))
+
+@cli.group()
+def search():
+    """Ranked prefix search over customers, vehicles and dealerships."""
+    pass
+
+def search_options(f):
+    f = click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='text', show_default=True, help='Output format')(f)
+    f = click.option('--offset', type=click.IntRange(min=0), default=0, help='Skip this many matches (for paging)')(f)
+    f = click.option('--limit', type=click.IntRange(min=1), default=20, show_default=True, help='Maximum matches to show')(f)
+    f = click.argument('query')(f)
+    return f
+
+@search.command(name='customers')
+@search_options
+def search_customers(query, limit, offset, fmt):
+    """Customers by words or word prefixes of their name or email."""
+    from lib.models import Customer
+    from lib.helpers import echo_records
+    try:
+        records = ({'id': c.id, 'name': c.name, 'email': c.email} for c in search_matches(Customer, query, limit, offset))
+        count = echo_records(records, fmt, ['id', 'name', 'email'],
+                             lambda c: f"ID: {c['id']}, Name: {c['name']}, Email: {c['email']}")
+        if not count and fmt == 'text':
+            click.echo("No matching customers found.")
+    except Exception as e:
+        fail(f"Error searching customers: {e}")
+
+@search.command(name='vehicles')
+@search_options
+def search_vehicles(query, limit, offset, fmt):
+    """Vehicles by words or word prefixes of their model."""
+    from lib.models import Vehicle
+    from lib.helpers import echo_records
+    try:
+        records = ({'id': v.id, 'model': v.model, 'price': v.price, 'dealership_id': v.dealership_id, 'customer_id': v.customer_id}
+                   for v in search_matches(Vehicle, query, limit, offset))
+        count = echo_records(records, fmt, ['id', 'model', 'price', 'dealership_id', 'customer_id'],
+                             lambda v: f"ID: {v['id']}, Model: {v['model']}, Price: ${v['price']}, Dealership ID: {v['dealership_id']}, Customer ID: {v['customer_id']}")
+        if not count and fmt == 'text':
+            click.echo("No matching vehicles found.")
+    except Exception as e:
+        fail(f"Error searching vehicles: {e}")
+
+@search.command(name='dealerships')
+@search_options
+def search_dealerships(query, limit, offset, fmt):
+    """Dealerships by words or word prefixes of their name or location."""
+    from lib.models import Dealership
+    from lib.helpers import echo_records
+    try:
+        records = ({'id': d.id, 'name': d.name, 'location': d.location} for d in search_matches(Dealership, query, limit, offset))
+        count = echo_records(records, fmt, ['id', 'name', 'location'],
+                             lambda d: f"ID: {d['id']}, Name: {d['name']}, Location: {d['location']}")
+        if not count and fmt == 'text':
+            click.echo("No matching dealerships found.")
+    except Exception as e:
+        fail(f"Error searching dealerships: {e}")
+
+@cli.command(name='migrate')
+@click.option('--url', default=None, help='Database URL (default: EV_DATABASE_URL or the local database)')
+def migrate_database(url):
+    """Apply pending schema and index migrations."""
+    from lib.helpers import get_engine
+    from lib.migrations import schema_version
+    try:
+        with get_engine(url).connect() as conn:
+            click.echo(f"Database schema is at version {schema_version(conn)}")
+    except Exception as e:
+        fail(f"Error migrating database: {e}")
+
+@cli.command()
+@click.option('--since', type=click.IntRange(min=0), default=0, show_default=True, help='Only show changes after this sequence number')
+@click.option('--entity', 'entities', type=click.Choice(ENTITIES), multiple=True, help='Only show changes to this entity; repeat for several (default: all)')
+@click.option('--follow', is_flag=True, help='Keep waiting for new changes until interrupted')
+@click.option('--batch-size', type=click.IntRange(min=1), default=DEFAULT_BATCH_SIZE, show_default=True, help='Changes read per query')
+@click.option('--poll-interval', type=click.FloatRange(min=0.01), default=1.0, show_default=True, help='Seconds between polls with --follow')
+@click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='jsonl', show_default=True, help='Output format')
+def changes(since, entities, follow, batch_size, poll_interval, fmt):
+    """Stream logged inserts, updates and deletes in sequence order, for incremental sync."""
+    if os.environ.get('EV_SHARD_MAP'):
+        fail("Error: each shard keeps its own change log; set EV_DATABASE_URL to one shard's database")
+        return
+    from lib.helpers import setup_database, echo_records
+    from lib.changes import iter_changes, CHANGE_FIELDS
+    session = setup_database()
+    try:
+        rows = iter_changes(session, since, entities, batch_size, follow, poll_interval)
+        if fmt == 'csv':
+            rows = ({**r, 'data': json.dumps(r['data'])} for r in rows)
+        count = echo_records(rows, fmt, CHANGE_FIELDS,
+                             lambda r: f"Seq: {r['seq']}, {r['op'].capitalize()} {r['entity']} ID {r['row_id']} at {r['changed_at']}: {json.dumps(r['data'])}")
+        if not count and fmt == 'text':
+            click.echo(f"No changes since {since}.")
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        fail(f"Error reading changes: {e}")
+    finally:
+        session.close()
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', show_default=True, help='Address to listen on')
+@click.option('--port', type=int, default=8000, show_default=True, help='Port to listen on')
+@click.option('--verbose', is_flag=True, help='Log every request to stderr')
+def serve(host, port, verbose):
+    """Serve the HTTP/JSON API (see lib/server.py) until interrupted."""
+    if os.environ.get('EV_SHARD_MAP'):
+        fail("Error: serve works on one database; unset EV_SHARD_MAP and set EV_DATABASE_URL")
+        return
+    from lib.server import serve as serve_api
+    click.echo(f"Serving on http://{host}:{port}/ (Ctrl+C to stop)")
+    try:
+        serve_api(host, port, verbose=verbose)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        fail(f"Error starting server: {e}")
+
+@cli.command(name='run-script')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True), default='-')
+@click.option('--commit-every', type=int, default=0, show_default=True, help='Commit after this many successful commands (0: once, when the script ends)')
+@click.option('--on-error', type=click.Choice(['stop', 'continue']), default='stop', show_default=True, help='stop rolls back to the last commit and exits; continue skips the failed command')
+@click.option('--echo', is_flag=True, help='Echo each command before its output')
+def run_script(path, commit_every, on_error, echo):
+    """Run commands from a file or stdin (one per line, shell words or JSON) in one session."""
+    from lib.helpers import batch_session
+    if os.environ.get('EV_SHARD_MAP'):
+        fail("Error: run-script runs in one database transaction and can't be used with EV_SHARD_MAP")
+        return
+    commands = script.without_prompts(cli, exclude=('run-script',))
+    try:
+        with batch_session() as scope, click.open_file(path) as lines:
+            # readline() rather than iteration: click's test stdin raises EOFError from __next__.
+            report = script.run_script(commands, iter(lines.readline, ''), scope, commit_every, on_error, echo)
+    except Exception as e:
+        fail(f"Error running script: {e}")
+        return
+    if report.stopped_at is not None:
+        fail(f"Stopped at line {report.stopped_at}: {report.ran} commands run, {report.rolled_back} rolled back, {report.committed} committed")
+    elif report.failed:
+        fail(f"Ran {report.ran} commands, {report.failed} failed, {report.committed} committed")
+    else:
+        click.echo(f"Ran {report.ran} commands, {report.committed} committed", err=True)
+
+MENU = [
+    ("Create Dealership", ['create-dealership']),
+    ("Delete Dealership", ['delete-dealership']),
+    ("List Dealerships", ['list-dealerships']),
+    ("Find Dealership by ID", ['find-dealership']),
+    ("List Vehicles for Dealership", ['list-dealership-vehicles']),
+    ("Create Vehicle", ['create-vehicle']),
+    ("Delete Vehicle", ['delete-vehicle']),
+    ("List Vehicles", ['list-vehicles']),
+    ("Find Vehicle by ID", ['find-vehicle']),
+    ("Create Customer", ['create-customer']),
+    ("Delete Customer", ['delete-customer']),
+    ("List Customers", ['list-customers']),
+    ("Find Customer by ID", ['find-customer']),
+    ("List Vehicles Purchased by Customer", ['list-customer-vehicles']),
+    ("Create Payment", ['create-payment']),
+    ("List Payments for Vehicle", ['list-vehicle-payments']),
+]
+
+def menu():
+    """Interactive menu. Every choice runs in one long-lived session and is committed when it finishes."""
+    exit_choice = len(MENU) + 1
+    with ExitStack() as stack:
+        scope = None
+        while True:
+            click.echo("\nEV African Motors Menu:")
+            for number, (label, args) in enumerate(MENU, 1):
+                click.echo(f"{number}. {label}")
+            click.echo(f"{exit_choice}. Exit")
+            try:
+                choice = click.prompt(f"Enter your choice (1-{exit_choice})", type=int)
+            except click.Abort:
+                # End of input or Ctrl-C.
+                click.echo("\nExiting...")
+                break
             click.echo(f"Selected option: {choice}")
-            if choice == 1:
-                create_dealership()
-            elif choice == 2:
-                delete_dealership()
-            elif choice == 3:
-                list_dealerships()
-            elif choice == 4:
-                find_dealership()
-            elif choice == 5:
-                list_dealership_vehicles()
-            elif choice == 6:
-                create_vehicle()
-            elif choice == 7:
-                delete_vehicle()
-            elif choice == 8:
-                list_vehicles()
-            elif choice == 9:
-                find_vehicle()
-            elif choice == 10:
-                create_customer()
-            elif choice == 11:
-                delete_customer()
-            elif choice == 12:
-                list_customers()
-            elif choice == 13:
-                find_customer()
-            elif choice == 14:
-                list_customer_vehicles()
-            elif choice == 15:
-                create_payment()
-            elif choice == 16:
-                list_vehicle_payments()
-            elif choice == 17:
+            if choice == exit_choice:
                 click.echo("Exiting...")
                 break
+            if not 1 <= choice <= len(MENU):
+                click.echo(f"Invalid choice. Please select 1-{exit_choice}.")
+                continue
+            if scope is None:
+                # The engine and session are set up on the first command, not at startup.
+                from lib.helpers import batch_session
+                scope = stack.enter_context(batch_session())
+            if script.run_command(cli, MENU[choice - 1][1]):
+                scope.commit()
             else:
-                click.echo("Invalid choice. Please select 1-17.")
-        except ValueError:
-            click.echo("Error: Please enter a valid number between 1 and 17")
-        except Exception as e:
-            click.echo(f"Error in menu: {e}")
-        click.echo("")
+                scope.rollback()
+            click.echo("")
+
+def main(argv=None):
+    """Entry point: run the command given on the command line, or the interactive menu without one."""
+    args = sys.argv[1:] if argv is None else argv
+    if args:
+        cli.main(args, prog_name=script.PROG_NAME)
+    else:
+        menu()
 
 if __name__ == '__main__':
     main()
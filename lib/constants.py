@@ -0,0 +1,10 @@
+# lib/constants.py
+"""Settings shared by the CLI and the database layer.
+
+This module must not import SQLAlchemy or the models: lib.cli builds its
+options from it at import time, before any command touches the database.
+"""
+DEFAULT_BATCH_SIZE = 1000
+OUTPUT_FORMATS = ('text', 'csv', 'jsonl')
+ENTITIES = ('dealerships', 'customers', 'vehicles', 'payments')
+EXPORT_FORMATS = ('auto', 'parquet', 'npy')
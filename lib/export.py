@@ -0,0 +1,190 @@
+# lib/export.py
+"""Columnar export of the database for analytics, incremental by id watermark.
+
+    export(session, 'snapshot/')    # first run writes every row
+    export(session, 'snapshot/')    # later runs write only rows added since
+
+Each run appends one part per entity under <out_dir>/<entity>/ and records
+in <out_dir>/manifest.json the highest id written, so the next run selects
+WHERE id > watermark. Rows are read in chunks inside a single read
+transaction, which gives every entity the same snapshot without blocking
+writers (WAL), and written one chunk at a time so memory stays flat
+whatever the table size.
+
+Parts are Parquet when pyarrow is installed (one row group per chunk), or
+otherwise a directory of NumPy .npy arrays, one per column, that can be
+opened with numpy.load(path, mmap_mode='r'). In .npy parts, strings are
+dictionary-encoded as <column>.codes.npy (int32) indexing
+<column>.values.npy, and a missing customer_id is -1. Money is exported as
+integer cents (price_cents, amount_cents); timestamps as datetime64[us].
+
+Rows are exported as of their insertion; the ledger columns that change
+with every payment (vehicles.total_paid, payment_count) are left out, as
+analysts can derive them from the payments parts.
+"""
+import json
+import os
+import shutil
+from sqlalchemy import select
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.customer import Customer
+from lib.models.payment import Payment
+from lib.models.money import cents
+from lib.constants import ENTITIES, DEFAULT_BATCH_SIZE
+
+MANIFEST = 'manifest.json'
+MISSING_ID = -1
+
+# entity -> (model, [(column name, expression, kind)]); kind is int, nullable_int, str or datetime.
+EXPORT_COLUMNS = {
+    'dealerships': (Dealership, [('id', Dealership.id, 'int'), ('name', Dealership.name, 'str'),
+                                 ('location', Dealership.location, 'str')]),
+    'customers': (Customer, [('id', Customer.id, 'int'), ('name', Customer.name, 'str'),
+                             ('email', Customer.email, 'str')]),
+    'vehicles': (Vehicle, [('id', Vehicle.id, 'int'), ('model', Vehicle.model, 'str'),
+                           ('price_cents', cents(Vehicle.price), 'int'), ('dealership_id', Vehicle.dealership_id, 'int'),
+                           ('customer_id', Vehicle.customer_id, 'nullable_int')]),
+    'payments': (Payment, [('id', Payment.id, 'int'), ('vehicle_id', Payment.vehicle_id, 'int'),
+                           ('customer_id', Payment.customer_id, 'int'), ('amount_cents', cents(Payment.amount), 'int'),
+                           ('payment_date', Payment.payment_date, 'datetime'), ('status', Payment.status, 'str'),
+                           ('reference', Payment.reference, 'str')]),
+}
+
+
+def resolve_format(fmt='auto'):
+    """The concrete part format for fmt, checking that its library is importable."""
+    if fmt in ('auto', 'parquet'):
+        try:
+            import pyarrow  # noqa: F401
+            return 'parquet'
+        except ImportError:
+            if fmt == 'parquet':
+                raise RuntimeError("Parquet export needs pyarrow: pip install ev_african_motors[export]")
+    try:
+        import numpy  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError("Export needs pyarrow or numpy: pip install ev_african_motors[export]") from e
+    return 'npy'
+
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {'entities': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class _ParquetPart:
+    def __init__(self, path, columns, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        types = {'int': pa.int64(), 'nullable_int': pa.int64(), 'str': pa.string(), 'datetime': pa.timestamp('us')}
+        self.schema = pa.schema([(name, types[kind]) for name, _, kind in columns])
+        self.path = path + '.parquet'
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+
+    def write(self, chunk):
+        self.writer.write_table(self.pa.Table.from_pydict(chunk, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _NpyPart:
+    def __init__(self, path, columns, rows):
+        import numpy as np
+        self.np = np
+        self.path = path
+        # A part left by a failed run that never reached the manifest is overwritten.
+        os.makedirs(path, exist_ok=True)
+        self.kinds = {name: kind for name, _, kind in columns}
+        self.arrays, self.dictionaries = {}, {}
+        dtypes = {'int': 'int64', 'nullable_int': 'int64', 'str': 'int32', 'datetime': 'datetime64[us]'}
+        for name, kind in self.kinds.items():
+            filename = f'{name}.codes.npy' if kind == 'str' else f'{name}.npy'
+            self.arrays[name] = np.lib.format.open_memmap(os.path.join(path, filename), mode='w+',
+                                                          dtype=dtypes[kind], shape=(rows,))
+            if kind == 'str':
+                self.dictionaries[name] = {}
+        self.offset = 0
+
+    def _codes(self, name, values):
+        dictionary = self.dictionaries[name]
+        return [MISSING_ID if value is None else dictionary.setdefault(value, len(dictionary)) for value in values]
+
+    def write(self, chunk):
+        count = len(chunk['id'])
+        for name, values in chunk.items():
+            kind = self.kinds[name]
+            if kind == 'str':
+                values = self._codes(name, values)
+            elif kind == 'nullable_int':
+                values = [MISSING_ID if value is None else value for value in values]
+            self.arrays[name][self.offset:self.offset + count] = values
+        self.offset += count
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+        for name, dictionary in self.dictionaries.items():
+            values = self.np.array(list(dictionary), dtype=str) if dictionary else self.np.array([], dtype='<U1')
+            self.np.save(os.path.join(self.path, f'{name}.values.npy'), values)
+        self.arrays.clear()
+
+
+PART_WRITERS = {'parquet': _ParquetPart, 'npy': _NpyPart}
+
+
+def export(session, out_dir, entities=ENTITIES, fmt='auto', chunk_size=DEFAULT_BATCH_SIZE, full=False):
+    """Write rows added since the last export of out_dir as columnar parts; return {entity: rows written}.
+
+    full=True discards the earlier parts and watermarks and exports everything.
+    """
+    fmt = resolve_format(fmt)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = read_manifest(out_dir)
+    if full:
+        for entity in entities:
+            shutil.rmtree(os.path.join(out_dir, entity), ignore_errors=True)
+            manifest['entities'].pop(entity, None)
+    written = {}
+    try:
+        for entity in entities:
+            model, columns = EXPORT_COLUMNS[entity]
+            state = manifest['entities'].setdefault(entity, {'watermark_id': 0, 'rows': 0, 'parts': []})
+            rows = session.query(model).filter(model.id > state['watermark_id']).count()
+            written[entity] = rows
+            if not rows:
+                continue
+            directory = os.path.join(out_dir, entity)
+            os.makedirs(directory, exist_ok=True)
+            name = f'part-{len(state["parts"]) + 1:05d}'
+            part = PART_WRITERS[fmt](os.path.join(directory, name), columns, rows)
+            names = [column_name for column_name, _, _ in columns]
+            query = (select(*(expression for _, expression, _ in columns))
+                     .where(model.id > state['watermark_id'])
+                     .order_by(model.id)
+                     .limit(rows))
+            try:
+                for chunk in session.execute(query).yield_per(chunk_size).partitions():
+                    part.write({column_name: list(values) for column_name, values in zip(names, zip(*chunk))})
+                    state['watermark_id'] = chunk[-1][0]
+            finally:
+                part.close()
+            state['rows'] += rows
+            state['parts'].append({'name': os.path.basename(part.path), 'format': fmt, 'rows': rows})
+    finally:
+        # End the read transaction; the snapshot is only needed while exporting.
+        session.commit()
+    _write_manifest(out_dir, manifest)
+    return written
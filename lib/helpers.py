@@ -1,14 +1,212 @@
 # lib/helpers.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from lib.models.base import Base
+import csv
+import io
+import json
+import os
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+import click
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from lib.models.base import Base, Session
 from lib.models.dealership import Dealership
 from lib.models.vehicle import Vehicle
 from lib.models.customer import Customer
 from lib.models.payment import Payment
+from lib.migrations import SCHEMA_VERSION, migrate
+from lib.models.cache import identity_cache
 
-def setup_database():
-    engine = create_engine('sqlite:///ev_african_motors.db')
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
+DATABASE_URL = 'sqlite:///ev_african_motors.db'
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    # Milliseconds a connection waits for another writer before failing with "database is locked".
+    'busy_timeout': 5000,
+    # Enforce the models' foreign keys, including their ON DELETE actions (SQLite leaves them off by default).
+    'foreign_keys': 'ON',
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def sqlite_pragmas():
+    """Return the pragmas applied to every new SQLite connection, honouring EV_SQLITE_* overrides."""
+    pragmas = dict(SQLITE_PRAGMAS)
+    for name in pragmas:
+        override = os.environ.get(f'EV_SQLITE_{name.upper()}')
+        if override not in (None, ''):
+            pragmas[name] = override
+    return pragmas
+
+
+def _apply_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def _use_explicit_begin(engine):
+    # pysqlite only opens a transaction lazily before DML, so an outer BEGIN is
+    # never sent and a session SAVEPOINT would commit on RELEASE. Take over
+    # transaction control and emit BEGIN ourselves (the SQLAlchemy recipe).
+    @event.listens_for(engine, 'connect')
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        # Write paths ask for IMMEDIATE (see lib.models.locking.begin_write).
+        mode = conn.get_execution_options().get('sqlite_begin')
+        conn.exec_driver_sql(f'BEGIN {mode}' if mode else 'BEGIN')
+
+
+def _create_engine(url, pool_size=None, max_overflow=None, pragmas=None, factory=create_engine):
+    """Create an engine with the pool settings and SQLite setup every engine here shares.
+
+    factory is create_engine, or create_async_engine for lib.aio.
+    """
+    options = {}
+    parsed = make_url(url)
+    in_memory = parsed.database in (None, '', ':memory:')
+    if not in_memory:
+        options['pool_size'] = pool_size if pool_size is not None else _env_int('EV_POOL_SIZE', 5)
+        options['max_overflow'] = max_overflow if max_overflow is not None else _env_int('EV_MAX_OVERFLOW', 10)
+    engine = factory(url, **options)
+    if engine.dialect.name == 'sqlite':
+        # Connection events live on the sync engine behind an AsyncEngine.
+        sync_engine = getattr(engine, 'sync_engine', engine)
+        _apply_pragmas(sync_engine, sqlite_pragmas() if pragmas is None else pragmas)
+        _use_explicit_begin(sync_engine)
+    return engine
+
+
+def ensure_schema(engine):
+    """Bring the schema up to SCHEMA_VERSION; a no-op once the database is stamped."""
+    return migrate(engine)
+
+
+def get_engine(url=None, **options):
+    """Return the process-wide engine for url, creating it and its schema on first use."""
+    url = url or os.environ.get('EV_DATABASE_URL') or DATABASE_URL
+    engine = _engines.get(url)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _create_engine(url, **options)
+            ensure_schema(engine)
+            _engines[url] = engine
+    return engine
+
+
+def dispose_engines():
+    """Close every pooled connection and forget the registered engines and cached entities."""
+    Session.remove()
+    identity_cache.clear()
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def setup_database(url=None):
+    engine = get_engine(url)
+    # Inside batch_session() the registry is bound to one of this engine's connections.
+    if getattr(Session.session_factory.kw.get('bind'), 'engine', None) is not engine:
+        Session.remove()
+        Session.configure(bind=engine)
     return Session()
+
+
+class BatchScope:
+    """The connection and outer transaction shared by every command in a batch_session()."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.transaction = connection.begin()
+
+    def commit(self):
+        Session.close()
+        self.transaction.commit()
+        self.transaction = self.connection.begin()
+
+    def rollback(self):
+        Session.close()
+        self.transaction.rollback()
+        # Snapshots cached during the batch may hold rows that no longer exist.
+        identity_cache.clear()
+        self.transaction = self.connection.begin()
+
+
+@contextmanager
+def batch_session(url=None):
+    """Bind the Session registry to one connection and transaction for a run of commands.
+
+    The registry joins the connection with a SAVEPOINT per session transaction,
+    so the session.commit() inside model methods only releases a savepoint and
+    nothing is durable until scope.commit(). Uncommitted work is committed when
+    the block exits normally and rolled back if it raises.
+    """
+    engine = get_engine(url)
+    previous = dict(Session.session_factory.kw)
+    connection = engine.connect()
+    Session.remove()
+    Session.configure(bind=connection, join_transaction_mode='create_savepoint')
+    try:
+        scope = BatchScope(connection)
+        try:
+            yield scope
+        except BaseException:
+            scope.rollback()
+            raise
+        scope.commit()
+    finally:
+        Session.remove()
+        Session.session_factory.kw.clear()
+        Session.session_factory.kw.update(previous)
+        connection.close()
+
+
+def _json_value(value):
+    # Two-place money amounts print the same digits as a float, so they stay JSON numbers.
+    return float(value) if isinstance(value, Decimal) else str(value)
+
+
+def echo_records(records, fmt, fields, text):
+    """Echo dict records one at a time as text lines, CSV or JSON lines; return how many were written.
+
+    text is a callable that renders one record for the human-readable format.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore', lineterminator='\n')
+    count = 0
+    for record in records:
+        if fmt == 'jsonl':
+            click.echo(json.dumps({field: record[field] for field in fields}, default=_json_value))
+        elif fmt == 'csv':
+            if count == 0:
+                writer.writeheader()
+            writer.writerow(record)
+            click.echo(buffer.getvalue(), nl=False)
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            click.echo(text(record))
+        count += 1
+    return count
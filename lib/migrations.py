@@ -0,0 +1,193 @@
+# lib/migrations.py
+from sqlalchemy import String
+from sqlalchemy.schema import CreateIndex, CreateTable
+from lib.models.base import Base
+from lib.models.vehicle import Vehicle
+from lib.models.payment import Payment, PaymentRollup
+from lib.models.search import create_search_indexes
+from lib.models.changes import create_change_triggers
+
+
+def create_schema(conn):
+    fill_out_key_only_tables(conn)
+    Base.metadata.create_all(conn)
+
+
+def columns(conn, table):
+    return {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info({table})')}
+
+
+def fill_out_key_only_tables(conn):
+    """Add the model's columns to tables that hold nothing but their id and foreign keys.
+
+    The earliest database files (lib/models/database.db among them) have
+    tables of that layout, which the later steps can't index or migrate.
+    Rows already there get '' or 0 in the added columns that can't be NULL.
+    """
+    for table in Base.metadata.sorted_tables:
+        existing = columns(conn, table.name)
+        keys = {column.name for column in table.columns if column.primary_key or column.foreign_keys}
+        if not existing or not existing <= keys:
+            continue
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'{column.name} {column.type.compile(dialect=conn.dialect)}'
+            if not column.nullable:
+                ddl += " NOT NULL DEFAULT " + ("''" if isinstance(column.type, String) else '0')
+            conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+
+
+def create_indexes(conn, *names):
+    """Create the named indexes as declared on the models, skipping any that exist."""
+    declared = {index.name: index for table in Base.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        conn.execute(CreateIndex(declared[name], if_not_exists=True))
+
+
+# The indexes added at version 2.
+LOOKUP_INDEXES = ('ix_vehicles_dealership_id', 'ix_vehicles_customer_id', 'ix_payments_customer_id',
+                  'ix_payments_vehicle_id_payment_date', 'ix_payments_payment_date', 'ix_dealerships_name_lower')
+
+
+def add_lookup_indexes(conn):
+    # Databases created before version 2 have the tables but none of the indexes.
+    create_indexes(conn, *LOOKUP_INDEXES)
+    conn.exec_driver_sql('ANALYZE')
+
+
+def add_payment_ledger(conn):
+    existing = columns(conn, 'vehicles')
+    if 'total_paid_cents' in existing:
+        # Created at version 5 or later, with the ledger already in cents.
+        return
+    if 'total_paid' not in existing:
+        conn.exec_driver_sql('ALTER TABLE vehicles ADD COLUMN total_paid FLOAT NOT NULL DEFAULT 0')
+    if 'payment_count' not in existing:
+        conn.exec_driver_sql('ALTER TABLE vehicles ADD COLUMN payment_count INTEGER NOT NULL DEFAULT 0')
+    conn.exec_driver_sql(
+        'UPDATE vehicles SET '
+        'total_paid = (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE payments.vehicle_id = vehicles.id), '
+        'payment_count = (SELECT COUNT(*) FROM payments WHERE payments.vehicle_id = vehicles.id)')
+
+
+def add_payment_reference(conn):
+    if 'reference' not in columns(conn, 'payments'):
+        conn.exec_driver_sql('ALTER TABLE payments ADD COLUMN reference VARCHAR')
+    create_indexes(conn, 'ix_payments_reference')
+
+
+def store_money_in_cents(conn):
+    # Float amounts become integer cents in new *_cents columns; the ledger is
+    # re-summed from the rounded payments so it agrees with them exactly.
+    for table, column in (('vehicles', 'price'), ('vehicles', 'total_paid'), ('payments', 'amount')):
+        if f'{column}_cents' not in columns(conn, table):
+            conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column}_cents INTEGER NOT NULL DEFAULT 0')
+            conn.exec_driver_sql(f'UPDATE {table} SET {column}_cents = CAST(ROUND({column} * 100) AS INTEGER)')
+            conn.exec_driver_sql(f'ALTER TABLE {table} DROP COLUMN {column}')
+    conn.exec_driver_sql(
+        'UPDATE vehicles SET total_paid_cents = '
+        '(SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE payments.vehicle_id = vehicles.id)')
+
+
+def foreign_keys(conn, table):
+    """{(column, referenced table, ON DELETE action)} as the database has them."""
+    return {(row[3], row[2], row[6].upper()) for row in conn.exec_driver_sql(f'PRAGMA foreign_key_list({table})')}
+
+
+def declared_foreign_keys(table):
+    return {(fk.parent.name, fk.column.table.name, (fk.ondelete or 'NO ACTION').upper()) for fk in table.foreign_keys}
+
+
+def rebuild_table(conn, table):
+    """Recreate table from its model definition and copy its rows across, keeping ids.
+
+    SQLite can't alter a constraint in place, so this is its documented
+    create / copy / drop / rename procedure. Needs foreign key enforcement
+    off (see migrate) so dropping the old table deletes nothing else; the
+    table's indexes and triggers go with it and are recreated by the caller.
+    """
+    staging = f'{table.name}_rebuild'
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {staging} ', 1))
+    listed = ', '.join(column.name for column in table.columns)
+    conn.exec_driver_sql(f'INSERT INTO {staging} ({listed}) SELECT {listed} FROM {table.name}')
+    conn.exec_driver_sql(f'DROP TABLE {table.name}')
+    conn.exec_driver_sql(f'ALTER TABLE {staging} RENAME TO {table.name}')
+    for index in table.indexes:
+        conn.execute(CreateIndex(index))
+    conn.exec_driver_sql(f'ANALYZE {table.name}')
+
+
+def add_cascading_foreign_keys(conn):
+    # Tables created before version 7 have plain foreign keys (no ON DELETE
+    # action); rebuild the ones whose constraints differ from the models.
+    rebuilt = False
+    for table in (Payment.__table__, Vehicle.__table__):
+        if foreign_keys(conn, table.name) != declared_foreign_keys(table):
+            rebuild_table(conn, table)
+            rebuilt = True
+    if rebuilt:
+        # The search index triggers on vehicles were dropped with the old table.
+        create_search_indexes(conn)
+
+
+def add_payment_rollups(conn):
+    PaymentRollup.__table__.create(conn, checkfirst=True)
+
+
+# (version, step) pairs applied in order to databases stamped with an older
+# PRAGMA user_version. Append new steps; never renumber existing ones.
+MIGRATIONS = [
+    (1, create_schema),
+    (2, add_lookup_indexes),
+    (3, add_payment_ledger),
+    (4, add_payment_reference),
+    (5, store_money_in_cents),
+    (6, create_search_indexes),
+    (7, add_cascading_foreign_keys),
+    (8, add_payment_rollups),
+    (9, create_change_triggers),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def _set_foreign_keys(conn, enabled):
+    """Switch SQLite foreign key enforcement for this connection; return whether it was on.
+
+    The pragma is a no-op inside a transaction, so it goes straight to the
+    driver connection, ahead of the BEGIN SQLAlchemy would emit.
+    """
+    driver = conn.connection.driver_connection
+    was_enabled = bool(driver.execute('PRAGMA foreign_keys').fetchone()[0])
+    driver.execute(f'PRAGMA foreign_keys = {"ON" if enabled else "OFF"}')
+    return was_enabled
+
+
+def migrate(engine):
+    """Apply every pending migration step in one transaction; return the versions applied."""
+    if engine.dialect.name != 'sqlite':
+        with engine.begin() as conn:
+            create_schema(conn)
+        return []
+    with engine.connect() as conn:
+        # Table rebuilds drop and recreate tables that others reference.
+        enforced = _set_foreign_keys(conn, False)
+        try:
+            with conn.begin():
+                current = schema_version(conn)
+                applied = []
+                for version, step in MIGRATIONS:
+                    if version > current:
+                        step(conn)
+                        applied.append(version)
+                if applied:
+                    conn.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        finally:
+            _set_foreign_keys(conn, enforced)
+        return applied
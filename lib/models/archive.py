@@ -0,0 +1,98 @@
+# lib/models/archive.py
+"""The archive database holding payments moved out of the hot table by lib.archive.
+
+It is a separate SQLite file next to the main one (fleet.db archives to
+fleet.archive.db), attached as schema "archive" on the connections that
+read or write it. archived_payments mirrors the payments table there,
+without foreign keys, which SQLite can't declare across databases.
+"""
+import os
+from sqlalchemy import MetaData, Table, Column, Index, select, delete
+from .payment import Payment
+
+ARCHIVE_SCHEMA = 'archive'
+
+archived_payments = Table(
+    'payments', MetaData(),
+    *(Column(column.name, column.type, key=column.key, primary_key=column.primary_key)
+      for column in Payment.__table__.columns),
+    Index('ix_archive_payments_vehicle_id_payment_date', 'vehicle_id', 'payment_date'),
+    Index('ix_archive_payments_customer_id', 'customer_id'),
+    Index('ix_archive_payments_reference', 'reference'),
+    schema=ARCHIVE_SCHEMA)
+
+
+def archive_path(session):
+    """The archive file for session's database, or None for databases that can't have one."""
+    url = session.get_bind().engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    stem, extension = os.path.splitext(url.database)
+    return f'{stem}.archive{extension or ".db"}'
+
+
+def attach_archive(session, create=False):
+    """Attach the archive to session's connection if it exists (or create=True); return whether it is attached.
+
+    An attachment lasts as long as the pooled connection, so call this again
+    after every commit, which may hand the session a different connection.
+    """
+    path = archive_path(session)
+    if path is None:
+        return False
+    # Without an archive file there's nothing to attach, and no statement is spent finding out.
+    if not create and not os.path.exists(path):
+        return False
+    connection = session.connection()
+    if any(row[1] == ARCHIVE_SCHEMA for row in connection.exec_driver_sql('PRAGMA database_list')):
+        return True
+    connection.exec_driver_sql(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+    if create:
+        archived_payments.create(connection, checkfirst=True)
+    return True
+
+
+def _as_payments(session, query):
+    # Transient Payment objects: they print and sort like hot payments but belong to no session.
+    return [Payment(**{column.key: row._mapping[column] for column in archived_payments.columns})
+            for row in session.execute(query)]
+
+
+def archived_payments_for(session, vehicle_id, since=None, until=None):
+    """The vehicle's archived payments (since <= payment_date < until) as transient Payments, oldest first."""
+    if not attach_archive(session):
+        return []
+    query = select(archived_payments).where(archived_payments.c.vehicle_id == vehicle_id)
+    if since is not None:
+        query = query.where(archived_payments.c.payment_date >= since)
+    if until is not None:
+        query = query.where(archived_payments.c.payment_date < until)
+    return _as_payments(session, query.order_by(archived_payments.c.payment_date, archived_payments.c.id))
+
+
+def archived_references(session, references):
+    """The settlement references among `references` that were posted and have since been archived."""
+    if not references or not attach_archive(session):
+        return set()
+    return set(session.scalars(select(archived_payments.c.reference)
+                               .where(archived_payments.c.reference.in_(references))))
+
+
+def delete_archived_payments(session, vehicle_ids):
+    """Delete the archived payments of these vehicles; return how many were deleted.
+
+    Call it inside the write transaction that deletes the vehicles, so an
+    archived payment never outlives its vehicle (and keeps blocking
+    Customer.delete).
+    """
+    if not vehicle_ids or not attach_archive(session):
+        return 0
+    return session.execute(delete(archived_payments)
+                           .where(archived_payments.c.vehicle_id.in_(vehicle_ids))).rowcount
+
+
+def has_archived_payments(session, customer_id):
+    if not attach_archive(session):
+        return False
+    return session.execute(select(archived_payments.c.id)
+                           .where(archived_payments.c.customer_id == customer_id).limit(1)).first() is not None
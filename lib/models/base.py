@@ -1,6 +1,24 @@
 # lib/models/base.py
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+from lib.constants import DEFAULT_BATCH_SIZE
 
 Base = declarative_base()
-Session = sessionmaker()
\ No newline at end of file
+# Process-wide session registry; lib.helpers binds it to the shared engine.
+Session = scoped_session(sessionmaker())
+
+
+def iter_keyset(query, id_column, batch_size=DEFAULT_BATCH_SIZE, after_id=None):
+    """Yield query rows in id order, fetching WHERE id > last ORDER BY id LIMIT batch_size pages."""
+    last_id = after_id
+    while True:
+        page = query.order_by(None).order_by(id_column)
+        if last_id is not None:
+            page = page.filter(id_column > last_id)
+        fetched = 0
+        for row in page.limit(batch_size).yield_per(batch_size):
+            fetched += 1
+            last_id = row.id
+            yield row
+        if fetched < batch_size:
+            return
@@ -0,0 +1,163 @@
+# lib/models/cache.py
+"""Process-wide read-through cache for find_by_id lookups.
+
+Entries are detached snapshots of an instance's column values, keyed by
+(database, class, id). A hit is attached to the caller's session with
+merge(load=False), so it costs no SELECT; an instance the session already
+holds is returned as it is, pending edits included. Entries are dropped when a
+session flushes a change to the instance, and every entry for a table is
+dropped when a bulk UPDATE/DELETE runs against it. The TTL bounds how
+stale an entry can get when another process writes to the database.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from .base import Base
+
+
+class EntityCache:
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_class(self, cls):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] is cls]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+identity_cache = EntityCache(
+    maxsize=int(os.environ.get('EV_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('EV_CACHE_TTL', 300)))
+
+
+def _detached_copy(instance):
+    mapper = inspect(instance).mapper
+    copy = mapper.class_manager.new_instance()
+    for prop in mapper.column_attrs:
+        set_committed_value(copy, prop.key, getattr(instance, prop.key))
+    make_transient_to_detached(copy)
+    return copy
+
+
+def _database(session):
+    # Key on the database rather than the Engine, so a session bound to a
+    # Connection (lib.helpers.batch_session) or to the async engine's sync
+    # side (lib.aio) shares and invalidates the same entries.
+    url = session.get_bind().engine.url
+    return (url.get_backend_name(), url.host, url.port, url.database)
+
+
+def cached_get(session, cls, id):
+    """session.get(cls, id), served from identity_cache when possible."""
+    if id is None:
+        return None
+    key = (_database(session), cls, id)
+    # An instance the session already holds may carry unflushed edits that a
+    # merge would overwrite, so it is returned as it is; it can still fill
+    # the cache for other sessions while its values are clean and loaded.
+    held = session.identity_map.get(inspect(cls).identity_key_from_primary_key((id,)))
+    if held is not None:
+        state = inspect(held)
+        if identity_cache.get(key) is None and not state.modified and not state.expired_attributes:
+            identity_cache.put(key, _detached_copy(held))
+        return held
+    snapshot = identity_cache.get(key)
+    if snapshot is not None:
+        return session.merge(snapshot, load=False)
+    instance = session.get(cls, id)
+    if instance is not None:
+        identity_cache.put(key, _detached_copy(instance))
+    return instance
+
+
+def _cache_key(session, instance):
+    identity = inspect(instance).identity
+    if identity is None:
+        return None
+    return (_database(session), type(instance), identity[0])
+
+
+def invalidate_instance(session, instance):
+    """Drop instance's entry now and again when session commits.
+
+    For writes that bypass the unit of work, such as a Core UPDATE on the
+    session's connection, which would otherwise leave the entry stale.
+    """
+    key = _cache_key(session, instance)
+    if key is not None:
+        identity_cache.invalidate(key)
+        session.info.setdefault('identity_cache_keys', set()).add(key)
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _invalidate_flushed(session, flush_context):
+    for instance in list(session.dirty) + list(session.deleted) + list(session.new):
+        invalidate_instance(session, instance)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _invalidate_committed(session):
+    # A concurrent reader may have re-cached the old row between flush and commit.
+    for key in session.info.pop('identity_cache_keys', ()):
+        identity_cache.invalidate(key)
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('identity_cache_keys', None)
+
+
+@event.listens_for(OrmSession, 'do_orm_execute')
+def _invalidate_bulk_writes(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    for mapper in Base.registry.mappers:
+        if mapper.local_table is table:
+            identity_cache.invalidate_class(mapper.class_)
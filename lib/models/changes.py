@@ -0,0 +1,55 @@
+# lib/models/changes.py
+"""Append-only log of every insert, update and delete on the four model tables.
+
+Triggers on dealerships, customers, vehicles and payments add a change_log
+row for each row written, in the same transaction, so changes made outside
+the ORM (bulk loads, ledger UPDATEs, set-based and cascading deletes) are
+logged too. data holds the row as stored, as a JSON object keyed by column
+name (money in integer cents): the new values for inserts and updates, the
+last values for deletes.
+
+seq is an AUTOINCREMENT key, so it only grows and is never reused. SQLite
+has one writer at a time, so changes commit in seq order and a reader that
+has seen seq N can never later find a committed change below N.
+"""
+from sqlalchemy import Column, Integer, String, DateTime, Text, select, func
+from .base import Base
+
+# Tables whose rows are logged, in the names change_log.entity uses.
+LOGGED_TABLES = ('dealerships', 'customers', 'vehicles', 'payments')
+
+
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # insert, update, delete; archive for payments moved by lib.archive
+    changed_at = Column(DateTime, nullable=False)
+    data = Column(Text, nullable=False)
+    __table_args__ = (
+        # seq must never be reused, or a consumer could skip a change.
+        {'sqlite_autoincrement': True},
+    )
+
+
+def _json_row(table, prefix):
+    pairs = ', '.join(f"'{column.name}', {prefix}.{column.name}" for column in Base.metadata.tables[table].columns)
+    return f'json_object({pairs})'
+
+
+def create_change_triggers(conn):
+    """Create the triggers that log writes on LOGGED_TABLES to change_log."""
+    ChangeLog.__table__.create(conn, checkfirst=True)
+    for table in LOGGED_TABLES:
+        for op, when, row in (('insert', 'INSERT', 'new'), ('update', 'UPDATE', 'new'), ('delete', 'DELETE', 'old')):
+            conn.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS change_log_{table}_{op} AFTER {when} ON {table} BEGIN "
+                f"INSERT INTO change_log (entity, row_id, op, changed_at, data) VALUES ('{table}', {row}.id, '{op}', "
+                f"strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'), {_json_row(table, row)}); END")
+
+
+def latest_seq(session):
+    """The seq of the newest change, or 0 when nothing has been logged."""
+    return session.execute(select(func.coalesce(func.max(ChangeLog.seq), 0))).scalar()
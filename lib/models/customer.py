@@ -1,61 +1,96 @@
 # lib/models/customer.py
 from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import relationship
-from .base import Base, Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, selectinload
+from sqlalchemy.ext.hybrid import hybrid_property
+from .base import Base, Session, DEFAULT_BATCH_SIZE, iter_keyset
+from .validators import non_empty_string, email_address
+from .search import search, DEFAULT_SEARCH_LIMIT
+from .cache import cached_get
+from .deletion import delete_by_ids
+from .locking import retry_on_busy
+from lib.profiling import timed
 
 class Customer(Base):
     __tablename__ = 'customers'
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
-    email = Column(String, nullable=False)
-    vehicles = relationship("Vehicle", back_populates="customer")
-    payments = relationship("Payment", back_populates="customer")
+    _name = Column('name', String, nullable=False)
+    _email = Column('email', String, nullable=False)
+    vehicles = relationship("Vehicle", back_populates="customer", passive_deletes=True)
+    payments = relationship("Payment", back_populates="customer", passive_deletes='all')
 
-    @property
+    @hybrid_property
     def name(self):
         return self._name
 
     @name.setter
     def name(self, value):
-        if not isinstance(value, str) or not value.strip():
-            raise ValueError("Name must be a non-empty string")
-        self._name = value
+        self._name = non_empty_string(value, "Name")
 
-    @property
+    @hybrid_property
     def email(self):
         return self._email
 
     @email.setter
     def email(self, value):
-        if not isinstance(value, str) or '@' not in value or not value.strip():
-            raise ValueError("Email must be a valid non-empty string")
-        self._email = value
+        self._email = email_address(value)
 
     @classmethod
+    @timed('Customer.create')
     def create(cls, session, name, email):
         try:
             customer = cls(name=name, email=email)
             session.add(customer)
             session.commit()
             return customer
-        except:
+        except ValueError as e:
             session.rollback()
-            raise ValueError("Failed to create customer: Invalid data")
+            raise ValueError(f"Failed to create customer: {e}") from e
+        except Exception:
+            session.rollback()
+            raise
 
     @classmethod
+    @retry_on_busy
     def delete(cls, session, id):
-        customer = session.query(cls).get(id)
-        if customer:
-            session.delete(customer)
-            session.commit()
-            return True
-        return False
+        """Delete a customer; the vehicles they own go back to stock (customer_id NULL).
+
+        A customer with payments on record, archived ones included, is refused
+        with ValueError, as the payments are the vehicles' ledger history; the
+        database enforces this too (ON DELETE RESTRICT).
+        """
+        from .vehicle import Vehicle
+        from .archive import has_archived_payments
+        if has_archived_payments(session, id):
+            raise ValueError(f"Failed to delete customer: customer {id} has payments on record")
+        try:
+            return delete_by_ids(session, cls, [id], set_null=[(Vehicle, 'customer_id')]) > 0
+        except IntegrityError as e:
+            raise ValueError(f"Failed to delete customer: customer {id} has payments on record") from e
 
     @classmethod
+    @timed('Customer.get_all')
     def get_all(cls, session):
         return session.query(cls).all()
 
     @classmethod
+    def iter_all(cls, session, batch_size=DEFAULT_BATCH_SIZE, after_id=None):
+        return iter_keyset(session.query(cls), cls.id, batch_size, after_id)
+
+    @classmethod
+    @timed('Customer.find_by_id')
     def find_by_id(cls, session, id):
-        return session.query(cls).get(id)
+        return cached_get(session, cls, id)
+
+    @classmethod
+    @timed('Customer.search')
+    def search(cls, session, query, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        """Customers whose name or email has a word starting with each word of query, best match first."""
+        return search(session, cls, query, limit, offset)
+
+    @classmethod
+    def find_with_vehicles(cls, session, id):
+        """Load the customer and all of its vehicles in two statements, whatever the vehicle count."""
+        return session.query(cls).options(selectinload(cls.vehicles)).filter(cls.id == id).first()
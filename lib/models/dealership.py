@@ -1,60 +1,111 @@
 # lib/models/dealership.py
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import relationship
-from .base import Base, Session
+from sqlalchemy import Column, Integer, String, Index, func, select
+from sqlalchemy.orm import relationship, selectinload
+from sqlalchemy.ext.hybrid import hybrid_property
+from .base import Base, Session, DEFAULT_BATCH_SIZE, iter_keyset
+from .validators import non_empty_string
+from .search import search, DEFAULT_SEARCH_LIMIT
+from .cache import cached_get
+from .deletion import delete_by_ids
+from .locking import retry_on_busy
+from lib.profiling import timed
 
 class Dealership(Base):
     __tablename__ = 'dealerships'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
-    location = Column(String, nullable=False)
-    vehicles = relationship("Vehicle", back_populates="dealership", cascade="all, delete")
+    _name = Column('name', String, nullable=False)
+    _location = Column('location', String, nullable=False)
+    vehicles = relationship("Vehicle", back_populates="dealership", cascade="all, delete",
+                            passive_deletes=True)
+    __table_args__ = (
+        Index('ix_dealerships_name_lower', func.lower(_name)),
+        {'sqlite_autoincrement': True},
+    )
 
-    @property
+    @hybrid_property
     def name(self):
         return self._name
 
     @name.setter
     def name(self, value):
-        if not isinstance(value, str) or not value.strip():
-            raise ValueError("Name must be a non-empty string")
-        self._name = value
+        self._name = non_empty_string(value, "Name")
 
-    @property
+    @hybrid_property
     def location(self):
         return self._location
 
     @location.setter
     def location(self, value):
-        if not isinstance(value, str) or not value.strip():
-            raise ValueError("Location must be a non-empty string")
-        self._location = value
+        self._location = non_empty_string(value, "Location")
 
     @classmethod
+    @timed('Dealership.create')
     def create(cls, session, name, location):
         try:
             dealership = cls(name=name, location=location)
             session.add(dealership)
             session.commit()
             return dealership
-        except:
+        except ValueError as e:
             session.rollback()
-            raise ValueError("Failed to create dealership: Invalid data")
+            raise ValueError(f"Failed to create dealership: {e}") from e
+        except Exception:
+            session.rollback()
+            raise
 
     @classmethod
     def delete(cls, session, id):
-        dealership = session.query(cls).get(id)
-        if dealership:
-            session.delete(dealership)
-            session.commit()
-            return True
-        return False
+        return cls.delete_many(session, [id]) > 0
+
+    @classmethod
+    @timed('Dealership.delete_many')
+    @retry_on_busy
+    def delete_many(cls, session, ids):
+        """Delete dealerships by id with their vehicles and payments; return how many dealerships were deleted.
+
+        One DELETE per chunk of ids; the vehicles and payments go by ON DELETE
+        CASCADE in the same transaction without being loaded, as do the
+        vehicles' archived payments.
+        """
+        from .vehicle import Vehicle
+        from .payment import Payment
+        from .archive import attach_archive, delete_archived_payments
+
+        def delete_archived(session, chunk):
+            if attach_archive(session):
+                delete_archived_payments(session, list(session.scalars(
+                    select(Vehicle.id).where(Vehicle.dealership_id.in_(chunk)))))
+
+        return delete_by_ids(session, cls, ids, cascade=[(Vehicle, 'dealership_id'), (Payment, 'vehicle_id')],
+                             on_chunk=delete_archived)
 
     @classmethod
+    @timed('Dealership.get_all')
     def get_all(cls, session):
         return session.query(cls).all()
 
     @classmethod
+    def iter_all(cls, session, batch_size=DEFAULT_BATCH_SIZE, after_id=None):
+        return iter_keyset(session.query(cls), cls.id, batch_size, after_id)
+
+    @classmethod
+    @timed('Dealership.find_by_id')
     def find_by_id(cls, session, id):
-        return session.query(cls).get(id)
+        return cached_get(session, cls, id)
+
+    @classmethod
+    @timed('Dealership.search')
+    def search(cls, session, query, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        """Dealerships whose name or location has a word starting with each word of query, best match first."""
+        return search(session, cls, query, limit, offset)
+
+    @classmethod
+    def find_by_name(cls, session, name):
+        """Case-insensitive exact match, served by the lower(name) expression index."""
+        return session.query(cls).filter(func.lower(cls.name) == func.lower(name)).first()
+
+    @classmethod
+    def find_with_vehicles(cls, session, id):
+        """Load the dealership and all of its vehicles in two statements, whatever the vehicle count."""
+        return session.query(cls).options(selectinload(cls.vehicles)).filter(cls.id == id).first()
@@ -0,0 +1,74 @@
+# lib/models/deletion.py
+"""Set-based deletes that leave the dependent rows to the database's foreign keys.
+
+Deleting through session.delete() loads every child the ORM cascades to and
+issues one DELETE per row. delete_by_ids() instead runs DELETE ... WHERE id
+IN (...) per chunk of ids and lets ON DELETE CASCADE / SET NULL (enforced
+because lib.helpers turns on PRAGMA foreign_keys) deal with the vehicles
+and payments underneath, without reading them.
+
+Rows removed or changed that way never pass through the session, so the
+caller names them: instances already loaded in the session are expunged
+(or expired, for SET NULL) and the identity cache entries for their class
+are dropped.
+"""
+from sqlalchemy import delete, inspect
+from .cache import identity_cache
+from .locking import begin_write
+
+DELETE_CHUNK_SIZE = 500
+
+
+def _loaded(session, cls, key, values):
+    """Instances of cls in session whose loaded key attribute is one of values, without loading anything."""
+    found = []
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, cls):
+            state = inspect(instance)
+            if (state.identity[0] if key == 'id' else state.dict.get(key)) in values:
+                found.append(instance)
+    return found
+
+
+def delete_by_ids(session, cls, ids, cascade=(), set_null=(), on_chunk=None):
+    """Delete the cls rows with these ids in one write transaction and commit; return how many were deleted.
+
+    cascade is the chain of (class, foreign key attribute) the database's
+    ON DELETE CASCADE follows from cls, e.g. [(Vehicle, 'dealership_id'),
+    (Payment, 'vehicle_id')]; set_null lists the (class, attribute) pairs
+    it sets to NULL. Both are only used to keep the session and the
+    identity cache in step with the database.
+
+    on_chunk(session, chunk), if given, runs in the same write transaction
+    before each chunk of ids is deleted, for dependent rows the foreign keys
+    can't reach (archived payments live in another database file).
+    """
+    ids = sorted(set(ids))
+    # Look first: begin_write commits, which expires the attributes read here.
+    removed = _loaded(session, cls, 'id', set(ids))
+    gone = set(ids)
+    for child, key in cascade:
+        instances = _loaded(session, child, key, gone)
+        removed.extend(instances)
+        gone = {inspect(instance).identity[0] for instance in instances}
+    nulled = [instance for child, key in set_null for instance in _loaded(session, child, key, set(ids))]
+    deleted = 0
+    try:
+        begin_write(session)
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            chunk = ids[start:start + DELETE_CHUNK_SIZE]
+            if on_chunk is not None:
+                on_chunk(session, chunk)
+            deleted += session.execute(delete(cls).where(cls.id.in_(chunk)),
+                                       execution_options={'synchronize_session': False}).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    for instance in removed:
+        session.expunge(instance)
+    for instance in nulled:
+        session.expire(instance)
+    for model, _ in [(cls, 'id'), *cascade, *set_null]:
+        identity_cache.invalidate_class(model)
+    return deleted
@@ -0,0 +1,63 @@
+# lib/models/locking.py
+"""Write serialization for SQLite: BEGIN IMMEDIATE transactions and retry with backoff.
+
+SQLite has one writer at a time. A deferred transaction that reads first and
+writes later must upgrade its lock, and when another connection wrote in the
+meantime SQLite fails the upgrade at once with "database is locked" instead
+of waiting out the busy timeout. begin_write() takes the write lock when the
+transaction starts, where the busy timeout applies, and retry_on_busy()
+re-runs an operation the few times the timeout itself runs out.
+"""
+import functools
+import os
+import random
+import time
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.util.concurrency import in_greenlet
+
+BUSY_RETRIES = int(os.environ.get('EV_BUSY_RETRIES', 5))
+BUSY_BACKOFF = 0.05
+
+
+def is_busy(error):
+    """True for SQLite's lock contention errors (SQLITE_BUSY / SQLITE_LOCKED)."""
+    message = str(getattr(error, 'orig', error)).lower()
+    return isinstance(error, OperationalError) and ('database is locked' in message or 'database is busy' in message
+                                                    or 'database table is locked' in message)
+
+
+def begin_write(session):
+    """Start a fresh transaction on session that holds SQLite's write lock from its first statement.
+
+    Anything the session has pending is committed first, as the model methods
+    commit their whole session anyway. Inside lib.helpers.batch_session() the
+    outer transaction is already open, so this only starts a new savepoint.
+    """
+    if session.in_transaction():
+        session.commit()
+    # lib.helpers emits BEGIN IMMEDIATE for connections carrying this option.
+    session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+
+
+def backoff(attempt):
+    """Seconds to wait before retry number attempt + 1: jittered and doubling."""
+    return BUSY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+def retry_on_busy(fn):
+    """Re-run fn with jittered exponential backoff while it fails on lock contention.
+
+    fn must roll back its session before letting the error escape. Under
+    lib.aio (an AsyncSession's run_sync) the error escapes at once: sleeping
+    here would stall the event loop, so lib.aio.run_write retries instead.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError as e:
+                if not is_busy(e) or attempt == BUSY_RETRIES or in_greenlet():
+                    raise
+                time.sleep(backoff(attempt))
+    return wrapper
@@ -0,0 +1,55 @@
+# lib/models/money.py
+"""Money stored as integer minor units (cents) and handled in Python as Decimal.
+
+Columns typed Cents hold whole cents in an INTEGER column, so SUM() and
+comparisons in SQL are exact integer arithmetic. Values are converted to
+Decimal with two places when rows are loaded and back to cents when they
+are bound, so model attributes, report rows and Python-side balance checks
+never see binary float rounding. Floats are accepted on the way in and
+rounded half-up to the nearest cent. Literals in expressions on a Cents
+column are bound as money too, so scale by a plain factor through cents().
+"""
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+from sqlalchemy import Integer
+from sqlalchemy.sql.expression import type_coerce
+from sqlalchemy.types import TypeDecorator
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def to_money(value):
+    """value (Decimal, int, float or numeric string) as a Decimal rounded to the cent."""
+    if isinstance(value, bool) or not isinstance(value, (Decimal, int, float, str)):
+        raise TypeError(f"Not a money amount: {value!r}")
+    try:
+        amount = Decimal(repr(value) if isinstance(value, float) else value).quantize(CENT, ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"Not a money amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Not a money amount: {value!r}")
+    return amount
+
+
+def to_cents(value):
+    return int(to_money(value) * 100)
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def cents(expression):
+    """expression read as raw integer cents, for hot loops that aggregate in Python."""
+    return type_coerce(expression, Integer)
+
+
+class Cents(TypeDecorator):
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else from_cents(value)
@@ -1,27 +1,215 @@
 # lib/models/payment.py
-from sqlalchemy import Column, Integer, Float, ForeignKey, DateTime, String
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, String, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 from .base import Base
+from .validators import row_object, positive_amount, timestamp
+from .money import Cents, ZERO
+from .locking import begin_write, retry_on_busy
+from lib.profiling import timed
 from datetime import datetime
 
+INGEST_CHUNK_SIZE = 500
+
+
+def _chunks(values, size=INGEST_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
 class Payment(Base):
     __tablename__ = 'payments'
 
     id = Column(Integer, primary_key=True)
-    vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
-    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
-    amount = Column(Float, nullable=False)
+    vehicle_id = Column(Integer, ForeignKey('vehicles.id', ondelete='CASCADE'), nullable=False)
+    # A customer with payments can't be deleted; see Customer.delete.
+    customer_id = Column(Integer, ForeignKey('customers.id', ondelete='RESTRICT'), nullable=False, index=True)
+    _amount = Column('amount_cents', Cents, key='amount', nullable=False)
     payment_date = Column(DateTime, nullable=False, default=datetime.now)
     status = Column(String, nullable=False, default="completed")
+    # External settlement reference; unique so re-ingesting a file can't double-post.
+    reference = Column(String, nullable=True, unique=True, index=True)
     vehicle = relationship("Vehicle", back_populates="payments")
     customer = relationship("Customer", back_populates="payments")
+    __table_args__ = (
+        # Leading vehicle_id also serves plain per-vehicle lookups and SUMs.
+        Index('ix_payments_vehicle_id_payment_date', 'vehicle_id', 'payment_date'),
+        Index('ix_payments_payment_date', 'payment_date'),
+        # Never reuse ids; also lets lib.sharding start a shard's ids at its block.
+        {'sqlite_autoincrement': True},
+    )
 
-    @property
+    @hybrid_property
     def amount(self):
         return self._amount
 
     @amount.setter
     def amount(self, value):
-        if not isinstance(value, (int, float)) or value <= 0:
-            raise ValueError("Payment amount must be a positive number")
-        self._amount = float(value)
+        self._amount = positive_amount(value, "Payment amount")
+
+    @classmethod
+    @retry_on_busy
+    def delete(cls, session, id):
+        """Delete a payment and take it back out of its vehicle's ledger in the same write transaction.
+
+        Like add_payment, the ledger UPDATE is guarded: a ledger that doesn't
+        hold the payment (see Vehicle.reconcile_ledger) fails with ValueError
+        rather than going negative.
+        """
+        from .vehicle import Vehicle
+        try:
+            begin_write(session)
+            payment = session.get(cls, id)
+            if not payment:
+                session.commit()
+                return False
+            booked = session.query(Vehicle).filter(
+                Vehicle.id == payment.vehicle_id, Vehicle.total_paid >= payment.amount, Vehicle.payment_count > 0,
+            ).update({Vehicle.total_paid: Vehicle.total_paid - payment.amount,
+                      Vehicle.payment_count: Vehicle.payment_count - 1},
+                     synchronize_session=False)
+            if not booked:
+                raise ValueError(f"Failed to delete payment: vehicle {payment.vehicle_id}'s ledger doesn't hold it; "
+                                 "run reconcile")
+            session.delete(payment)
+            session.commit()
+            return True
+        except Exception:
+            session.rollback()
+            raise
+
+    @staticmethod
+    def _parse_settlement_row(row):
+        reference = row_object(row).get('reference')
+        if not isinstance(reference, str) or not reference.strip():
+            raise ValueError("Reference is required")
+        try:
+            vehicle_id = int(row.get('vehicle_id'))
+            customer_id = int(row.get('customer_id'))
+        except (TypeError, ValueError):
+            raise ValueError("Vehicle ID and customer ID must be integers")
+        amount = positive_amount(row.get('amount'), "Payment amount")
+        return {'vehicle_id': vehicle_id, 'customer_id': customer_id, 'amount': amount,
+                'payment_date': timestamp(row.get('payment_date'), "Payment date"), 'status': "completed",
+                'reference': reference.strip()}
+
+    @classmethod
+    @timed('Payment.bulk_ingest')
+    def bulk_ingest(cls, session, rows, batch_size=INGEST_CHUNK_SIZE):
+        """Post a settlement batch in one transaction, keyed by each row's external reference.
+
+        Vehicles, customers and already-posted references are looked up with one
+        IN query per chunk of rows rather than per row. Rows whose reference was
+        already posted are skipped as duplicates, so re-running a file is safe;
+        rows that fail validation or would overpay the vehicle are rejected.
+        Returns {'inserted': n, 'duplicates': [reference, ...], 'rejected': [(row number, row, error), ...]}.
+        """
+        parsed, rejected = cls._parse_settlement(rows)
+        return cls._post_settlement(session, parsed, rejected, batch_size)
+
+    @classmethod
+    @timed('Payment.bulk_ingest_sharded')
+    def bulk_ingest_sharded(cls, router, rows, batch_size=INGEST_CHUNK_SIZE):
+        """bulk_ingest() across the shards of a lib.sharding.ShardRouter, each row posted in its vehicle's shard.
+
+        Each shard's rows are posted in one transaction of that shard; the
+        results are added up, with row numbers counted across the whole file.
+        """
+        parsed, rejected = cls._parse_settlement(rows)
+        routed = {}
+        for number, row, payment in parsed:
+            try:
+                routed.setdefault(router.map.shard_for_id(payment['vehicle_id']), []).append((number, row, payment))
+            except ValueError as e:
+                rejected.append((number, row, str(e)))
+        result = {'inserted': 0, 'duplicates': [], 'rejected': rejected}
+        for shard in router.map.names:
+            if shard in routed:
+                posted = cls._post_settlement(router.session(shard), routed[shard], [], batch_size)
+                result['inserted'] += posted['inserted']
+                result['duplicates'].extend(posted['duplicates'])
+                result['rejected'].extend(posted['rejected'])
+        result['rejected'].sort(key=lambda rejected: rejected[0])
+        return result
+
+    @classmethod
+    def _parse_settlement(cls, rows):
+        """Numbered (number, row, payment) for the rows that parse, and (number, row, error) for the rest."""
+        parsed, rejected = [], []
+        for number, row in enumerate(rows, start=1):
+            try:
+                parsed.append((number, row, cls._parse_settlement_row(row)))
+            except ValueError as e:
+                rejected.append((number, row, str(e)))
+        return parsed, rejected
+
+    @classmethod
+    @retry_on_busy
+    def _post_settlement(cls, session, parsed, rejected, batch_size):
+        # Balances are read and the payments written under one write lock, so
+        # a concurrent ingest or posting can't spend the same balance twice.
+        from .vehicle import Vehicle
+        from .customer import Customer
+        result = {'inserted': 0, 'duplicates': [], 'rejected': list(rejected)}
+        try:
+            begin_write(session)
+            vehicles, customer_ids, posted = {}, set(), set()
+            for chunk in _chunks({p['vehicle_id'] for _, _, p in parsed}):
+                for id, customer_id, price, total_paid in session.query(
+                        Vehicle.id, Vehicle.customer_id, Vehicle.price, Vehicle.total_paid).filter(Vehicle.id.in_(chunk)):
+                    vehicles[id] = (customer_id, price - total_paid)
+            for chunk in _chunks({p['customer_id'] for _, _, p in parsed}):
+                customer_ids.update(id for (id,) in session.query(Customer.id).filter(Customer.id.in_(chunk)))
+            from .archive import archived_references
+            for chunk in _chunks({p['reference'] for _, _, p in parsed}):
+                posted.update(ref for (ref,) in session.query(cls.reference).filter(cls.reference.in_(chunk)))
+                # A re-sent file may hold payments archived since they were posted.
+                posted.update(archived_references(session, chunk))
+
+            accepted, ledger = [], {}
+            for number, row, payment in parsed:
+                vehicle = vehicles.get(payment['vehicle_id'])
+                if payment['reference'] in posted:
+                    result['duplicates'].append(payment['reference'])
+                    continue
+                if vehicle is None:
+                    error = "Invalid vehicle ID"
+                elif payment['customer_id'] not in customer_ids:
+                    error = "Invalid customer ID"
+                elif vehicle[0] and vehicle[0] != payment['customer_id']:
+                    error = "Payment customer must match vehicle customer"
+                elif payment['amount'] > vehicle[1] - ledger.get(payment['vehicle_id'], (ZERO, 0))[0]:
+                    error = "Payment exceeds remaining balance"
+                else:
+                    error = None
+                if error:
+                    result['rejected'].append((number, row, error))
+                    continue
+                posted.add(payment['reference'])
+                total, count = ledger.get(payment['vehicle_id'], (ZERO, 0))
+                ledger[payment['vehicle_id']] = (total + payment['amount'], count + 1)
+                accepted.append(payment)
+
+            for chunk in _chunks(accepted, batch_size):
+                session.execute(cls.__table__.insert(), chunk)
+            Vehicle.apply_to_ledger(session, ledger)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        result['inserted'] = len(accepted)
+        return result
+
+
+class PaymentRollup(Base):
+    """Per-vehicle totals of the payments lib.archive has moved to the archive database.
+
+    A vehicle's ledger (total_paid, payment_count) equals its payments plus this row.
+    """
+    __tablename__ = 'payment_rollups'
+
+    vehicle_id = Column(Integer, ForeignKey('vehicles.id', ondelete='CASCADE'), primary_key=True)
+    amount = Column('amount_cents', Cents, key='amount', nullable=False, default=0, server_default='0')
+    payment_count = Column(Integer, nullable=False, default=0, server_default='0')
+    first_payment_date = Column(DateTime, nullable=True)
+    last_payment_date = Column(DateTime, nullable=True)
@@ -0,0 +1,86 @@
+# lib/models/search.py
+"""Ranked prefix search over customers, vehicles and dealerships with SQLite FTS5.
+
+Each searchable table has an external-content FTS5 index (<table>_fts) whose
+rowid is the row's id, so the index holds only the tokens and the text
+stays in the base table. Triggers on the base table keep the index in step
+with every insert, update and delete, including bulk loads that bypass the
+ORM. Queries match every word as a prefix of some indexed word and are
+ordered by FTS5's bm25 rank, best first.
+
+On databases other than SQLite, search falls back to a case-insensitive
+substring match ordered by id.
+"""
+import re
+from sqlalchemy import literal_column, or_, and_
+from sqlalchemy.sql import table as table_clause, column as column_clause
+
+DEFAULT_SEARCH_LIMIT = 20
+
+# table -> indexed columns
+SEARCH_INDEXES = {
+    'customers': ('name', 'email'),
+    'vehicles': ('model',),
+    'dealerships': ('name', 'location'),
+}
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def create_search_indexes(conn):
+    """Create the FTS5 tables and their sync triggers, and index the existing rows."""
+    for table, columns in SEARCH_INDEXES.items():
+        fts = f'{table}_fts'
+        listed = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({listed}, content='{table}', content_rowid='id', "
+            f"tokenize='unicode61', prefix='2 3')")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {listed}) VALUES (new.id, {new}); END")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {listed}) VALUES ('delete', old.id, {old}); END")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {listed} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {listed}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {listed}) VALUES (new.id, {new}); END")
+        conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    """FTS5 query requiring every word of free text as a prefix; None when the text has no words.
+
+    Words are quoted, so operators and punctuation typed by users are never
+    parsed as FTS5 syntax.
+    """
+    words = _WORD.findall(query or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search(session, model, query, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+    """Instances of model matching query, best match first; limit/offset page through the ranking."""
+    table = model.__tablename__
+    columns = SEARCH_INDEXES[table]
+    if session.get_bind().dialect.name != 'sqlite':
+        words = _WORD.findall(query or '')
+        if not words:
+            return []
+        fields = [model.__table__.c[column] for column in columns]
+        matches = and_(*(or_(*(field.ilike(f'%{word}%') for field in fields)) for word in words))
+        return session.query(model).filter(matches).order_by(model.id).limit(limit).offset(offset).all()
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    fts = table_clause(f'{table}_fts', column_clause('rowid'), column_clause('rank'))
+    return (session.query(model)
+            .join(fts, fts.c.rowid == model.id)
+            .filter(literal_column(fts.name).match(expression))
+            .order_by(fts.c.rank, model.id)
+            .limit(limit)
+            .offset(offset)
+            .all())
@@ -0,0 +1,46 @@
+# lib/models/validators.py
+# Shared by the model property setters and the bulk loader so both apply the same rules.
+from datetime import datetime
+from .money import to_money
+
+
+def row_object(value):
+    """An input row (CSV record or JSON line) must be a mapping of field names to values."""
+    if not isinstance(value, dict):
+        raise ValueError("Row must be an object")
+    return value
+
+
+def non_empty_string(value, label):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{label} must be a non-empty string")
+    return value
+
+
+def email_address(value):
+    if not isinstance(value, str) or '@' not in value or not value.strip():
+        raise ValueError("Email must be a valid non-empty string")
+    return value
+
+
+def positive_amount(value, label):
+    """value as a Decimal rounded to the cent; it must be positive after rounding."""
+    try:
+        amount = to_money(value.strip() if isinstance(value, str) else value)
+    except (TypeError, ValueError):
+        amount = None
+    if amount is None or amount <= 0:
+        raise ValueError(f"{label} must be a positive number")
+    return amount
+
+
+def timestamp(value, label):
+    """value as a datetime, parsed from ISO 8601 text; a blank value means now."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return datetime.now()
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise ValueError(f"{label} must be an ISO 8601 timestamp")
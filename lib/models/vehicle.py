@@ -1,81 +1,158 @@
 # lib/models/vehicle.py
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
-from .base import Base, Session
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func
+from sqlalchemy.orm import relationship, joinedload
+from sqlalchemy.sql import bindparam
+from sqlalchemy.ext.hybrid import hybrid_property
+from .base import Base, Session, DEFAULT_BATCH_SIZE, iter_keyset
+from .validators import non_empty_string, positive_amount
+from .money import Cents, ZERO
+from .search import search, DEFAULT_SEARCH_LIMIT
+from .cache import cached_get, invalidate_instance
+from .deletion import delete_by_ids
+from .locking import begin_write, retry_on_busy
+from lib.profiling import timed
+from .dealership import Dealership
+from .customer import Customer
 from datetime import datetime
 
+# Vehicle ids per IN (...) when rewriting drifted ledgers.
+LEDGER_CHUNK_SIZE = 500
+
 class Vehicle(Base):
     __tablename__ = 'vehicles'
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True)
-    model = Column(String, nullable=False)
-    price = Column(Float, nullable=False)
-    dealership_id = Column(Integer, ForeignKey('dealerships.id'), nullable=False)
+    _model = Column('model', String, nullable=False)
+    _price = Column('price_cents', Cents, key='price', nullable=False)
+    dealership_id = Column(Integer, ForeignKey('dealerships.id', ondelete='CASCADE'), nullable=False, index=True)
     dealership = relationship("Dealership", back_populates="vehicles")
-    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=True)
+    customer_id = Column(Integer, ForeignKey('customers.id', ondelete='SET NULL'), nullable=True, index=True)
     customer = relationship("Customer", back_populates="vehicles")
-    payments = relationship("Payment", back_populates="vehicle", cascade="all, delete-orphan")
+    payments = relationship("Payment", back_populates="vehicle", cascade="all, delete-orphan",
+                            passive_deletes=True)
+    # Running payment ledger, kept in step with the payments table by
+    # add_payment, Payment.delete and the bulk loader; see reconcile_ledger.
+    total_paid = Column('total_paid_cents', Cents, key='total_paid', nullable=False, default=0, server_default='0')
+    payment_count = Column(Integer, nullable=False, default=0, server_default='0')
 
-    @property
+    @hybrid_property
     def model(self):
         return self._model
 
     @model.setter
     def model(self, value):
-        if not isinstance(value, str) or not value.strip():
-            raise ValueError("Model must be a non-empty string")
-        self._model = value
+        self._model = non_empty_string(value, "Model")
 
-    @property
+    @hybrid_property
     def price(self):
         return self._price
 
     @price.setter
     def price(self, value):
-        if not isinstance(value, (int, float)) or value <= 0:
-            raise ValueError("Price must be a positive number")
-        self._price = float(value)
+        self._price = positive_amount(value, "Price")
 
     @classmethod
+    @timed('Vehicle.create')
     def create(cls, session, model, price, dealership_id, customer_id=None):
         try:
-            if not session.query(Dealership).get(dealership_id):
+            if not Dealership.find_by_id(session, dealership_id):
                 raise ValueError("Invalid dealership ID")
-            if customer_id and not session.query(Customer).get(customer_id):
+            if customer_id and not Customer.find_by_id(session, customer_id):
                 raise ValueError("Invalid customer ID")
             vehicle = cls(model=model, price=price, dealership_id=dealership_id, customer_id=customer_id)
             session.add(vehicle)
             session.commit()
             return vehicle
-        except:
+        except ValueError as e:
             session.rollback()
-            raise ValueError("Failed to create vehicle: Invalid data")
+            raise ValueError(f"Failed to create vehicle: {e}") from e
+        except Exception:
+            session.rollback()
+            raise
 
     @classmethod
     def delete(cls, session, id):
-        vehicle = session.query(cls).get(id)
-        if vehicle:
-            session.delete(vehicle)
-            session.commit()
-            return True
-        return False
+        return cls.delete_many(session, [id]) > 0
 
     @classmethod
+    @timed('Vehicle.delete_many')
+    @retry_on_busy
+    def delete_many(cls, session, ids):
+        """Delete vehicles by id with their payments; return how many vehicles were deleted.
+
+        One DELETE per chunk of ids; the payments go by ON DELETE CASCADE, and
+        with them the ledger rows they were summed into. Their archived
+        payments are deleted in the same transaction.
+        """
+        from .payment import Payment
+        from .archive import delete_archived_payments
+        return delete_by_ids(session, cls, ids, cascade=[(Payment, 'vehicle_id')],
+                             on_chunk=delete_archived_payments)
+
+    @classmethod
+    @timed('Vehicle.get_all')
     def get_all(cls, session):
         return session.query(cls).all()
 
     @classmethod
+    def iter_all(cls, session, batch_size=DEFAULT_BATCH_SIZE, after_id=None):
+        """Stream vehicles, with dealership and customer loaded, in keyset-paginated batches."""
+        return iter_keyset(cls.list_with_relations(session), cls.id, batch_size, after_id)
+
+    @classmethod
+    @timed('Vehicle.find_by_id')
     def find_by_id(cls, session, id):
-        return session.query(cls).get(id)
+        return cached_get(session, cls, id)
+
+    @classmethod
+    @timed('Vehicle.search')
+    def search(cls, session, query, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        """Vehicles whose model has a word starting with each word of query, best match first."""
+        return search(session, cls, query, limit, offset)
+
+    @classmethod
+    def list_with_relations(cls, session, dealership_id=None, customer_id=None):
+        """Query vehicles with their dealership and customer joined in the same SELECT."""
+        query = session.query(cls).options(joinedload(cls.dealership), joinedload(cls.customer))
+        if dealership_id is not None:
+            query = query.filter(cls.dealership_id == dealership_id)
+        if customer_id is not None:
+            query = query.filter(cls.customer_id == customer_id)
+        return query.order_by(cls.id)
 
+    @classmethod
+    def find_with_relations(cls, session, id):
+        return cls.list_with_relations(session).filter(cls.id == id).first()
+
+    @timed('Vehicle.add_payment')
+    @retry_on_busy
     def add_payment(self, session, amount, customer_id, payment_date=None):
+        """Post a payment, refusing any amount beyond the remaining balance.
+
+        Runs in a BEGIN IMMEDIATE transaction, and the balance check and ledger
+        increment are a single guarded UPDATE, so concurrent postings from other
+        sessions or processes can neither lose an increment nor overpay.
+        """
         try:
-            if not session.query(Customer).get(customer_id):
+            amount = positive_amount(amount, "Payment amount")
+            begin_write(session)
+            if not Customer.find_by_id(session, customer_id):
                 raise ValueError("Invalid customer ID")
-            if not isinstance(amount, (int, float)) or amount <= 0:
-                raise ValueError("Payment amount must be a positive number")
             if self.customer_id and self.customer_id != customer_id:
                 raise ValueError("Payment customer must match vehicle customer")
+            vehicles = Vehicle.__table__
+            booked = session.connection().execute(
+                vehicles.update()
+                .where(vehicles.c.id == self.id,
+                       vehicles.c.total_paid + amount <= vehicles.c.price)
+                .values(total_paid=vehicles.c.total_paid + amount,
+                        payment_count=vehicles.c.payment_count + 1)).rowcount
+            if not booked:
+                raise ValueError("Payment exceeds remaining balance")
+            # The UPDATE bypassed the unit of work; refresh the ledger columns on next access.
+            session.expire(self, ['total_paid', 'payment_count'])
+            invalidate_instance(session, self)
             from .payment import Payment
             payment = Payment(
                 vehicle_id=self.id,
@@ -87,20 +164,117 @@ class Vehicle(Base):
             session.add(payment)
             session.commit()
             return payment
-        except:
+        except ValueError as e:
+            session.rollback()
+            raise ValueError(f"Failed to add payment: {e}") from e
+        except Exception:
             session.rollback()
-            raise ValueError("Failed to add payment: Invalid data")
+            raise
 
-    def get_payments(self, session):
+    def get_payments(self, session, since=None, until=None, include_archived=False):
+        """This vehicle's payments, oldest first; since/until bound payment_date (since <= date < until).
+
+        Only the hot payments table is read unless include_archived is set,
+        which adds the payments lib.archive moved out as transient Payments.
+        """
         from .payment import Payment
-        return session.query(Payment).filter(Payment.vehicle_id == self.id).all()
+        query = session.query(Payment).filter(Payment.vehicle_id == self.id)
+        if since is not None:
+            query = query.filter(Payment.payment_date >= since)
+        if until is not None:
+            query = query.filter(Payment.payment_date < until)
+        payments = query.order_by(Payment.payment_date, Payment.id).all()
+        if include_archived:
+            from .archive import archived_payments_for
+            # Archived payments all predate the hot ones of the same vehicle.
+            payments = archived_payments_for(session, self.id, since, until) + payments
+        return payments
 
     def get_total_payments(self, session):
-        from sqlalchemy import func
-        from .payment import Payment
-        total = session.query(func.sum(Payment.amount)).filter(Payment.vehicle_id == self.id).scalar()
-        return total or 0.0
+        total = session.query(Vehicle.total_paid).filter(Vehicle.id == self.id).scalar()
+        return total or ZERO
 
     def get_remaining_balance(self, session):
         total_paid = self.get_total_payments(session)
         return self.price - total_paid
+
+    @property
+    def remaining_balance(self):
+        return self.price - self.total_paid
+
+    @classmethod
+    def apply_to_ledger(cls, session, ledger):
+        """Add {vehicle_id: (amount, count)} deltas to the ledger with one executemany UPDATE.
+
+        Like add_payment's, the UPDATE only books an amount that keeps
+        total_paid within the price; if any vehicle would pass it, ValueError
+        is raised and the caller must roll back. Does not commit; callers run
+        it in the write transaction that wrote the payments.
+        """
+        if not ledger:
+            return
+        vehicles = cls.__table__
+        booked = session.execute(
+            vehicles.update().where(vehicles.c.id == bindparam('vehicle_id'),
+                                    vehicles.c.total_paid + bindparam('amount') <= vehicles.c.price).values(
+                total_paid=vehicles.c.total_paid + bindparam('amount'),
+                payment_count=vehicles.c.payment_count + bindparam('count')),
+            [{'vehicle_id': id, 'amount': amount, 'count': count} for id, (amount, count) in ledger.items()]).rowcount
+        if booked != len(ledger):
+            raise ValueError("Payment exceeds remaining balance")
+
+    @classmethod
+    def _ledger_drift(cls, session, ids=None):
+        """reconcile_ledger's tuples for the drifted vehicles, optionally only among ids."""
+        from .payment import Payment, PaymentRollup
+        actual_total = func.coalesce(func.sum(Payment.amount), 0) + func.coalesce(PaymentRollup.amount, 0)
+        actual_count = func.count(Payment.id) + func.coalesce(PaymentRollup.payment_count, 0)
+        query = (session.query(cls.id, cls.total_paid, actual_total, cls.payment_count, actual_count)
+                 .outerjoin(Payment, Payment.vehicle_id == cls.id)
+                 .outerjoin(PaymentRollup, PaymentRollup.vehicle_id == cls.id))
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+        rows = (query.group_by(cls.id)
+                .having((cls.total_paid != actual_total) | (cls.payment_count != actual_count))
+                .all())
+        return [tuple(row) for row in rows]
+
+    @classmethod
+    def reconcile_ledger(cls, session, fix=True):
+        """Recompute every vehicle's ledger from payments in one grouped query.
+
+        Returns (vehicle_id, stored total, actual total, stored count, actual count)
+        for each vehicle that had drifted; with fix=True those rows are rewritten.
+        Archived payments count through their PaymentRollup row.
+        """
+        drift = cls._ledger_drift(session)
+        if fix and drift:
+            drift = cls.rewrite_ledger(session, drift)
+        return drift
+
+    @classmethod
+    @retry_on_busy
+    def rewrite_ledger(cls, session, drift):
+        """Rewrite the ledgers of the vehicles named in drift (reconcile_ledger's tuples) and commit.
+
+        The totals are recomputed under the write lock rather than taken from
+        drift, which may come from an earlier snapshot (lib.parallel's workers
+        scan in their own), so payments posted since the scan are not lost.
+        Returns the tuples found and rewritten under the lock.
+        """
+        ids = sorted({row[0] for row in drift})
+        try:
+            begin_write(session)
+            rewritten = []
+            for start in range(0, len(ids), LEDGER_CHUNK_SIZE):
+                rewritten.extend(cls._ledger_drift(session, ids[start:start + LEDGER_CHUNK_SIZE]))
+            if rewritten:
+                session.execute(
+                    cls.__table__.update().where(cls.__table__.c.id == bindparam('vehicle_id')),
+                    [{'vehicle_id': id, 'total_paid': total, 'payment_count': count}
+                     for id, _, total, _, count in rewritten])
+            session.commit()
+            return rewritten
+        except Exception:
+            session.rollback()
+            raise
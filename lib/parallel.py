@@ -0,0 +1,180 @@
+# lib/parallel.py
+"""Fleet-wide reconciliation and totals, computed over vehicle ID ranges in worker processes.
+
+The vehicle ID space is cut into contiguous ranges. Each range is scanned by
+a ProcessPoolExecutor worker with its own read-only engine on the same
+SQLite file (WAL lets readers run alongside each other and a writer), and
+the per-range partial aggregates are summed in the parent:
+
+- totals per dealership and per customer, with amounts recomputed from the
+  payments table rather than read from the ledger;
+- ledger drift, the same tuples Vehicle.reconcile_ledger reports;
+- payments on sold vehicles whose customer is not the vehicle's owner
+  (unsold vehicles take payments from anyone, as on every write path);
+- vehicles paid past their price.
+
+Amounts are read and summed as integer cents and only turned into Decimal
+when rows are produced.
+
+With workers=1 the whole ID space is scanned in-process on the caller's
+session, which is also the fallback for in-memory databases.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from sqlalchemy import func
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session as OrmSession
+from lib.helpers import _create_engine
+from lib.models.vehicle import Vehicle
+from lib.models.payment import Payment, PaymentRollup
+from lib.models.money import cents, from_cents
+
+RANGES_PER_WORKER = 4
+
+DEALERSHIP_TOTAL_FIELDS = ['dealership_id', 'vehicles', 'sold', 'total_price', 'total_paid', 'outstanding', 'payments']
+CUSTOMER_TOTAL_FIELDS = ['customer_id', 'vehicles', 'total_price', 'total_paid', 'outstanding', 'payments']
+ANOMALY_FIELDS = ['kind', 'vehicle_id', 'payment_id', 'detail']
+
+# Read-only pragmas for worker engines; journal_mode is left to the writers.
+READER_PRAGMAS = {'query_only': 1, 'cache_size': -64000, 'mmap_size': 268435456, 'busy_timeout': 5000}
+
+_reader_engines = {}
+
+
+class Audit:
+    """Merged result of a fleet scan; partial Audits from each range are added together."""
+
+    def __init__(self):
+        self.dealerships = {}
+        self.customers = {}
+        self.drift = []
+        self.owner_mismatches = []
+        self.overpaid = []
+
+    def merge(self, other):
+        for mine, theirs in ((self.dealerships, other.dealerships), (self.customers, other.customers)):
+            for key, values in theirs.items():
+                current = mine.get(key)
+                mine[key] = values if current is None else [a + b for a, b in zip(current, values)]
+        self.drift.extend(other.drift)
+        self.owner_mismatches.extend(other.owner_mismatches)
+        self.overpaid.extend(other.overpaid)
+        return self
+
+    def dealership_totals(self):
+        """Rows of DEALERSHIP_TOTAL_FIELDS in dealership order."""
+        for id in sorted(self.dealerships):
+            vehicles, sold, price, paid, payments = self.dealerships[id]
+            yield dict(zip(DEALERSHIP_TOTAL_FIELDS, (id, vehicles, sold, from_cents(price), from_cents(paid),
+                                                     from_cents(price - paid), payments)))
+
+    def customer_totals(self):
+        """Rows of CUSTOMER_TOTAL_FIELDS in customer order."""
+        for id in sorted(self.customers):
+            vehicles, price, paid, payments = self.customers[id]
+            yield dict(zip(CUSTOMER_TOTAL_FIELDS, (id, vehicles, from_cents(price), from_cents(paid),
+                                                   from_cents(price - paid), payments)))
+
+    def anomalies(self):
+        """Rows of ANOMALY_FIELDS: ledger drift, owner mismatches and overpaid vehicles."""
+        for id, stored_total, actual_total, stored_count, actual_count in sorted(self.drift):
+            yield {'kind': 'ledger_drift', 'vehicle_id': id, 'payment_id': None,
+                   'detail': f"ledger {stored_total:.2f} over {stored_count} payments, actual {actual_total:.2f} over {actual_count}"}
+        for payment_id, vehicle_id, customer_id, owner_id in sorted(self.owner_mismatches, key=lambda m: m[1]):
+            yield {'kind': 'owner_mismatch', 'vehicle_id': vehicle_id, 'payment_id': payment_id,
+                   'detail': f"paid by customer {customer_id}, vehicle owner {owner_id}"}
+        for id, price, paid in sorted(self.overpaid):
+            yield {'kind': 'overpaid', 'vehicle_id': id, 'payment_id': None,
+                   'detail': f"paid {paid:.2f} against a price of {price:.2f}"}
+
+
+def read_only_url(url):
+    """SQLite URL that opens the same file read-only; other URLs are returned unchanged."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite' or parsed.database in (None, '', ':memory:'):
+        return parsed
+    path = os.path.abspath(parsed.database)
+    return parsed.set(database=f'file:{path}?mode=ro', query={'uri': 'true'})
+
+
+def _reader(url):
+    engine = _reader_engines.get(url)
+    if engine is None:
+        engine = _reader_engines[url] = _create_engine(read_only_url(url), pragmas=READER_PRAGMAS)
+    return engine
+
+
+def id_ranges(session, parts):
+    """Split [min(vehicle id), max(vehicle id)] into up to `parts` contiguous inclusive ranges."""
+    low, high = session.query(func.min(Vehicle.id), func.max(Vehicle.id)).one()
+    if low is None:
+        return []
+    step = max(math.ceil((high - low + 1) / parts), 1)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def scan_range(url, low, high):
+    """Worker entry point: scan one ID range on this process's read-only engine for url."""
+    with OrmSession(_reader(url)) as session:
+        return scan(session, low, high)
+
+
+def scan(session, low, high):
+    """Aggregate vehicles with low <= id <= high (and their payments) into an Audit."""
+    audit = Audit()
+    in_range = Vehicle.id.between(low, high)
+    # Archived payments count through the vehicle's rollup row.
+    actual_total = func.coalesce(func.sum(cents(Payment.amount)), 0) + func.coalesce(cents(PaymentRollup.amount), 0)
+    actual_count = func.count(Payment.id) + func.coalesce(PaymentRollup.payment_count, 0)
+    rows = (session.query(Vehicle.id, Vehicle.dealership_id, Vehicle.customer_id, cents(Vehicle.price),
+                          cents(Vehicle.total_paid), Vehicle.payment_count, actual_total, actual_count)
+            .outerjoin(Payment, Payment.vehicle_id == Vehicle.id)
+            .outerjoin(PaymentRollup, PaymentRollup.vehicle_id == Vehicle.id)
+            .filter(in_range)
+            .group_by(Vehicle.id))
+    for id, dealership_id, customer_id, price, stored_total, stored_count, paid, payments in rows:
+        sold = customer_id is not None
+        totals = audit.dealerships.get(dealership_id)
+        row = [1, int(sold), price, paid, payments]
+        audit.dealerships[dealership_id] = row if totals is None else [a + b for a, b in zip(totals, row)]
+        if sold:
+            totals = audit.customers.get(customer_id)
+            row = [1, price, paid, payments]
+            audit.customers[customer_id] = row if totals is None else [a + b for a, b in zip(totals, row)]
+        if stored_total != paid or stored_count != payments:
+            audit.drift.append((id, from_cents(stored_total), from_cents(paid), stored_count, payments))
+        if paid > price:
+            audit.overpaid.append((id, from_cents(price), from_cents(paid)))
+    mismatches = (session.query(Payment.id, Payment.vehicle_id, Payment.customer_id, Vehicle.customer_id)
+                  .join(Vehicle, Vehicle.id == Payment.vehicle_id)
+                  .filter(Payment.vehicle_id.between(low, high),
+                          Vehicle.customer_id != None, Payment.customer_id != Vehicle.customer_id))
+    audit.owner_mismatches.extend(tuple(row) for row in mismatches)
+    return audit
+
+
+def audit_fleet(session, workers=None, url=None, ranges_per_worker=RANGES_PER_WORKER):
+    """Scan every vehicle with `workers` processes (default: one per CPU) and return the merged Audit.
+
+    With one worker, or an in-memory database, the scan runs on session
+    itself. Otherwise session's transaction is committed first and the
+    workers read the committed state of the same database file.
+    """
+    url = str(url or session.get_bind().engine.url.render_as_string(hide_password=False))
+    workers = workers or os.cpu_count() or 1
+    if make_url(url).database in (None, '', ':memory:'):
+        workers = 1
+    ranges = id_ranges(session, workers * ranges_per_worker if workers > 1 else 1)
+    audit = Audit()
+    if workers == 1:
+        for low, high in ranges:
+            audit.merge(scan(session, low, high))
+        return audit
+    session.commit()
+    # spawn, not fork: the parent's pooled SQLite connections must not be shared with children.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for partial in pool.map(scan_range, [url] * len(ranges), *zip(*ranges)):
+            audit.merge(partial)
+    return audit
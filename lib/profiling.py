@@ -0,0 +1,214 @@
+# lib/profiling.py
+"""Opt-in SQL and hot-path instrumentation, enabled with `--profile` or EV_PROFILE=1.
+
+While a Profiler is active every Engine reports statement counts and
+timings, every Session reports flush/commit times, and model methods
+wrapped with @timed record spans. Nothing is hooked until enable() is
+called, so the unprofiled path pays only a None check per timed call.
+"""
+import cProfile
+import functools
+import json
+import re
+import sys
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession, Mapper
+
+_active = None
+
+
+def _normalize(statement):
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+class _Stat:
+    __slots__ = ('calls', 'total', 'max', 'rows')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, elapsed, rows=0):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.rows += rows
+
+    def as_dict(self):
+        return {'calls': self.calls, 'total_ms': self.total * 1000, 'max_ms': self.max * 1000, 'rows': self.rows}
+
+
+class Profiler:
+    def __init__(self, cprofile=False):
+        self.statements = {}
+        self.spans = {}
+        self.loaded = {}
+        self.started = time.perf_counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    def record_statement(self, statement, elapsed, rows):
+        key = _normalize(statement)
+        self.statements.setdefault(key, _Stat()).add(elapsed, rows)
+
+    def record_span(self, name, elapsed):
+        self.spans.setdefault(name, _Stat()).add(elapsed)
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - started)
+
+    def to_dict(self):
+        from lib.models.cache import identity_cache
+        return {
+            'wall_ms': (time.perf_counter() - self.started) * 1000,
+            'statement_count': sum(s.calls for s in self.statements.values()),
+            'statement_ms': sum(s.total for s in self.statements.values()) * 1000,
+            'statements': {sql: stat.as_dict() for sql, stat in self.statements.items()},
+            'spans': {name: stat.as_dict() for name, stat in self.spans.items()},
+            'instances_loaded': dict(self.loaded),
+            'identity_cache': identity_cache.stats(),
+        }
+
+    def summary(self, top=15):
+        data = self.to_dict()
+        lines = [f"Profile: {data['statement_count']} statements, {data['statement_ms']:.2f} ms in SQL, "
+                 f"{data['wall_ms']:.2f} ms wall"]
+        if self.spans:
+            lines.append(f"  {'calls':>7}{'total ms':>11}{'max ms':>10}  span")
+            for name, stat in sorted(self.spans.items(), key=lambda item: -item[1].total):
+                lines.append(f"  {stat.calls:>7}{stat.total * 1000:>11.2f}{stat.max * 1000:>10.2f}  {name}")
+        if self.statements:
+            lines.append(f"  {'calls':>7}{'total ms':>11}{'max ms':>10}{'rows':>8}  statement")
+            for sql, stat in sorted(self.statements.items(), key=lambda item: -item[1].total)[:top]:
+                lines.append(f"  {stat.calls:>7}{stat.total * 1000:>11.2f}{stat.max * 1000:>10.2f}{stat.rows:>8}  {sql[:100]}")
+        if self.loaded:
+            lines.append("  Instances loaded: " + ", ".join(f"{name} {count}" for name, count in sorted(self.loaded.items())))
+        cache = data['identity_cache']
+        lines.append(f"  Identity cache: {cache['hits']} hits, {cache['misses']} misses, {cache['evictions']} evictions")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Write JSON stats, or a cProfile dump when path ends in .prof."""
+        if path.endswith('.prof') and self.cprofile is not None:
+            self.cprofile.dump_stats(path)
+            return
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def active():
+    return _active
+
+
+def enable(cprofile=False):
+    """Start collecting into a fresh Profiler and return it."""
+    global _active
+    if _active is not None:
+        return _active
+    _active = Profiler(cprofile=cprofile)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(OrmSession, 'before_flush', _before_flush)
+    event.listen(OrmSession, 'after_flush_postexec', _after_flush)
+    event.listen(OrmSession, 'before_commit', _before_commit)
+    event.listen(OrmSession, 'after_commit', _after_commit)
+    event.listen(Mapper, 'load', _on_load)
+    if _active.cprofile is not None:
+        _active.cprofile.enable()
+    return _active
+
+
+def disable():
+    """Stop collecting and return the Profiler that was active, if any."""
+    global _active
+    profiler, _active = _active, None
+    if profiler is None:
+        return None
+    if profiler.cprofile is not None:
+        profiler.cprofile.disable()
+    event.remove(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.remove(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.remove(OrmSession, 'before_flush', _before_flush)
+    event.remove(OrmSession, 'after_flush_postexec', _after_flush)
+    event.remove(OrmSession, 'before_commit', _before_commit)
+    event.remove(OrmSession, 'after_commit', _after_commit)
+    event.remove(Mapper, 'load', _on_load)
+    return profiler
+
+
+def finish(output=None, stream=None):
+    """Disable profiling, print the summary to stderr and optionally write it to output."""
+    profiler = disable()
+    if profiler is None:
+        return None
+    print(profiler.summary(), file=stream or sys.stderr)
+    if output:
+        profiler.write(output)
+    return profiler
+
+
+def timed(name):
+    """Record calls to the wrapped function as a span while profiling is enabled."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if _active is not None:
+                    _active.record_span(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('profile_started')
+    if not stack:
+        return
+    started = stack.pop()
+    if _active is not None:
+        # DB-API rowcount is the affected row count for DML and -1 for SQLite SELECTs;
+        # rows returned by ORM queries show up under instances loaded instead.
+        _active.record_statement(statement, time.perf_counter() - started, max(cursor.rowcount, 0))
+
+
+def _before_flush(session, flush_context, instances):
+    session.info['profile_flush_started'] = time.perf_counter()
+
+
+def _after_flush(session, flush_context):
+    started = session.info.pop('profile_flush_started', None)
+    if _active is not None and started is not None:
+        _active.record_span('session.flush', time.perf_counter() - started)
+
+
+def _before_commit(session):
+    session.info['profile_commit_started'] = time.perf_counter()
+
+
+def _after_commit(session):
+    started = session.info.pop('profile_commit_started', None)
+    if _active is not None and started is not None:
+        _active.record_span('session.commit', time.perf_counter() - started)
+
+
+def _on_load(target, context):
+    if _active is not None:
+        name = type(target).__name__
+        _active.loaded[name] = _active.loaded.get(name, 0) + 1
@@ -0,0 +1,77 @@
+# lib/reports.py
+"""Fleet-wide reports, each computed by a single grouped query and streamed as dict rows."""
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, select, union_all
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.customer import Customer
+from lib.models.payment import Payment, PaymentRollup
+from lib.models.archive import archived_payments, attach_archive
+
+STREAM_BATCH_SIZE = 1000
+OVERDUE_AFTER_DAYS = 30
+
+CUSTOMER_BALANCE_FIELDS = ['customer_id', 'customer', 'vehicles', 'total_price', 'total_paid', 'outstanding']
+DEALERSHIP_REVENUE_FIELDS = ['dealership_id', 'dealership', 'month', 'payments', 'revenue']
+VEHICLE_STATUS_FIELDS = ['vehicle_id', 'model', 'dealership_id', 'customer_id', 'price', 'total_paid',
+                         'outstanding', 'last_payment', 'status']
+
+
+def customer_balances(session, dealership_id=None):
+    """Outstanding balance per customer over the vehicles they own, from the per-vehicle ledger."""
+    query = (session.query(Customer.id, Customer.name, func.count(Vehicle.id), func.sum(Vehicle.price),
+                           func.sum(Vehicle.total_paid), func.sum(Vehicle.price - Vehicle.total_paid))
+             .join(Vehicle, Vehicle.customer_id == Customer.id)
+             .group_by(Customer.id)
+             .order_by(Customer.id))
+    if dealership_id is not None:
+        query = query.filter(Vehicle.dealership_id == dealership_id)
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield dict(zip(CUSTOMER_BALANCE_FIELDS, row))
+
+
+def dealership_revenue(session, dealership_id=None, since=None, include_archived=False):
+    """Payments received per dealership per calendar month; include_archived also counts archived payments."""
+    payments = Payment.__table__
+    if include_archived and attach_archive(session):
+        payments = union_all(select(Payment.__table__), select(archived_payments)).subquery()
+    month = func.strftime('%Y-%m', payments.c.payment_date)
+    query = (session.query(Dealership.id, Dealership.name, month, func.count(payments.c.id), func.sum(payments.c.amount))
+             .select_from(payments)
+             .join(Vehicle, Vehicle.id == payments.c.vehicle_id)
+             .join(Dealership, Dealership.id == Vehicle.dealership_id)
+             .group_by(Dealership.id, month)
+             .order_by(Dealership.id, month))
+    if dealership_id is not None:
+        query = query.filter(Vehicle.dealership_id == dealership_id)
+    if since is not None:
+        query = query.filter(payments.c.payment_date >= since)
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield dict(zip(DEALERSHIP_REVENUE_FIELDS, row))
+
+
+def vehicle_status(session, dealership_id=None, since=None):
+    """Sold vehicles that are fully paid, or overdue: a balance left and no payment since `since`.
+
+    since defaults to OVERDUE_AFTER_DAYS ago.
+    """
+    if since is None:
+        since = datetime.now() - timedelta(days=OVERDUE_AFTER_DAYS)
+    # Fully paid vehicles may have had their payments archived; the rollup keeps the last date.
+    last_payment = func.coalesce(func.max(Payment.payment_date), PaymentRollup.last_payment_date)
+    status = case(
+        (Vehicle.total_paid >= Vehicle.price, 'paid'),
+        ((last_payment == None) | (last_payment < since), 'overdue'),
+        else_='current')
+    query = (session.query(Vehicle.id, Vehicle.model, Vehicle.dealership_id, Vehicle.customer_id, Vehicle.price,
+                           Vehicle.total_paid, Vehicle.price - Vehicle.total_paid, last_payment, status)
+             .outerjoin(Payment, Payment.vehicle_id == Vehicle.id)
+             .outerjoin(PaymentRollup, PaymentRollup.vehicle_id == Vehicle.id)
+             .filter(Vehicle.customer_id != None)
+             .group_by(Vehicle.id)
+             .having(status != 'current')
+             .order_by(Vehicle.id))
+    if dealership_id is not None:
+        query = query.filter(Vehicle.dealership_id == dealership_id)
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield dict(zip(VEHICLE_STATUS_FIELDS, row))
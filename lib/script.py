@@ -0,0 +1,148 @@
+# lib/script.py
+"""Run CLI commands from a script: one command per line, as shell words or JSON.
+
+    create-dealership --name "Lagos EV Centre" --location Lagos
+    ["create-customer", "--name", "Ada Obi", "--email", "ada@example.com"]
+    {"command": "create-payment", "vehicle_id": 3, "customer_id": 1, "amount": 500}
+    {"command": "report balances", "format": "jsonl"}
+
+Blank lines and lines starting with # are skipped. In the object form every
+key other than "command" and "args" (positional arguments) becomes an option;
+true adds a flag and false/null leaves the option out.
+"""
+import copy
+import json
+import shlex
+import click
+
+PROG_NAME = 'ev-african-motors'
+
+
+def without_prompts(command, exclude=()):
+    """Copy a command tree so no option prompts; a missing option takes its default instead."""
+    command = copy.copy(command)
+    params = []
+    for param in command.params:
+        if isinstance(param, click.Option) and param.prompt:
+            param = copy.copy(param)
+            param.prompt = None
+        params.append(param)
+    command.params = params
+    if isinstance(command, click.Group):
+        command.commands = {name: without_prompts(sub) for name, sub in command.commands.items()
+                            if name not in exclude}
+    return command
+
+
+def _option_name(command, key):
+    opts = {opt for param in command.params for opt in getattr(param, 'opts', ())}
+    for name in (f'--{key}', f"--{key.replace('_', '-')}", f"--{key.replace('-', '_')}"):
+        if name in opts:
+            return name
+    return f'--{key}'
+
+
+def object_args(group, data):
+    """CLI arguments for a {"command": ..., option: value, "args": [...]} script line."""
+    data = dict(data)
+    words = str(data.pop('command', '')).split()
+    if not words:
+        raise ValueError('missing "command"')
+    command = group
+    for word in words:
+        command = command.commands.get(word) if isinstance(command, click.Group) else None
+        if command is None:
+            raise ValueError(f"unknown command {' '.join(words)!r}")
+    args = list(words)
+    positional = data.pop('args', [])
+    for key, value in data.items():
+        name = _option_name(command, key)
+        if value is True:
+            args.append(name)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            for item in value:
+                args.extend([name, str(item)])
+        else:
+            args.extend([name, str(value)])
+    return args + [str(arg) for arg in positional]
+
+
+def parse_line(group, line):
+    """CLI arguments for one script line, or None for blank lines and comments."""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line[0] == '{':
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError('expected a JSON object')
+        return object_args(group, data)
+    if line[0] == '[':
+        data = json.loads(line)
+        if not isinstance(data, list):
+            raise ValueError('expected a JSON array')
+        return [str(arg) for arg in data]
+    return shlex.split(line)
+
+
+def run_command(group, args):
+    """Invoke one command without exiting the process; return True if it succeeded."""
+    try:
+        return group.main(args, prog_name=PROG_NAME, standalone_mode=False) in (None, 0)
+    except click.ClickException as e:
+        e.show()
+    except click.Abort:
+        click.echo("Aborted!", err=True)
+    except Exception as e:
+        click.echo(f"Error: {e}")
+    return False
+
+
+class ScriptReport:
+    def __init__(self):
+        self.ran = 0
+        self.failed = 0
+        self.committed = 0
+        self.rolled_back = 0
+        self.stopped_at = None
+
+
+def run_script(group, lines, scope, commit_every=0, on_error='stop', echo=False):
+    """Run script lines through group inside a batch_session() scope and return a ScriptReport.
+
+    Work is committed every commit_every successful commands (0: only when the
+    caller's batch_session() exits). With on_error='stop' the first failure
+    rolls back everything since the last commit and ends the script.
+    """
+    report = ScriptReport()
+    pending = 0
+    for number, line in enumerate(lines, 1):
+        try:
+            args = parse_line(group, line)
+        except ValueError as e:
+            click.echo(f"Error: line {number}: {e}")
+            ok = False
+        else:
+            if args is None:
+                continue
+            if echo:
+                click.echo(f"> {line.strip()}")
+            ok = run_command(group, args)
+        report.ran += 1
+        if ok:
+            pending += 1
+            if commit_every and pending >= commit_every:
+                scope.commit()
+                report.committed += pending
+                pending = 0
+            continue
+        report.failed += 1
+        if on_error == 'stop':
+            scope.rollback()
+            report.rolled_back = pending
+            report.stopped_at = number
+            return report
+    report.committed += pending
+    return report
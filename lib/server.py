@@ -0,0 +1,313 @@
+# lib/server.py
+"""HTTP/JSON API over the model layer, on the standard library's threading HTTP server.
+
+    ev-african-motors serve --port 8000
+
+    GET  /dealerships, /customers, /vehicles          NDJSON, ?after=<id>&limit=<n>
+    GET  /dealerships/<id>, /customers/<id>, /vehicles/<id>
+    POST /dealerships {"name", "location"}
+    POST /customers {"name", "email"}
+    POST /vehicles {"model", "price", "dealership_id"[, "customer_id"]}
+    GET  /vehicles/<id>/balance
+    GET  /vehicles/<id>/payments                      NDJSON, ?since=&until=&include_archived=1
+    POST /vehicles/<id>/payments {"amount", "customer_id"[, "payment_date"]}
+
+Every request runs on its own Session over the process-wide pooled engine
+(lib.helpers.get_engine), and connections speak HTTP/1.1 keep-alive, so
+neither the database connection nor the client's socket is reopened per
+request. Money is sent as JSON numbers and read back exactly (request
+bodies parse numbers as Decimal).
+
+List endpoints stream one JSON object per line with chunked transfer
+encoding, a batch of rows per chunk, so memory stays flat whatever the
+page size. Pages are keyset cursors on id: when more rows follow, a
+Link: <...?after=<last id>&limit=<n>>; rel="next" header names the next page.
+
+Single dealerships, customers and vehicles carry an ETag; a GET with a
+matching If-None-Match is answered 304 Not Modified without a body.
+"""
+import hashlib
+import json
+import re
+from datetime import datetime
+from decimal import Decimal
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from urllib.parse import urlsplit, parse_qs, urlencode
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session as OrmSession
+from lib.helpers import get_engine, _json_value
+from lib.models.dealership import Dealership
+from lib.models.vehicle import Vehicle
+from lib.models.customer import Customer
+from lib.models.locking import is_busy
+from lib.constants import DEFAULT_BATCH_SIZE
+
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 10000
+STREAM_BATCH_SIZE = 100
+NDJSON = 'application/x-ndjson'
+
+DEALERSHIP_FIELDS = ('id', 'name', 'location')
+CUSTOMER_FIELDS = ('id', 'name', 'email')
+VEHICLE_FIELDS = ('id', 'model', 'price', 'dealership_id', 'customer_id')
+PAYMENT_FIELDS = ('id', 'vehicle_id', 'customer_id', 'amount', 'payment_date', 'status', 'reference')
+BALANCE_FIELDS = ('vehicle_id', 'price', 'total_paid', 'remaining_balance')
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def record(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_value)
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+
+
+def _date(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be an ISO date")
+
+
+def _page(session, model, after, limit):
+    """The id to continue after when more than limit rows follow after, else None.
+
+    One index-only query, in the same transaction as the rows that follow.
+    """
+    query = session.query(model.id).order_by(model.id)
+    if after is not None:
+        query = query.filter(model.id > after)
+    ids = [id for (id,) in query.offset(limit - 1).limit(2)]
+    return ids[0] if len(ids) == 2 else None
+
+
+class Stream:
+    """A list response: records streamed as NDJSON, with an optional next-page cursor."""
+
+    def __init__(self, records, next_query=None):
+        self.records = records
+        self.next_query = next_query
+
+
+class Api:
+    """The route table: (method, path pattern, handler). Handlers return a record, a Stream or (status, record)."""
+
+    ENTITIES = {'dealerships': (Dealership, DEALERSHIP_FIELDS), 'customers': (Customer, CUSTOMER_FIELDS),
+                'vehicles': (Vehicle, VEHICLE_FIELDS)}
+
+    def __init__(self):
+        self.routes = [
+            ('GET', re.compile(r'/(dealerships|customers|vehicles)'), self.list_entities),
+            ('GET', re.compile(r'/(dealerships|customers|vehicles)/(\d+)'), self.find_entity),
+            ('POST', re.compile(r'/dealerships'), self.create_dealership),
+            ('POST', re.compile(r'/customers'), self.create_customer),
+            ('POST', re.compile(r'/vehicles'), self.create_vehicle),
+            ('GET', re.compile(r'/vehicles/(\d+)/balance'), self.vehicle_balance),
+            ('GET', re.compile(r'/vehicles/(\d+)/payments'), self.list_payments),
+            ('POST', re.compile(r'/vehicles/(\d+)/payments'), self.add_payment),
+        ]
+
+    def resolve(self, method, path):
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                if route_method == method:
+                    return handler, match.groups()
+                allowed = True
+        if allowed:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported on {path}")
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+
+    def list_entities(self, session, query, body, entity):
+        model, fields = self.ENTITIES[entity]
+        after = _int(query['after'], 'after') if 'after' in query else None
+        limit = _int(query.get('limit', PAGE_LIMIT), 'limit')
+        if not 1 <= limit <= MAX_PAGE_LIMIT:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+        next_after = _page(session, model, after, limit)
+        rows = islice(model.iter_all(session, min(limit, DEFAULT_BATCH_SIZE), after), limit)
+        return Stream((record(instance, fields) for instance in rows),
+                      None if next_after is None else {'after': next_after, 'limit': limit})
+
+    def _find(self, session, model, id):
+        instance = model.find_by_id(session, id)
+        if instance is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"{model.__name__} with ID {id} not found")
+        return instance
+
+    def find_entity(self, session, query, body, entity, id):
+        model, fields = self.ENTITIES[entity]
+        return record(self._find(session, model, int(id)), fields)
+
+    def create_dealership(self, session, query, body):
+        dealership = Dealership.create(session, body.get('name'), body.get('location'))
+        return HTTPStatus.CREATED, record(dealership, DEALERSHIP_FIELDS)
+
+    def create_customer(self, session, query, body):
+        customer = Customer.create(session, body.get('name'), body.get('email'))
+        return HTTPStatus.CREATED, record(customer, CUSTOMER_FIELDS)
+
+    def create_vehicle(self, session, query, body):
+        customer_id = body.get('customer_id')
+        vehicle = Vehicle.create(session, body.get('model'), body.get('price'),
+                                 _int(body.get('dealership_id'), 'dealership_id'),
+                                 None if customer_id is None else _int(customer_id, 'customer_id'))
+        return HTTPStatus.CREATED, record(vehicle, VEHICLE_FIELDS)
+
+    def vehicle_balance(self, session, query, body, id):
+        vehicle = self._find(session, Vehicle, int(id))
+        total_paid = vehicle.get_total_payments(session)
+        return dict(zip(BALANCE_FIELDS, (vehicle.id, vehicle.price, total_paid, vehicle.price - total_paid)))
+
+    def list_payments(self, session, query, body, id):
+        vehicle = self._find(session, Vehicle, int(id))
+        since = _date(query['since'], 'since') if 'since' in query else None
+        until = _date(query['until'], 'until') if 'until' in query else None
+        include_archived = query.get('include_archived', '0').lower() in ('1', 'true', 'yes')
+        payments = vehicle.get_payments(session, since, until, include_archived)
+        return Stream(record(payment, PAYMENT_FIELDS) for payment in payments)
+
+    def add_payment(self, session, query, body, id):
+        vehicle = self._find(session, Vehicle, int(id))
+        payment_date = body.get('payment_date')
+        payment = vehicle.add_payment(session, body.get('amount'), _int(body.get('customer_id'), 'customer_id'),
+                                      _date(payment_date, 'payment_date') if payment_date else None)
+        return HTTPStatus.CREATED, record(payment, PAYMENT_FIELDS)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'EVAfricanMotors'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive clients wait out a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length), parse_float=Decimal)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Request body must be JSON")
+        if not isinstance(body, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+        return body
+
+    def handle_api(self, method):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            # Read the body before anything can fail, or it would be parsed as the next request.
+            body = self._body() if method == 'POST' else {}
+            handler, arguments = self.server.api.resolve(method, url.path.rstrip('/') or '/')
+            with OrmSession(bind=self.server.engine) as session:
+                result = handler(session, query, body, *arguments)
+                if isinstance(result, Stream):
+                    self.send_stream(url.path, result)
+                else:
+                    status, document = result if isinstance(result, tuple) else (HTTPStatus.OK, result)
+                    self.send_json(status, document, etag=method == 'GET' and 'id' in document)
+        except HttpError as e:
+            self.send_json(e.status, {'error': str(e)})
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+        except OperationalError as e:
+            if not is_busy(e):
+                self.send_error_json(e)
+            else:
+                self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Database is busy"}, headers={'Retry-After': '1'})
+        except Exception as e:
+            self.send_error_json(e)
+
+    def send_error_json(self, error):
+        self.log_error("%s: %s", type(error).__name__, error)
+        self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"Internal server error: {error}"})
+
+    def send_json(self, status, document, etag=False, headers=None):
+        body = _dumps(document).encode()
+        headers = dict(headers or {})
+        if etag:
+            tag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+            headers.update({'ETag': tag, 'Cache-Control': 'no-cache'})
+            if tag in (self.headers.get('If-None-Match') or '').replace(' ', '').split(','):
+                status, body = HTTPStatus.NOT_MODIFIED, b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, path, stream):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', NDJSON)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if stream.next_query is not None:
+            self.send_header('Link', f'<{path}?{urlencode(stream.next_query)}>; rel="next"')
+        self.end_headers()
+        lines = []
+        try:
+            for document in stream.records:
+                lines.append(_dumps(document))
+                if len(lines) == STREAM_BATCH_SIZE:
+                    self._write_chunk(lines)
+                    lines = []
+        except Exception as e:
+            # The status line is gone; ending without the last chunk tells the client the body is incomplete.
+            self.log_error("Stream of %s failed: %s", path, e)
+            self.close_connection = True
+            return
+        self._write_chunk(lines)
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, lines):
+        if lines:
+            data = ('\n'.join(lines) + '\n').encode()
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+
+class ApiServer(ThreadingHTTPServer):
+    """A thread per connection, all sharing the pooled engine for url (default EV_DATABASE_URL)."""
+    daemon_threads = True
+
+    def __init__(self, address, url=None, verbose=False):
+        self.engine = get_engine(url)
+        self.api = Api()
+        self.verbose = verbose
+        super().__init__(address, ApiHandler)
+
+
+def serve(host='127.0.0.1', port=8000, url=None, verbose=False):
+    server = ApiServer((host, port), url, verbose)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,196 @@
+# lib/sharding.py
+"""Per-region shard databases, with model operations routed to the right one.
+
+A shard map, a JSON file named by EV_SHARD_MAP, gives every region its own
+database and says which dealership locations belong to it:
+
+    {"shards": {"kenya": {"url": "sqlite:///kenya.db", "block": 1},
+                "nigeria": {"url": "sqlite:///nigeria.db", "block": 2},
+                "south_africa": {"url": "sqlite:///south_africa.db", "block": 3}},
+     "locations": {"Nairobi": "kenya", "Mombasa": "kenya", "Lagos": "nigeria",
+                   "Johannesburg": "south_africa"},
+     "default": "kenya"}
+
+Each shard is a complete database with the usual schema, holding a
+region's dealerships, their vehicles and payments, and the customers who
+buy there, so foreign keys, the payment ledger and search all work within
+a shard unchanged. Writes to different regions take different SQLite file
+locks and no longer queue behind each other.
+
+Rows take their ids from their shard's block: a shard with block b numbers
+rows from b * ID_BLOCK + 1, so an id alone says which shard holds the row
+and rows from different shards never collide. Block 0 is the range an
+unsharded database already uses, so an existing database can stay on as
+one shard. "default" (optional) takes dealership locations the map does
+not list.
+
+ShardRouter hands out an ordinary Session per shard: for_location(),
+for_id() and for_region() pick it, and the model methods run on it as
+they would on a single database. Reads across every shard fan out to one
+thread per shard (sqlite3 releases the GIL while a statement runs) and the
+results are chained in block order, which is id order, so listings and
+reports ordered by id stay ordered.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from sqlalchemy.orm import Session as OrmSession
+from lib.helpers import get_engine
+from lib.models.base import Base
+
+ID_BLOCK = 10 ** 12
+
+
+class ShardMap:
+    def __init__(self, shards, locations=None, default=None):
+        """shards is {name: {'url': ..., 'block': n}}; locations is {location: shard name}."""
+        blocks = {}
+        for name, shard in shards.items():
+            if not isinstance(shard.get('block'), int) or shard['block'] < 0:
+                raise ValueError(f"Shard {name!r} needs a non-negative integer block")
+            if shard['block'] in blocks:
+                raise ValueError(f"Shards {blocks[shard['block']]!r} and {name!r} share block {shard['block']}")
+            blocks[shard['block']] = name
+        for location, name in (locations or {}).items():
+            if name not in shards:
+                raise ValueError(f"Location {location!r} maps to unknown shard {name!r}")
+        if default is not None and default not in shards:
+            raise ValueError(f"Default shard {default!r} is not in the shard map")
+        self.urls = {name: shard['url'] for name, shard in shards.items()}
+        self.blocks = {name: shard['block'] for name, shard in shards.items()}
+        self.names = [blocks[block] for block in sorted(blocks)]
+        self.locations = {location.strip().lower(): name for location, name in (locations or {}).items()}
+        self.default = default
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            document = json.load(f)
+        if not isinstance(document, dict) or not document.get('shards'):
+            raise ValueError(f"{path}: a shard map needs a \"shards\" object")
+        return cls(document['shards'], document.get('locations'), document.get('default'))
+
+    def shard_for_location(self, location):
+        name = self.locations.get((location or '').strip().lower(), self.default)
+        if name is None:
+            raise ValueError(f"No shard for location {location!r}")
+        return name
+
+    def shard_for_id(self, id):
+        block = int(id) // ID_BLOCK
+        for name, shard_block in self.blocks.items():
+            if shard_block == block:
+                return name
+        raise ValueError(f"No shard holds ID {id}")
+
+    def check_region(self, region):
+        if region not in self.urls:
+            raise ValueError(f"Unknown region {region!r}; expected one of {', '.join(self.names)}")
+        return region
+
+
+def _autoincrement_tables(conn):
+    return {name for name, sql in conn.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+            if 'AUTOINCREMENT' in (sql or '').upper()}
+
+
+def reserve_id_block(engine, block):
+    """Start each table's ids at block * ID_BLOCK + 1, checking no row already lies outside the block."""
+    low, high = block * ID_BLOCK, (block + 1) * ID_BLOCK
+    with engine.begin() as conn:
+        autoincrement = _autoincrement_tables(conn)
+        for table in Base.metadata.sorted_tables:
+            if 'id' not in table.c:
+                continue
+            outside = conn.exec_driver_sql(
+                f'SELECT COUNT(*) FROM {table.name} WHERE id <= ? OR id >= ?', (low, high)).scalar()
+            if outside:
+                raise ValueError(f"{engine.url.database}: {outside} {table.name} rows have IDs outside block {block}")
+            if not block:
+                continue
+            if table.name not in autoincrement:
+                raise ValueError(f"{engine.url.database}: table {table.name} predates AUTOINCREMENT ids "
+                                 f"and can only be used as block 0")
+            # sqlite_sequence holds the largest id handed out so far.
+            conn.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ? AND seq < ?', (table.name, low))
+            conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? WHERE NOT EXISTS '
+                                 '(SELECT 1 FROM sqlite_sequence WHERE name = ?)', (table.name, low, table.name))
+
+
+class ShardRouter:
+    """One Session per shard of a ShardMap, picked by location, id or region."""
+
+    def __init__(self, shard_map):
+        self.map = shard_map
+        self._engines = {}
+        self._sessions = {}
+
+    def engine(self, shard):
+        engine = self._engines.get(shard)
+        if engine is None:
+            engine = get_engine(self.map.urls[shard])
+            reserve_id_block(engine, self.map.blocks[shard])
+            self._engines[shard] = engine
+        return engine
+
+    def session(self, shard):
+        session = self._sessions.get(shard)
+        if session is None:
+            session = self._sessions[shard] = OrmSession(bind=self.engine(shard))
+        return session
+
+    def for_location(self, location):
+        """The session of the shard a dealership at location belongs in."""
+        return self.session(self.map.shard_for_location(location))
+
+    def for_id(self, id):
+        """The session of the shard holding the row with this id, whatever its table."""
+        return self.session(self.map.shard_for_id(id))
+
+    def for_region(self, region):
+        return self.session(self.map.check_region(region))
+
+    def _run(self, shard, fn):
+        with OrmSession(bind=self.engine(shard)) as session:
+            result = fn(session)
+            # Generators must be drained before their session closes.
+            return list(result) if result is not None else []
+
+    def fan_out(self, fn):
+        """Call fn(session) on every shard at once; return {shard: list of its results} in block order.
+
+        Each call gets a session of its own, closed afterwards, so ORM
+        instances come back detached with their loaded attributes.
+        """
+        for shard in self.map.names:
+            self.engine(shard)  # set up on this thread, once
+        with ThreadPoolExecutor(max_workers=len(self.map.names)) as pool:
+            futures = [pool.submit(self._run, shard, fn) for shard in self.map.names]
+            return {shard: future.result() for shard, future in zip(self.map.names, futures)}
+
+    def gather(self, fn):
+        """fn(session)'s results from every shard, fetched in parallel and chained in id order."""
+        return chain.from_iterable(self.fan_out(fn).values())
+
+    def get_all(self, model):
+        return list(self.gather(model.get_all))
+
+    def iter_all(self, model, batch_size=None, after_id=None):
+        """Stream model rows from each shard in turn, keyset-paginated; rows come in id order across shards."""
+        options = {} if batch_size is None else {'batch_size': batch_size}
+        for shard in self.map.names:
+            if after_id is not None and (self.map.blocks[shard] + 1) * ID_BLOCK <= after_id:
+                continue
+            yield from model.iter_all(self.session(shard), after_id=after_id, **options)
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+def router_from_env():
+    """A ShardRouter for the map in EV_SHARD_MAP, or None when it isn't set."""
+    path = os.environ.get('EV_SHARD_MAP')
+    return ShardRouter(ShardMap.load(path)) if path else None
@@ -8,6 +8,11 @@ setup(
         'click',
         'sqlalchemy',
     ],
+    extras_require={
+        'async': ['aiosqlite'],
+        'export': ['pyarrow'],
+        'analytics': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'ev-african-motors=lib.cli:main',
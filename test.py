@@ -1,7 +1,1032 @@
 # test.py
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from click.testing import CliRunner
+from sqlalchemy import event
+from sqlalchemy.schema import CreateTable
 from lib.models.dealership import Dealership
 from lib.models.vehicle import Vehicle
 from lib.models.customer import Customer
 from lib.models.payment import Payment
-from lib.helpers import setup_database
-print("All modules imported successfully")
\ No newline at end of file
+from lib.helpers import setup_database, get_engine, dispose_engines, SCHEMA_VERSION
+print("All modules imported successfully")
+
+
+def temp_database_url():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    return f'sqlite:///{path}'
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement != 'BEGIN':
+            statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_shared_engine_and_schema_version():
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        assert get_engine(url) is get_engine(url)
+        assert setup_database(url) is session
+        with get_engine(url).connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA user_version').scalar() == SCHEMA_VERSION
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        dealership = Dealership.create(session, "Nairobi EV Hub", "Nairobi")
+        customer = Customer.create(session, "John Doe", "john@example.com")
+        vehicle = Vehicle.create(session, "EV Bolt", 30000, dealership.id, customer.id)
+        vehicle.add_payment(session, 1000, customer.id)
+        assert vehicle.get_remaining_balance(session) == 29000
+    finally:
+        dispose_engines()
+
+
+def test_listing_statement_count_is_constant():
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    runner = CliRunner()
+    try:
+        session = setup_database()
+        dealership = Dealership.create(session, "Lagos EV Centre", "Lagos")
+        customer = Customer.create(session, "Ada Obi", "ada@example.com")
+        counts = []
+        for batch in (3, 30):
+            for i in range(batch):
+                session.add(Vehicle(model=f"EV {i}", price=20000, dealership_id=dealership.id,
+                                    customer_id=customer.id if i % 2 else None))
+            session.commit()
+            for command in (['list-vehicles'], ['list-dealership-vehicles', '--id', str(dealership.id)],
+                            ['list-customer-vehicles', '--id', str(customer.id)]):
+                with count_statements(get_engine()) as statements:
+                    result = runner.invoke(cli, command)
+                assert result.exit_code == 0 and 'Error' not in result.output, result.output
+                counts.append((command[0], len(statements)))
+        assert counts[:3] == counts[3:], counts
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_keyset_listing_streams_in_batches():
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    try:
+        session = setup_database()
+        for i in range(7):
+            Dealership.create(session, f"Dealer {i}", "Kigali")
+        with count_statements(get_engine()) as statements:
+            ids = [d.id for d in Dealership.iter_all(session, batch_size=3)]
+        assert ids == list(range(1, 8)) and len(statements) == 3
+        assert [d.id for d in Dealership.iter_all(session, batch_size=3, after_id=5)] == [6, 7]
+        result = CliRunner().invoke(cli, ['list-dealerships', '--after', '2', '--limit', '2', '--format', 'jsonl'])
+        assert [json.loads(line)['id'] for line in result.output.splitlines()] == [3, 4], result.output
+        result = CliRunner().invoke(cli, ['list-dealerships', '--limit', '1', '--format', 'csv'])
+        assert result.output == "id,name,location\n1,Dealer 0,Kigali\n", result.output
+        result = CliRunner().invoke(cli, ['list-dealerships', '--limit', '-1'])
+        assert result.exit_code == 2 and "Invalid value for '--limit'" in result.output, result.output
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_bulk_import_validates_and_batches():
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    workdir = tempfile.mkdtemp()
+    try:
+        session = setup_database()
+        with open(os.path.join(workdir, 'dealerships.csv'), 'w') as f:
+            f.write("id,name,location\n1,Nairobi EV Hub,Nairobi\n2,,Mombasa\n")
+        with open(os.path.join(workdir, 'vehicles.jsonl'), 'w') as f:
+            f.write('{"model": "EV Bolt", "price": "30000", "dealership_id": 1}\n')
+            f.write('{"model": "EV Leaf", "price": -5, "dealership_id": 1}\n')
+            f.write('{"model": "EV Kona", "price": 41000, "dealership_id": 9}\n')
+            f.write('not json\n')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['import', 'dealerships', os.path.join(workdir, 'dealerships.csv')])
+        assert "Imported 1 dealerships (1 rejected)" in result.output, result.output
+        assert "Name must be a non-empty string" in result.output
+        result = runner.invoke(cli, ['import', 'vehicles', os.path.join(workdir, 'vehicles.jsonl'), '--batch-size', '1'])
+        assert "Imported 1 vehicles (3 rejected)" in result.output, result.output
+        assert "Price must be a positive number" in result.output and "Invalid dealership ID" in result.output
+        assert [(v.model, v.price) for v in Vehicle.get_all(session)] == [("EV Bolt", 30000.0)]
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_migration_adds_indexes_to_existing_database():
+    from sqlalchemy import create_engine
+    from lib.models.base import Base
+    url = temp_database_url()
+    legacy = create_engine(url)
+    with legacy.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            conn.exec_driver_sql(str(CreateTable(table).compile(legacy)))
+        conn.exec_driver_sql('PRAGMA user_version = 1')
+    legacy.dispose()
+    try:
+        with get_engine(url).connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA user_version').scalar() == SCHEMA_VERSION
+            indexes = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            assert {'ix_payments_vehicle_id_payment_date', 'ix_dealerships_name_lower', 'ix_vehicles_dealership_id'} <= indexes
+            plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN SELECT id FROM dealerships WHERE lower(name) = lower('x')").fetchall()
+            assert 'ix_dealerships_name_lower' in str(plan), plan
+    finally:
+        dispose_engines()
+
+
+def test_migration_upgrades_the_checked_in_database():
+    import shutil
+    url = temp_database_url()
+    # Tables holding only ids and foreign keys, at user_version 0.
+    shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib', 'models', 'database.db'),
+                    url[len('sqlite:///'):])
+    try:
+        session = setup_database(url)
+        assert session.connection().exec_driver_sql('PRAGMA user_version').scalar() == SCHEMA_VERSION
+        assert len(Dealership.get_all(session)) == 9
+        dealership = Dealership.create(session, "Kigali EV", "Kigali")
+        customer = Customer.create(session, "Aline Uwase", "aline@example.com")
+        vehicle = Vehicle.create(session, "EV Leaf", 1000, dealership.id, customer.id)
+        vehicle.add_payment(session, 400, customer.id)
+        assert [d.id for d in Dealership.search(session, "kigali")] == [dealership.id]
+        assert Vehicle.reconcile_ledger(session, fix=False) == []
+    finally:
+        dispose_engines()
+
+
+def test_payment_ledger_tracks_postings_and_reconciles():
+    from lib import bulk
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Accra Motors", "Accra")
+        customer = Customer.create(session, "Kofi Mensah", "kofi@example.com")
+        vehicle = Vehicle.create(session, "EV Bolt", 30000, dealership.id, customer.id)
+        first = vehicle.add_payment(session, 1000, customer.id)
+        vehicle.add_payment(session, 2500, customer.id)
+        report = bulk.load(session, 'payments', [({'vehicle_id': vehicle.id, 'customer_id': customer.id, 'amount': '500'}, None)] * 2)
+        assert report.inserted == 2
+        session.expire_all()
+        assert (vehicle.total_paid, vehicle.payment_count) == (4500, 4)
+        assert Payment.delete(session, first.id)
+        assert vehicle.get_remaining_balance(session) == 26500 and vehicle.payment_count == 3
+        assert Vehicle.reconcile_ledger(session) == []
+        session.execute(Vehicle.__table__.update().values(total_paid=0))
+        session.commit()
+        # A ledger that doesn't hold the payment refuses the delete and leaves the session usable.
+        try:
+            Payment.delete(session, session.query(Payment.id).filter(Payment.vehicle_id == vehicle.id).first()[0])
+            assert False, "a delete took the ledger negative"
+        except ValueError as e:
+            assert "run reconcile" in str(e)
+        assert Vehicle.reconcile_ledger(session) == [(vehicle.id, 0, 3500, 3, 3)]
+        assert vehicle.get_total_payments(session) == 3500
+
+        # The loader refuses overpayments, counting the earlier rows of the same file...
+        scooter = Vehicle.create(session, "EV Scooter", 100, dealership.id, customer.id)
+        scooter_id = scooter.id
+        row = {'vehicle_id': scooter_id, 'customer_id': customer.id, 'amount': '60'}
+        report = bulk.load(session, 'payments', [(row, None)] * 2 + [({**row, 'amount': '5000'}, None)])
+        assert report.inserted == 1 and [r[2] for r in report.rejected] == ["Payment exceeds remaining balance"] * 2
+        # ...and its guarded ledger UPDATE refuses a batch that a payment posted since validation would overpay.
+        loader = bulk.LOADERS['payments'](session)
+        record = {**loader.validate({**row, 'amount': '40'}), 'id': None}
+        Vehicle.find_by_id(session, scooter_id).add_payment(session, 10, customer.id)
+        try:
+            loader.flush([record])
+            assert False, "a batch overpaid the vehicle"
+        except ValueError as e:
+            assert "exceeds remaining balance" in str(e)
+        assert Vehicle.find_by_id(session, scooter_id).get_total_payments(session) == 70
+        assert Vehicle.reconcile_ledger(session, fix=False) == []
+    finally:
+        dispose_engines()
+
+
+def test_reports_aggregate_in_one_statement():
+    from datetime import datetime
+    from lib import reports
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Kampala EV", "Kampala")
+        alice = Customer.create(session, "Alice Nakato", "alice@example.com")
+        bob = Customer.create(session, "Bob Okello", "bob@example.com")
+        paid = Vehicle.create(session, "EV Bolt", 1000, dealership.id, alice.id)
+        owing = Vehicle.create(session, "EV Leaf", 5000, dealership.id, alice.id)
+        stale = Vehicle.create(session, "EV Kona", 8000, dealership.id, bob.id)
+        paid.add_payment(session, 1000, alice.id, datetime(2025, 1, 15))
+        owing.add_payment(session, 2000, alice.id, datetime.now())
+        stale.add_payment(session, 500, bob.id, datetime(2025, 2, 1))
+        with count_statements(get_engine(url)) as statements:
+            balances = list(reports.customer_balances(session))
+            revenue = list(reports.dealership_revenue(session, since=datetime(2025, 1, 1)))
+            status = list(reports.vehicle_status(session))
+        assert len(statements) == 3
+        assert [(r['customer_id'], r['outstanding']) for r in balances] == [(alice.id, 3000), (bob.id, 7500)]
+        assert [(r['month'], r['revenue']) for r in revenue][:2] == [('2025-01', 1000), ('2025-02', 500)]
+        assert [(r['vehicle_id'], r['status']) for r in status] == [(paid.id, 'paid'), (stale.id, 'overdue')]
+    finally:
+        dispose_engines()
+
+
+def test_bulk_ingest_is_idempotent_and_guards_balance():
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Durban EV", "Durban")
+        customer = Customer.create(session, "Thandi Zulu", "thandi@example.com")
+        other = Customer.create(session, "Sipho Dube", "sipho@example.com")
+        vehicle = Vehicle.create(session, "EV Bolt", 1000, dealership.id, customer.id)
+        rows = [
+            {'reference': 'MM-1', 'vehicle_id': vehicle.id, 'customer_id': customer.id, 'amount': '400'},
+            {'reference': 'MM-2', 'vehicle_id': vehicle.id, 'customer_id': customer.id, 'amount': 500},
+            {'reference': 'MM-3', 'vehicle_id': vehicle.id, 'customer_id': customer.id, 'amount': 200},
+            {'reference': 'MM-4', 'vehicle_id': vehicle.id, 'customer_id': other.id, 'amount': 50},
+            {'reference': 'MM-5', 'vehicle_id': 999, 'customer_id': customer.id, 'amount': 50},
+            None,
+        ]
+        with count_statements(get_engine(url)) as statements:
+            result = Payment.bulk_ingest(session, rows)
+        assert len(statements) <= 6, statements
+        assert result['inserted'] == 2 and result['duplicates'] == []
+        assert [error for _, _, error in result['rejected']] == [
+            "Row must be an object", "Payment exceeds remaining balance",
+            "Payment customer must match vehicle customer", "Invalid vehicle ID"]
+        again = Payment.bulk_ingest(session, rows[:2])
+        assert again['inserted'] == 0 and again['duplicates'] == ['MM-1', 'MM-2']
+        assert vehicle.get_total_payments(session) == 900
+        # Settlement ingest and the bulk loader share one payment date rule.
+        late = {'reference': 'MM-6', 'vehicle_id': vehicle.id, 'customer_id': customer.id, 'amount': 1,
+                'payment_date': 'last Tuesday'}
+        from lib import bulk
+        assert Payment.bulk_ingest(session, [late])['rejected'][0][2] == "Payment date must be an ISO 8601 timestamp"
+        assert bulk.load(session, 'payments', [(late, None)]).rejected[0][2] == "Payment date must be an ISO 8601 timestamp"
+    finally:
+        dispose_engines()
+
+
+def test_identity_cache_serves_repeat_lookups_and_invalidates():
+    from sqlalchemy.orm import sessionmaker
+    from lib.models.cache import identity_cache
+    url = temp_database_url()
+    try:
+        setup_database(url)
+        engine = get_engine(url)
+        make_session = sessionmaker(bind=engine)
+        writer = make_session()
+        dealership = Dealership.create(writer, "Cairo EV", "Cairo")
+        customer = Customer.create(writer, "Omar Said", "omar@example.com")
+        vehicle = Vehicle.create(writer, "EV Bolt", 30000, dealership.id, customer.id)
+        dealership_id, vehicle_id = dealership.id, vehicle.id
+        before = identity_cache.stats()
+        with count_statements(engine) as statements:
+            assert Dealership.find_by_id(make_session(), dealership_id).name == "Cairo EV"
+        assert statements == [] and identity_cache.stats()['hits'] > before['hits']
+        dealership.name = "Cairo EV Centre"
+        writer.commit()
+        assert Dealership.find_by_id(make_session(), dealership_id).name == "Cairo EV Centre"
+        Vehicle.find_by_id(make_session(), vehicle_id)
+        Vehicle.apply_to_ledger(writer, {vehicle_id: (100.0, 1)})
+        writer.commit()
+        assert Vehicle.find_by_id(make_session(), vehicle_id).total_paid == 100.0
+        assert Vehicle.delete(writer, vehicle_id)
+        assert Vehicle.find_by_id(make_session(), vehicle_id) is None
+        # A repeat lookup in the same session keeps the session's instance and its unflushed edits.
+        editor = make_session()
+        held = Dealership.find_by_id(editor, dealership_id)
+        held.name = "Renamed"
+        assert Dealership.find_by_id(editor, dealership_id) is held and held.name == "Renamed"
+        assert editor.is_modified(held)
+        editor.commit()
+        assert Dealership.find_by_id(make_session(), dealership_id).name == "Renamed"
+    finally:
+        dispose_engines()
+
+
+def test_profile_flag_reports_statements_and_spans():
+    from lib import profiling
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Accra EV", "Accra")
+        Vehicle.create(session, "EV Leaf", 25000, dealership.id)
+        output = os.path.join(tempfile.mkdtemp(), 'profile.json')
+        result = CliRunner().invoke(cli, ['--profile', '--profile-output', output, 'list-vehicles'])
+        assert result.exit_code == 0, result.output
+        assert "Profile:" in result.output and "EV Leaf" in result.output
+        with open(output) as f:
+            data = json.load(f)
+        assert data['statement_count'] >= 1 and data['spans'] == {}
+        assert data['instances_loaded'].get('Vehicle') == 1
+        assert profiling.active() is None
+        profiling.enable()
+        Vehicle.create(session, "EV Zoe", 22000, dealership.id)
+        profiler = profiling.disable()
+        assert profiler.spans['Vehicle.create'].calls == 1
+        assert any(sql.startswith('INSERT INTO vehicles') for sql in profiler.statements)
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_run_script_runs_commands_in_one_session():
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    runner = CliRunner()
+    try:
+        commands = "\n".join([
+            '# fixtures',
+            'create-dealership --name "Kigali EV" --location Kigali',
+            '["create-customer", "--name", "Aline Uwase", "--email", "aline@example.com"]',
+            '{"command": "create-vehicle", "model": "EV Niro", "price": 28000, "dealership": "Kigali EV", "customer_id": 1}',
+            '{"command": "create-payment", "vehicle_id": 1, "customer_id": 1, "amount": 1000}',
+            '{"command": "report balances", "format": "jsonl"}',
+        ])
+        with count_statements(get_engine()) as statements:
+            result = runner.invoke(cli, ['run-script', '-'], input=commands)
+        assert result.exit_code == 0, result.output
+        assert '"outstanding": 27000.0' in result.output and "Ran 5 commands, 5 committed" in result.output
+        assert sum(s.startswith('RELEASE SAVEPOINT') for s in statements) >= 4
+
+        failing = "create-dealership --name Doomed --location Nowhere\nfind-vehicle --id 99\n"
+        result = runner.invoke(cli, ['run-script', '-'], input=failing)
+        assert result.exit_code == 1 and "Stopped at line 2" in result.output, result.output
+        result = runner.invoke(cli, ['run-script', '--on-error', 'continue', '--commit-every', '1', '-'],
+                               input=failing + 'create-dealership --name\n')
+        assert result.exit_code == 1 and "Ran 3 commands, 2 failed, 1 committed" in result.output, result.output
+        session = setup_database()
+        assert [d.name for d in Dealership.get_all(session)] == ["Kigali EV", "Doomed"]
+        assert Vehicle.find_by_id(session, 1).get_total_payments(session) == 1000.0
+        assert runner.invoke(cli, ['find-vehicle', '--id', '99']).exit_code == 1
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_cli_startup_does_not_load_the_orm():
+    import subprocess
+    import sys
+    probe = ("import sys\nfrom lib.cli import main\ntry:\n    main(['--help'])\nexcept SystemExit:\n    pass\n"
+             "print([name for name in sys.modules if name.startswith(('sqlalchemy', 'lib.models'))])")
+    result = subprocess.run([sys.executable, '-c', probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip().endswith('[]'), result.stdout
+
+
+def test_async_api_posts_concurrent_payments():
+    try:
+        import aiosqlite  # noqa: F401
+    except ImportError:
+        print("Skipping async API test: aiosqlite is not installed")
+        return
+    import asyncio
+    from lib.aio import async_session, dispose_async_engines, AsyncDealership, AsyncCustomer, AsyncVehicle
+    url = temp_database_url()
+
+    async def scenario():
+        async with async_session(url) as session:
+            dealership = await AsyncDealership.create(session, "Kampala EV", "Kampala")
+            customer = await AsyncCustomer.create(session, "Grace Namu", "grace@example.com")
+            vehicle = await AsyncVehicle.create(session, "EV Ioniq", 5000, dealership.id, customer.id)
+
+        async def post(amount):
+            async with async_session(url) as session:
+                return await AsyncVehicle.add_payment(session, vehicle.id, amount, customer.id)
+        payments = await asyncio.gather(*(post(10) for _ in range(50)))
+        assert len({payment.id for payment in payments}) == 50
+
+        async with async_session(url) as session:
+            assert await AsyncVehicle.get_total_payments(session, vehicle.id) == 500.0
+            assert (await AsyncVehicle.find_by_id(session, vehicle.id)).model == "EV Ioniq"
+            assert [d.name for d in await AsyncDealership.get_all(session)] == ["Kampala EV"]
+            try:
+                await AsyncVehicle.add_payment(session, vehicle.id, 10, customer.id + 1)
+                assert False, "payment from another customer was accepted"
+            except ValueError as e:
+                assert "Invalid customer ID" in str(e)
+            assert await AsyncDealership.delete(session, 999) is False
+        await dispose_async_engines()
+
+    try:
+        asyncio.run(scenario())
+        session = setup_database(url)
+        assert Vehicle.reconcile_ledger(session, fix=False) == []
+    finally:
+        dispose_engines()
+
+    # A write that finds the database locked by another process backs off without blocking the event loop.
+    import sqlite3
+    import types
+    from lib.models import locking
+    url = temp_database_url()
+    blocking_sleeps = []
+
+    async def contended():
+        blocker = sqlite3.connect(url[len('sqlite:///'):], isolation_level=None)
+        try:
+            async with async_session(url) as session:
+                await AsyncDealership.get_all(session)
+                blocker.execute('BEGIN IMMEDIATE')
+                asyncio.get_running_loop().call_later(0.2, blocker.commit)
+                return await AsyncDealership.create(session, "Gulu EV", "Gulu")
+        finally:
+            blocker.close()
+            await dispose_async_engines()
+
+    os.environ['EV_SQLITE_BUSY_TIMEOUT'] = '0'
+    real_time, locking.time = locking.time, types.SimpleNamespace(sleep=blocking_sleeps.append)
+    try:
+        assert asyncio.run(contended()).name == "Gulu EV" and blocking_sleeps == []
+    finally:
+        locking.time = real_time
+        del os.environ['EV_SQLITE_BUSY_TIMEOUT']
+        dispose_engines()
+
+
+def test_concurrent_writers_neither_lose_nor_overpay():
+    from benchmarks.stress_payments import run
+    result = run(writers=3, payments=20, vehicles=2)
+    assert result['problems'] == [] and result['errors'] == 0, result
+    assert result['posted'] + result['guarded'] == 60 and result['guarded'] > 0, result
+
+
+def test_add_payment_refuses_to_overpay():
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Lusaka EV", "Lusaka")
+        customer = Customer.create(session, "Mwila Banda", "mwila@example.com")
+        vehicle = Vehicle.create(session, "EV Zoe", 1000, dealership.id, customer.id)
+        vehicle.add_payment(session, 600, customer.id)
+        try:
+            vehicle.add_payment(session, 400.01, customer.id)
+            assert False, "overpayment was accepted"
+        except ValueError as e:
+            assert "exceeds remaining balance" in str(e)
+        vehicle.add_payment(session, 400, customer.id)
+        assert vehicle.get_total_payments(session) == 1000.0 and vehicle.payment_count == 2
+        assert Vehicle.find_by_id(setup_database(url), vehicle.id).total_paid == 1000.0
+    finally:
+        dispose_engines()
+
+
+def test_parallel_audit_matches_serial_reconciliation():
+    from datetime import datetime
+    from lib.parallel import audit_fleet
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Dakar EV", "Dakar")
+        owner = Customer.create(session, "Awa Diop", "awa@example.com")
+        other = Customer.create(session, "Moussa Fall", "moussa@example.com")
+        vehicles = [Vehicle.create(session, f"EV {i}", 1000, dealership.id, owner.id if i % 3 else None) for i in range(12)]
+        for vehicle in vehicles[1::3] + vehicles[2::3]:
+            vehicle.add_payment(session, 100, owner.id)
+        # Unsold vehicles take payments from anyone; that isn't an owner mismatch.
+        vehicles[0].add_payment(session, 100, other.id)
+        # A payment from someone other than the owner, and a ledger that drifted.
+        session.execute(Payment.__table__.insert().values(vehicle_id=vehicles[1].id, customer_id=other.id,
+                                                          amount=50, payment_date=datetime.now()))
+        session.execute(Vehicle.__table__.update().where(Vehicle.id == vehicles[2].id).values(total_paid=0))
+        session.commit()
+        expected = Vehicle.reconcile_ledger(session, fix=False)
+        serial, parallel = audit_fleet(session, workers=1), audit_fleet(session, workers=2)
+        for audit in (serial, parallel):
+            assert sorted(audit.drift) == sorted(expected) and len(expected) == 2
+            assert [(vehicle_id, customer_id) for _, vehicle_id, customer_id, _ in audit.owner_mismatches] == [(vehicles[1].id, other.id)]
+            assert [r['payments'] for r in audit.dealership_totals()] == [10]
+            assert [(r['customer_id'], r['vehicles'], r['total_paid']) for r in audit.customer_totals()] == [(owner.id, 8, 850)]
+        # A payment posted between the workers' scan and the rewrite stays in the ledger.
+        vehicles[2].add_payment(session, 200, owner.id)
+        assert [row[0] for row in Vehicle.rewrite_ledger(session, parallel.drift)] == sorted(row[0] for row in expected)
+        assert vehicles[2].get_total_payments(session) == 300 and Vehicle.reconcile_ledger(session, fix=False) == []
+    finally:
+        dispose_engines()
+
+
+def test_money_is_exact_and_float_columns_migrate_to_cents():
+    from decimal import Decimal
+    from sqlalchemy import create_engine
+    from lib import reports
+    url = temp_database_url()
+    legacy = create_engine(url)
+    with legacy.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE dealerships (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, location VARCHAR NOT NULL)')
+        conn.exec_driver_sql('CREATE TABLE customers (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, email VARCHAR NOT NULL)')
+        conn.exec_driver_sql('CREATE TABLE vehicles (id INTEGER PRIMARY KEY, model VARCHAR NOT NULL, price FLOAT NOT NULL, '
+                             'dealership_id INTEGER NOT NULL, customer_id INTEGER, '
+                             'total_paid FLOAT NOT NULL DEFAULT 0, payment_count INTEGER NOT NULL DEFAULT 0)')
+        conn.exec_driver_sql('CREATE TABLE payments (id INTEGER PRIMARY KEY, vehicle_id INTEGER NOT NULL, customer_id INTEGER NOT NULL, '
+                             'amount FLOAT NOT NULL, payment_date DATETIME NOT NULL, status VARCHAR NOT NULL, reference VARCHAR UNIQUE)')
+        conn.exec_driver_sql("INSERT INTO dealerships VALUES (1, 'Lusaka EV', 'Lusaka')")
+        conn.exec_driver_sql("INSERT INTO customers VALUES (1, 'Mwila Banda', 'mwila@example.com')")
+        conn.exec_driver_sql("INSERT INTO vehicles VALUES (1, 'EV Zoe', 0.3, 1, 1, 0.30000000000000004, 2)")
+        conn.exec_driver_sql("INSERT INTO payments VALUES (1, 1, 1, 0.1, '2025-01-01', 'completed', NULL), "
+                             "(2, 1, 1, 0.2, '2025-02-01', 'completed', NULL)")
+        conn.exec_driver_sql('PRAGMA user_version = 4')
+    legacy.dispose()
+    try:
+        session = setup_database(url)
+        vehicle = Vehicle.find_by_id(session, 1)
+        assert (vehicle.price, vehicle.total_paid) == (Decimal('0.30'), Decimal('0.30'))
+        assert vehicle.get_remaining_balance(session) == 0
+        assert [r['status'] for r in reports.vehicle_status(session)] == ['paid']
+        assert Vehicle.reconcile_ledger(session, fix=False) == []
+
+        fresh = Vehicle.create(session, "EV Leaf", 1, 1, 1)
+        for _ in range(10):
+            fresh.add_payment(session, 0.1, 1)
+        assert fresh.get_remaining_balance(session) == Decimal('0.00')
+        try:
+            fresh.add_payment(session, 0.01, 1)
+            assert False, "overpayment by one cent was accepted"
+        except ValueError as e:
+            assert "exceeds remaining balance" in str(e)
+    finally:
+        dispose_engines()
+
+
+def test_search_ranks_prefix_matches_and_follows_writes():
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Nairobi EV Centre", "Nairobi")
+        kofi = Customer.create(session, "Kofi Mensah", "kofi@example.com")
+        ama = Customer.create(session, "Ama Kofi", "ama@kofi.io")
+        Customer.create(session, "Zainab Bello", "zainab@example.com")
+        Vehicle.create(session, "EV Kona Electric", 30000, dealership.id)
+        assert {c.id for c in Customer.search(session, "kof")} == {kofi.id, ama.id}
+        assert [c.id for c in Customer.search(session, "kofi men")] == [kofi.id]
+        ranked = [c.id for c in Customer.search(session, "kofi")]
+        assert [c.id for c in Customer.search(session, "kofi", limit=1) + Customer.search(session, "kofi", limit=1, offset=1)] == ranked
+        assert Customer.search(session, '"AND (') == [] and Customer.search(session, "") == []
+        assert [v.model for v in Vehicle.search(session, "kon")] == ["EV Kona Electric"]
+        assert [d.id for d in Dealership.search(session, "nairob")] == [dealership.id]
+
+        session.execute(Customer.__table__.update().where(Customer.id == kofi.id).values(name="Kwame Mensah"))
+        session.commit()
+        assert [c.id for c in Customer.search(session, "kwame")] == [kofi.id]
+        assert Customer.delete(session, ama.id)
+        assert [c.id for c in Customer.search(session, "ama")] == []
+
+        result = CliRunner().invoke(cli, ['search', 'customers', 'zain', '--format', 'jsonl'])
+        assert result.exit_code == 0, result.output
+        assert [json.loads(line)['name'] for line in result.output.splitlines()] == ["Zainab Bello"]
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_export_writes_columnar_parts_incrementally():
+    try:
+        import numpy as np
+    except ImportError:
+        print("Skipping export test: numpy is not installed")
+        return
+    from lib.export import export, read_manifest
+    url = temp_database_url()
+    out_dir = tempfile.mkdtemp()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Kigali EV", "Kigali")
+        customer = Customer.create(session, "Aline Uwase", "aline@example.com")
+        sold = Vehicle.create(session, "EV Zoe", 12000.5, dealership.id, customer.id)
+        Vehicle.create(session, "EV Leaf", 15000, dealership.id)
+        sold.add_payment(session, 100.25, customer.id)
+        assert export(session, out_dir, fmt='npy', chunk_size=1) == {'dealerships': 1, 'customers': 1, 'vehicles': 2, 'payments': 1}
+        sold.add_payment(session, 50, customer.id)
+        assert export(session, out_dir, fmt='npy') == {'dealerships': 0, 'customers': 0, 'vehicles': 0, 'payments': 1}
+
+        vehicles = os.path.join(out_dir, 'vehicles', 'part-00001')
+        assert np.load(os.path.join(vehicles, 'price_cents.npy'), mmap_mode='r').tolist() == [1200050, 1500000]
+        assert np.load(os.path.join(vehicles, 'customer_id.npy')).tolist() == [customer.id, -1]
+        models = np.load(os.path.join(vehicles, 'model.values.npy'))[np.load(os.path.join(vehicles, 'model.codes.npy'))]
+        assert models.tolist() == ["EV Zoe", "EV Leaf"]
+        amounts = [np.load(os.path.join(out_dir, 'payments', part, 'amount_cents.npy')).tolist() for part in ('part-00001', 'part-00002')]
+        assert amounts == [[10025], [5000]]
+        state = read_manifest(out_dir)['entities']['payments']
+        assert state['rows'] == 2 and len(state['parts']) == 2 and set(state) == {'watermark_id', 'rows', 'parts'}
+        assert export(session, out_dir, entities=['payments'], fmt='npy', full=True) == {'payments': 2}
+    finally:
+        dispose_engines()
+
+
+def test_vectorized_analytics_group_payments():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("Skipping analytics test: numpy is not installed")
+        return
+    from datetime import datetime
+    from decimal import Decimal
+    from lib import analytics
+    from lib.archive import archive_payments
+    from lib.cli import cli
+    url = temp_database_url()
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Abuja EV", "Abuja")
+        ngozi = Customer.create(session, "Ngozi Eze", "ngozi@example.com")
+        tunde = Customer.create(session, "Tunde Bakare", "tunde@example.com")
+        steady = Vehicle.create(session, "EV Ioniq", 1000, dealership.id, ngozi.id)
+        stalled = Vehicle.create(session, "EV Kona", 500, dealership.id, tunde.id)
+        Vehicle.create(session, "EV Zoe", 700, dealership.id)
+        for day, amount in ((datetime(2025, 1, 1), 100), (datetime(2025, 1, 31), 100.5), (datetime(2025, 3, 2), 99.5)):
+            steady.add_payment(session, amount, ngozi.id, day)
+        stalled.add_payment(session, 50, tunde.id, datetime(2024, 12, 1))
+
+        payments, vehicles = analytics.load_payments(session), analytics.load_vehicles(session)
+        assert list(analytics.instalment_intervals(payments)) == [
+            {'vehicle_id': steady.id, 'payments': 3, 'mean_days': 30.0, 'min_days': 30.0, 'max_days': 30.0}]
+        assert [(r['period'], r['payments'], r['revenue']) for r in analytics.revenue_by_period(payments)] == [
+            ('2024-12', 1, Decimal('50.00')), ('2025-01', 2, Decimal('200.50')), ('2025-03', 1, Decimal('99.50'))]
+        assert analytics.running_balances(payments, vehicles).tolist() == [90000, 79950, 70000, 45000]
+        as_of = datetime(2025, 3, 12)
+        assert [r['vehicle_id'] for r in analytics.overdue_vehicles(payments, vehicles, as_of)] == [stalled.id]
+        velocity = {r['customer_id']: r for r in analytics.payment_velocity(payments, vehicles, as_of)}
+        assert velocity[ngozi.id]['paid'] == Decimal('300.00') and velocity[ngozi.id]['outstanding'] == Decimal('700.00')
+        # 300.00 over 70 days is 4.29 a day, so 700.00 takes 164 more days.
+        assert velocity[ngozi.id]['days_to_payoff'] == 164
+        assert [(r['vehicle_id'], r['balance']) for r in analytics.balance_history(payments, vehicles)][-2:] == [
+            (steady.id, Decimal('700.00')), (stalled.id, Decimal('450.00'))]
+
+        # Archived payments still count in every series.
+        stalled.add_payment(session, 450, tunde.id, datetime(2025, 1, 10))
+
+        def series():
+            payments, vehicles = analytics.load_payments(session), analytics.load_vehicles(session)
+            return (list(analytics.instalment_intervals(payments)), list(analytics.revenue_by_period(payments)),
+                    list(analytics.balance_history(payments, vehicles)),
+                    list(analytics.payment_velocity(payments, vehicles, as_of)),
+                    list(analytics.overdue_vehicles(payments, vehicles, as_of)))
+        before = series()
+        assert archive_payments(session, datetime(2025, 2, 1)) == {'vehicles': 1, 'archived': 2}
+        assert series() == before
+        os.environ['EV_DATABASE_URL'] = url
+        try:
+            result = CliRunner().invoke(cli, ['analytics', 'balances', '--format', 'jsonl'])
+        finally:
+            del os.environ['EV_DATABASE_URL']
+        assert [json.loads(line)['balance'] for line in result.output.splitlines()] == [
+            900, 799.5, 700, 450, 0], result.output
+    finally:
+        dispose_engines()
+
+
+def test_deletes_cascade_in_the_database():
+    from datetime import datetime
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import IntegrityError
+    from lib.migrations import foreign_keys, declared_foreign_keys
+    url = temp_database_url()
+    legacy = create_engine(url)
+    with legacy.begin() as conn:
+        # Version 6 tables, whose foreign keys have no ON DELETE action.
+        conn.exec_driver_sql('CREATE TABLE dealerships (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, location VARCHAR NOT NULL)')
+        conn.exec_driver_sql('CREATE TABLE customers (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, email VARCHAR NOT NULL)')
+        conn.exec_driver_sql('CREATE TABLE vehicles (id INTEGER PRIMARY KEY, model VARCHAR NOT NULL, '
+                             'dealership_id INTEGER NOT NULL REFERENCES dealerships (id), '
+                             'customer_id INTEGER REFERENCES customers (id), payment_count INTEGER NOT NULL DEFAULT 0, '
+                             'price_cents INTEGER NOT NULL DEFAULT 0, total_paid_cents INTEGER NOT NULL DEFAULT 0)')
+        conn.exec_driver_sql('CREATE TABLE payments (id INTEGER PRIMARY KEY, vehicle_id INTEGER NOT NULL REFERENCES vehicles (id), '
+                             'customer_id INTEGER NOT NULL REFERENCES customers (id), payment_date DATETIME NOT NULL, '
+                             'status VARCHAR NOT NULL, reference VARCHAR UNIQUE, amount_cents INTEGER NOT NULL DEFAULT 0)')
+        conn.exec_driver_sql("INSERT INTO dealerships VALUES (1, 'Accra EV', 'Accra'), (2, 'Kumasi EV', 'Kumasi')")
+        conn.exec_driver_sql("INSERT INTO customers VALUES (1, 'Yaw Boateng', 'yaw@example.com'), "
+                             "(2, 'Efua Owusu', 'efua@example.com')")
+        conn.exec_driver_sql("INSERT INTO vehicles VALUES (1, 'EV Ioniq', 1, 1, 2, 3000000, 150000), "
+                             "(2, 'EV Ioniq 5', 1, NULL, 0, 3500000, 0), (3, 'EV Kona', 2, 2, 0, 2800000, 0)")
+        conn.exec_driver_sql("INSERT INTO payments VALUES (1, 1, 1, '2025-01-01', 'completed', NULL, 100000), "
+                             "(2, 1, 1, '2025-02-01', 'completed', NULL, 50000)")
+        conn.exec_driver_sql('PRAGMA user_version = 6')
+    legacy.dispose()
+    try:
+        session = setup_database(url)
+        engine = get_engine(url)
+        with engine.connect() as conn:
+            for model in (Vehicle, Payment):
+                assert foreign_keys(conn, model.__tablename__) == declared_foreign_keys(model.__table__)
+        assert [v.id for v in Vehicle.search(session, "ioniq")] == [1, 2]
+
+        try:
+            Customer.delete(session, 1)
+            assert False, "a customer with payments was deleted"
+        except ValueError as e:
+            assert "has payments" in str(e)
+        kona = Vehicle.find_by_id(session, 3)
+        assert Customer.delete(session, 2)
+        assert kona.customer_id is None and Vehicle.find_by_id(session, 3).customer_id is None
+
+        ioniq = Vehicle.find_by_id(session, 1)
+        with count_statements(engine) as statements:
+            assert Dealership.delete_many(session, [1, 999]) == 1
+        assert len([s for s in statements if s.startswith('DELETE')]) == 1
+        assert not any(s.startswith('SELECT') for s in statements)
+        assert ioniq not in session and Vehicle.find_by_id(session, 1) is None
+        assert session.query(Vehicle.id).all() == [(3,)] and session.query(Payment).count() == 0
+        assert Vehicle.search(session, "ioniq") == []
+        assert Customer.delete(session, 1)
+
+        assert Vehicle.delete_many(session, [3]) == 1 and Vehicle.delete(session, 3) is False
+        try:
+            session.execute(Payment.__table__.insert().values(vehicle_id=3, customer_id=1, amount=1,
+                                                               payment_date=datetime(2025, 1, 1), status="completed"))
+            assert False, "a payment for a missing vehicle was inserted"
+        except IntegrityError:
+            session.rollback()
+    finally:
+        dispose_engines()
+
+
+def test_shard_router_routes_by_region_and_fans_out():
+    from lib import reports
+    from lib.cli import cli
+    from lib.sharding import ShardMap, ShardRouter, ID_BLOCK
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'shards.json')
+    with open(path, 'w') as f:
+        json.dump({'shards': {'kenya': {'url': f'sqlite:///{directory}/kenya.db', 'block': 1},
+                              'nigeria': {'url': f'sqlite:///{directory}/nigeria.db', 'block': 2}},
+                   'locations': {'Nairobi': 'kenya', 'Lagos': 'nigeria'}}, f)
+    router = ShardRouter(ShardMap.load(path))
+    os.environ['EV_SHARD_MAP'] = path
+    try:
+        nairobi = Dealership.create(router.for_location("Nairobi"), "Nairobi EV", "Nairobi")
+        lagos = Dealership.create(router.for_location("lagos"), "Lagos EV", "Lagos")
+        assert (nairobi.id, lagos.id) == (ID_BLOCK + 1, 2 * ID_BLOCK + 1)
+        try:
+            router.for_location("Accra")
+            assert False, "a location outside the map was routed"
+        except ValueError as e:
+            assert "No shard" in str(e)
+        wanjiru = Customer.create(router.for_region('kenya'), "Wanjiru Kamau", "wanjiru@example.com")
+        chidi = Customer.create(router.for_region('nigeria'), "Chidi Okeke", "chidi@example.com")
+        leaf = Vehicle.create(router.for_id(nairobi.id), "EV Leaf", 1000, nairobi.id, wanjiru.id)
+        kona = Vehicle.create(router.for_id(lagos.id), "EV Kona", 2000, lagos.id, chidi.id)
+        try:
+            Vehicle.create(router.for_id(lagos.id), "EV Ioniq", 3000, lagos.id, wanjiru.id)
+            assert False, "a vehicle was sold to a customer in another region"
+        except ValueError as e:
+            assert "Invalid customer ID" in str(e)
+        session = router.for_id(leaf.id)
+        Vehicle.find_by_id(session, leaf.id).add_payment(session, 400, wanjiru.id)
+        assert Vehicle.find_by_id(router.for_id(kona.id), kona.id).total_paid == 0
+
+        assert [d.id for d in router.get_all(Dealership)] == [nairobi.id, lagos.id]
+        assert [v.id for v in router.iter_all(Vehicle, batch_size=1, after_id=leaf.id)] == [kona.id]
+        balances = list(router.gather(lambda s: reports.customer_balances(s)))
+        assert [(r['customer_id'], r['outstanding']) for r in balances] == [(wanjiru.id, 600), (chidi.id, 2000)]
+
+        runner = CliRunner()
+        result = runner.invoke(cli, ['create-customer', '--name', 'Thandi Nkosi', '--email', 'thandi@example.com',
+                                     '--region', 'nigeria'])
+        assert result.exit_code == 0 and f"ID: {chidi.id + 1}" in result.output, result.output
+        result = runner.invoke(cli, ['list-customers', '--format', 'jsonl'])
+        assert [json.loads(line)['id'] for line in result.output.splitlines()] == [wanjiru.id, chidi.id, chidi.id + 1]
+        result = runner.invoke(cli, ['create-payment', '--vehicle_id', str(kona.id), '--customer_id', str(chidi.id),
+                                     '--amount', '500'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(cli, ['report', 'balances', '--format', 'jsonl'])
+        assert [json.loads(line)['outstanding'] for line in result.output.splitlines()] == [600, 1500]
+        assert runner.invoke(cli, ['create-customer', '--name', 'Ada', '--email', 'ada@example.com']).exit_code == 1
+
+        result = runner.invoke(cli, ['search', 'customers', 'exam', '--format', 'jsonl'])
+        assert len(result.output.splitlines()) == 3 and str(wanjiru.id) in result.output, result.output
+        result = runner.invoke(cli, ['search', 'customers', 'exam', '--offset', '1', '--limit', '1', '--format', 'jsonl'])
+        assert [json.loads(line)['id'] for line in result.output.splitlines()] == [chidi.id], result.output
+        rows = os.path.join(directory, 'dealerships.csv')
+        with open(rows, 'w') as f:
+            f.write(f"name,location,id\nMombasa EV,Nairobi,\nIkeja EV,Lagos,\nAccra EV,Accra,\nStray EV,Lagos,{ID_BLOCK + 9}\n")
+        result = runner.invoke(cli, ['import', 'dealerships', rows])
+        assert "Imported 2 dealerships (2 rejected)" in result.output, result.output
+        assert "Rejected row 3: No shard" in result.output and "Rejected row 4: ID" in result.output
+        assert [d.id for d in router.get_all(Dealership)] == [nairobi.id, nairobi.id + 1, lagos.id, lagos.id + 1]
+        rows = os.path.join(directory, 'payments.jsonl')
+        with open(rows, 'w') as f:
+            for reference, vehicle, customer in (('KE-1', leaf, wanjiru), ('NG-1', kona, chidi), ('KE-2', leaf, chidi)):
+                f.write(json.dumps({'reference': reference, 'vehicle_id': vehicle.id, 'customer_id': customer.id,
+                                    'amount': 100}) + "\n")
+        result = runner.invoke(cli, ['ingest-payments', rows])
+        assert "Ingested 2 payments, skipped 0 already posted, rejected 1" in result.output, result.output
+        assert "Rejected row 3: Invalid customer ID" in result.output
+        result = runner.invoke(cli, ['report', 'totals', '--format', 'jsonl'])
+        assert [(r['dealership_id'], r['total_paid']) for r in map(json.loads, result.output.splitlines())] == \
+            [(nairobi.id, 500), (lagos.id, 600)], result.output
+        result = runner.invoke(cli, ['reconcile'])
+        assert "0 vehicles with drift fixed" in result.output, result.output
+        result = runner.invoke(cli, ['analytics', 'revenue', '--period', 'year', '--format', 'jsonl'])
+        assert sum(json.loads(line)['payments'] for line in result.output.splitlines()) == 4, result.output
+        result = runner.invoke(cli, ['export', os.path.join(directory, 'export'), '--entity', 'payments'])
+        assert "kenya payments: 2 new rows" in result.output and "Exported 4 rows" in result.output, result.output
+    finally:
+        del os.environ['EV_SHARD_MAP']
+        router.close()
+        dispose_engines()
+
+
+def test_archive_moves_settled_payments_and_keeps_totals():
+    from datetime import datetime
+    from lib import reports
+    from lib.archive import archive_payments
+    from lib.changes import iter_changes
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Kigali EV", "Kigali")
+        paid_up = Customer.create(session, "Aline Uwase", "aline@example.com")
+        paying = Customer.create(session, "Eric Mugisha", "eric@example.com")
+        settled = Vehicle.create(session, "EV Leaf", 1000, dealership.id, paid_up.id)
+        owing = Vehicle.create(session, "EV Kona", 1000, dealership.id, paying.id)
+        paying_id, owing_id, dealership_id = paying.id, owing.id, dealership.id
+        rows = [
+            {'reference': 'RW-1', 'vehicle_id': settled.id, 'customer_id': paid_up.id, 'amount': 400, 'payment_date': '2023-01-05'},
+            {'reference': 'RW-2', 'vehicle_id': settled.id, 'customer_id': paid_up.id, 'amount': 500, 'payment_date': '2023-03-05'},
+            {'reference': 'RW-3', 'vehicle_id': settled.id, 'customer_id': paid_up.id, 'amount': 100, 'payment_date': '2024-02-01'},
+            {'reference': 'RW-4', 'vehicle_id': owing.id, 'customer_id': paying.id, 'amount': 300, 'payment_date': '2023-01-05'},
+        ]
+        assert Payment.bulk_ingest(session, rows)['inserted'] == 4
+
+        assert archive_payments(session, datetime(2024, 1, 1), batch_size=1) == {'vehicles': 1, 'archived': 2}
+        assert archive_payments(session, datetime(2024, 1, 1)) == {'vehicles': 0, 'archived': 0}
+        assert [c['op'] for c in iter_changes(session, entities=['payments'])] == ['insert'] * 4 + ['archive'] * 2
+        assert settled.get_total_payments(session) == 1000 and Vehicle.reconcile_ledger(session, fix=False) == []
+        assert [p.reference for p in settled.get_payments(session)] == ['RW-3']
+        assert [p.reference for p in settled.get_payments(session, include_archived=True)] == ['RW-1', 'RW-2', 'RW-3']
+        assert [p.reference for p in settled.get_payments(session, datetime(2023, 2, 1), datetime(2024, 1, 1),
+                                                          include_archived=True)] == ['RW-2']
+        assert [p.reference for p in owing.get_payments(session)] == ['RW-4']
+        assert [r['payments'] for r in reports.dealership_revenue(session)] == [1, 1]
+        assert [r['payments'] for r in reports.dealership_revenue(session, include_archived=True)] == [2, 1, 1]
+        assert Payment.bulk_ingest(session, rows[:1])['duplicates'] == ['RW-1']
+        try:
+            Customer.delete(session, paid_up.id)
+            assert False, "a customer with archived payments was deleted"
+        except ValueError as e:
+            assert "has payments on record" in str(e)
+
+        result = CliRunner().invoke(cli, ['list-vehicle-payments', '--vehicle_id', str(settled.id), '--include-archived',
+                                          '--until', '2024-01-01'])
+        assert result.exit_code == 0 and result.output.count("Payment ID") == 2, result.output
+        assert "Total Paid: $1000.00" in result.output
+        assert CliRunner().invoke(cli, ['archive', '--before', '2024-01-01']).exit_code == 0
+        Vehicle.delete(session, settled.id)
+        assert Vehicle.reconcile_ledger(session, fix=False) == []
+        # The vehicle's archived payments went with it, so its owner can now be deleted.
+        assert Customer.delete(session, paid_up.id)
+        # So do a dealership's, with its vehicles.
+        Vehicle.find_by_id(session, owing_id).add_payment(session, 700, paying_id)
+        assert archive_payments(session, datetime(2025, 1, 1)) == {'vehicles': 1, 'archived': 1}
+        assert Dealership.delete(session, dealership_id) and Customer.delete(session, paying_id)
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+def test_http_api_streams_pages_and_revalidates():
+    import http.client
+    import threading
+    from lib.server import ApiServer
+    url = temp_database_url()
+    server = ApiServer(('127.0.0.1', 0), url)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+    def call(method, path, body=None, headers=None):
+        connection.request(method, path, body=None if body is None else json.dumps(body), headers=headers or {})
+        response = connection.getresponse()
+        return response, response.read().decode()
+
+    try:
+        response, body = call('POST', '/dealerships', {'name': "Accra EV", 'location': "Accra"})
+        assert response.status == 201, body
+        dealership = json.loads(body)
+        customer = json.loads(call('POST', '/customers', {'name': "Ama Owusu", 'email': "ama@example.com"})[1])
+        vehicles = [json.loads(call('POST', '/vehicles', {'model': f"EV {n}", 'price': 1000.10,
+                                                          'dealership_id': dealership['id'],
+                                                          'customer_id': customer['id']})[1]) for n in range(3)]
+        assert vehicles[0]['price'] == 1000.1
+
+        response, body = call('GET', '/vehicles?limit=2')
+        assert response.getheader('Content-Type') == 'application/x-ndjson'
+        assert [json.loads(line)['id'] for line in body.splitlines()] == [vehicles[0]['id'], vehicles[1]['id']]
+        assert response.getheader('Link') == f'</vehicles?after={vehicles[1]["id"]}&limit=2>; rel="next"'
+        response, body = call('GET', f'/vehicles?after={vehicles[1]["id"]}&limit=2')
+        assert len(body.splitlines()) == 1 and response.getheader('Link') is None
+
+        response, body = call('POST', f'/vehicles/{vehicles[0]["id"]}/payments', {'amount': 400.05, 'customer_id': customer['id']})
+        assert response.status == 201 and json.loads(body)['amount'] == 400.05, body
+        response, body = call('POST', f'/vehicles/{vehicles[0]["id"]}/payments', {'amount': 700, 'customer_id': customer['id']})
+        assert response.status == 400 and "exceeds remaining balance" in json.loads(body)['error']
+        assert json.loads(call('GET', f'/vehicles/{vehicles[0]["id"]}/balance')[1])['remaining_balance'] == 600.05
+        assert len(call('GET', f'/vehicles/{vehicles[0]["id"]}/payments')[1].splitlines()) == 1
+
+        response, body = call('GET', f'/dealerships/{dealership["id"]}')
+        tag = response.getheader('ETag')
+        assert json.loads(body) == dealership and tag
+        response, body = call('GET', f'/dealerships/{dealership["id"]}', headers={'If-None-Match': tag})
+        assert response.status == 304 and body == ''
+        assert call('GET', '/dealerships/999')[0].status == 404
+        assert call('DELETE', '/dealerships')[0].status == 501
+        assert call('POST', '/vehicles/1/balance', {})[0].status == 405
+        assert call('POST', '/customers', {'name': "No Email"})[0].status == 400
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+        dispose_engines()
+
+
+def test_change_log_feeds_every_write_in_order():
+    from itertools import islice
+    from lib.changes import iter_changes
+    from lib.cli import cli
+    url = temp_database_url()
+    os.environ['EV_DATABASE_URL'] = url
+    try:
+        session = setup_database(url)
+        dealership = Dealership.create(session, "Kampala EV", "Kampala")
+        customer = Customer.create(session, "Okello James", "okello@example.com")
+        vehicle = Vehicle.create(session, "EV Niro", 1000, dealership.id, customer.id)
+        vehicle.add_payment(session, 250, customer.id)
+        changes = list(iter_changes(session, batch_size=2))
+        assert [(c['entity'], c['op']) for c in changes] == [
+            ('dealerships', 'insert'), ('customers', 'insert'), ('vehicles', 'insert'),
+            ('vehicles', 'update'), ('payments', 'insert')]
+        assert [c['seq'] for c in changes] == sorted(c['seq'] for c in changes)
+        assert changes[3]['data']['total_paid_cents'] == 25000 and changes[4]['data']['amount_cents'] == 25000
+        last = changes[-1]['seq']
+
+        dealership_id, vehicle_id = dealership.id, vehicle.id
+        Dealership.delete(session, dealership_id)
+        later = list(iter_changes(session, since=last))
+        assert [(c['entity'], c['op'], c['row_id']) for c in later] == [
+            ('payments', 'delete', changes[4]['row_id']), ('vehicles', 'delete', vehicle_id),
+            ('dealerships', 'delete', dealership_id)]
+        assert [c['entity'] for c in iter_changes(session, since=last, entities=['vehicles'])] == ['vehicles']
+
+        feed = iter_changes(session, since=later[-1]['seq'], follow=True, poll_interval=0.01)
+        Customer.create(session, "Nakato Grace", "nakato@example.com")
+        assert next(feed)['data']['email'] == "nakato@example.com"
+        feed.close()
+
+        result = CliRunner().invoke(cli, ['changes', '--since', str(last), '--entity', 'dealerships'])
+        assert result.exit_code == 0, result.output
+        assert [json.loads(line)['op'] for line in result.output.splitlines()] == ['delete']
+        assert list(islice(iter_changes(session, since=10 ** 6), 1)) == []
+    finally:
+        del os.environ['EV_DATABASE_URL']
+        dispose_engines()
+
+
+if __name__ == '__main__':
+    test_shared_engine_and_schema_version()
+    test_listing_statement_count_is_constant()
+    test_keyset_listing_streams_in_batches()
+    test_bulk_import_validates_and_batches()
+    test_migration_adds_indexes_to_existing_database()
+    test_migration_upgrades_the_checked_in_database()
+    test_payment_ledger_tracks_postings_and_reconciles()
+    test_reports_aggregate_in_one_statement()
+    test_bulk_ingest_is_idempotent_and_guards_balance()
+    test_identity_cache_serves_repeat_lookups_and_invalidates()
+    test_profile_flag_reports_statements_and_spans()
+    test_run_script_runs_commands_in_one_session()
+    test_cli_startup_does_not_load_the_orm()
+    test_async_api_posts_concurrent_payments()
+    test_concurrent_writers_neither_lose_nor_overpay()
+    test_add_payment_refuses_to_overpay()
+    test_parallel_audit_matches_serial_reconciliation()
+    test_money_is_exact_and_float_columns_migrate_to_cents()
+    test_search_ranks_prefix_matches_and_follows_writes()
+    test_export_writes_columnar_parts_incrementally()
+    test_vectorized_analytics_group_payments()
+    test_deletes_cascade_in_the_database()
+    test_shard_router_routes_by_region_and_fans_out()
+    test_archive_moves_settled_payments_and_keeps_totals()
+    test_http_api_streams_pages_and_revalidates()
+    test_change_log_feeds_every_write_in_order()
+    print("All tests passed")